@@ -56,19 +56,28 @@ const pubSub = () => {
 };
 const pub_sub = pubSub();
 
+// The newest reading fetched so far, for the live stream to start after.
+let last_reading_id: string | null = null;
+
 async function getData(): Promise<GraphData> {
   // Fetch the data, set the global variable, and call "publish" to notify subscribers
   console.log("start of getData()");
   const now = new Date();
   const one_day_ago = new Date(+now - 24 * 60 * 60 * 1000);
   const url = encodeURI(
-    `/api/readings/?fields=device_name,mac,timestamp,temperature,humidity&timestamp__gt=${one_day_ago.toISOString()}&ordering=timestamp&limit=2000`,
+    `/api/readings/?fields=url,device_name,mac,timestamp,temperature,humidity&timestamp__gt=${one_day_ago.toISOString()}&ordering=timestamp&limit=2000`,
   );
   const data = await fetch(url).then((response) => response.json()!);
   const temperature_series_data = new Map();
   const humidity_series_data = new Map();
 
   for (const reading of data.results) {
+    // The id ends the reading's url. Ids are UUIDv7s in lowercase hex, so
+    // they sort as strings.
+    const id = reading.url.split("/").at(-2);
+    if (last_reading_id === null || id > last_reading_id) {
+      last_reading_id = id;
+    }
     if (reading.temperature === null) {
       continue;
     }
@@ -153,12 +162,96 @@ const defaultOption: EChartsOption = {
   },
 };
 
+const window_ms = 24 * 60 * 60 * 1000;
+
+function addPoint(
+  series_data: LineSeriesOption[],
+  name: string,
+  ts: Date,
+  value: number | null,
+) {
+  let series = series_data.find((series) => series.name === name);
+  if (series === undefined) {
+    series = { name: name, type: "line", showSymbol: false, data: [] };
+    series_data.push(series);
+    series_data.sort((a, b) => (a.name < b.name ? -1 : 1));
+  }
+  const data = series.data as { name: string; value: [Date, number] }[];
+  const last = data[data.length - 1];
+  data.push({ name: name, value: [ts, value] });
+  if (last !== undefined && +last.value[0] > +ts) {
+    // A late reading; keep the line in time order.
+    data.sort((a, b) => +a.value[0] - +b.value[0]);
+  }
+}
+
+function applyReadings(readings) {
+  // Merge readings pushed by the live stream into the charts, dropping
+  // points that have scrolled out of the 24h window.
+  if (global_graph_data === null) {
+    return;
+  }
+  for (const reading of readings) {
+    if (reading.temperature === null) {
+      continue;
+    }
+    const name = reading.device_name;
+    const ts = roundToNearestMinutes(reading.timestamp);
+    addPoint(global_graph_data.temperature, name, ts, reading.temperature);
+    addPoint(global_graph_data.humidity, name, ts, reading.humidity);
+  }
+  const cutoff = +new Date() - window_ms;
+  for (const series_data of [
+    global_graph_data.temperature,
+    global_graph_data.humidity,
+  ]) {
+    for (const series of series_data) {
+      const data = series.data as { value: [Date, number] }[];
+      const first = data.findIndex((point) => +point.value[0] >= cutoff);
+      data.splice(0, first === -1 ? data.length : first);
+    }
+  }
+  pub_sub.publish();
+}
+
 // Fetch the data on an interval
 const update_data_interval = 1000 * 300;
-getData();
-setInterval(() => {
-  getData();
-}, update_data_interval);
+
+function startPolling() {
+  setInterval(() => {
+    getData();
+  }, update_data_interval);
+}
+
+function startStream(since: Date) {
+  // Receive new readings as they're ingested instead of re-fetching the
+  // whole window. The server answers 204 when the stream is turned off,
+  // which closes the EventSource for good; poll instead.
+  if (!("EventSource" in window)) {
+    startPolling();
+    return;
+  }
+  // Start after the newest reading getData() drew, so ones that arrived
+  // while it was fetching aren't drawn twice; from when it started if it
+  // found none.
+  const start =
+    last_reading_id !== null
+      ? `after=${encodeURIComponent(last_reading_id)}`
+      : `since=${encodeURIComponent(since.toISOString())}`;
+  const url = `/api/async/readings/stream/?${start}`;
+  const source = new EventSource(url);
+  source.addEventListener("readings", (event) => {
+    applyReadings(JSON.parse(event.data));
+  });
+  source.onerror = () => {
+    if (source.readyState === EventSource.CLOSED) {
+      startPolling();
+    }
+  };
+}
+
+const started = new Date();
+getData().then(() => startStream(started));
 
 const Chart = ({ title, aspect, formatter }) => {
   console.log(`aspect=${aspect}`);
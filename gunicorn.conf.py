@@ -0,0 +1,16 @@
+# Read by gunicorn from the directory it's started in.
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sensors.settings")
+
+
+def on_starting(server):
+    import sensors.metrics
+
+    sensors.metrics.clear()
+
+
+def child_exit(server, worker):
+    import sensors.metrics
+
+    sensors.metrics.retire(worker.pid)
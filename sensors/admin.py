@@ -35,3 +35,17 @@ class DeviceAdmin(admin.ModelAdmin):
         "name",
     )
     list_filter = ("owner",)
+
+
+@admin.register(sensors.models.DeviceState)
+class DeviceStateAdmin(admin.ModelAdmin):
+    list_display = (
+        "owner",
+        "mac",
+        "timestamp",
+        "temperature",
+        "humidity",
+        "battery",
+        "rssi",
+    )
+    list_filter = ("owner",)
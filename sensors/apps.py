@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class SensorsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "sensors"
+
+    def ready(self):
+        # Connect the connection_created handlers.
+        import sensors.metrics
+        import sensors.perf
+        import sensors.sqlite  # noqa: F401
@@ -0,0 +1,358 @@
+"""
+Async versions of the hot API endpoints, mounted under ``/api/async/``.
+
+Served by an ASGI server (see the README), a request that's waiting on a
+slow client or the database doesn't hold a worker. They return the same
+JSON as their DRF counterparts and accept the same session or HTTP Basic
+authentication. DRF views are sync only, so these are plain Django views.
+"""
+
+import base64
+import binascii
+import datetime
+import functools
+import json
+import time
+import uuid
+
+import django.conf
+import django.contrib.auth
+import django.db
+import django.http
+import django.middleware.csrf
+import rest_framework.exceptions
+import rest_framework.fields
+import structlog
+from asgiref.sync import sync_to_async
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+import sensors.buffer
+import sensors.compact
+import sensors.ingest
+import sensors.live
+import sensors.models
+import sensors.serializers
+import sensors.views
+from sensors.uuid7 import uuid7_floor
+
+from . import filters
+
+logger = structlog.get_logger()
+
+MAX_LIMIT = 1000
+
+# The reading fields sent by the live stream.
+STREAM_FIELDS = (
+    "id",
+    "mac",
+    "timestamp",
+    "temperature",
+    "humidity",
+    "battery",
+    "rssi",
+)
+STREAM_KEEPALIVE = 15
+STREAM_RETRY_MS = 5000
+
+
+def _authenticate(request, username, password):
+    try:
+        return django.contrib.auth.authenticate(
+            request, username=username, password=password
+        )
+    finally:
+        # This runs on an executor thread that Django doesn't clean up after.
+        django.db.connection.close()
+
+
+async def _basic_auth_user(request):
+    scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "basic" or not credentials:
+        return None
+    try:
+        username, _, password = (
+            base64.b64decode(credentials).decode("utf-8").partition(":")
+        )
+    except (binascii.Error, UnicodeDecodeError):
+        raise rest_framework.exceptions.AuthenticationFailed(
+            "Invalid basic header. Credentials not correctly base64 encoded."
+        )
+    # Password hashing is slow on purpose, so run it off the request's
+    # thread, where it would hold up every other request in the process.
+    user = await sync_to_async(_authenticate, thread_sensitive=False)(
+        request, username, password
+    )
+    if user is None or not user.is_active:
+        raise rest_framework.exceptions.AuthenticationFailed(
+            "Invalid username/password."
+        )
+    return user
+
+
+def _enforce_csrf(request):
+    # As DRF's SessionAuthentication does: cookie-authenticated writes need
+    # a CSRF token, Basic-authenticated ones don't.
+    check = django.middleware.csrf.CsrfViewMiddleware(lambda request: None)
+    check.process_request(request)
+    reason = check.process_view(request, None, (), {})
+    if reason:
+        raise rest_framework.exceptions.PermissionDenied(
+            f"CSRF Failed: {reason.reason_phrase}"
+        )
+
+
+def api_view(view):
+    """
+    Authenticate the request (HTTP Basic, then session), and render DRF API
+    exceptions as DRF would.
+    """
+
+    @csrf_exempt
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            user = await _basic_auth_user(request)
+            if user is None:
+                user = await request.auser()
+                if not user.is_authenticated:
+                    raise rest_framework.exceptions.NotAuthenticated()
+                if request.method not in ("GET", "HEAD", "OPTIONS"):
+                    _enforce_csrf(request)
+            request.user = user
+            return await view(request, *args, **kwargs)
+        except rest_framework.exceptions.APIException as e:
+            data = (
+                e.detail if isinstance(e.detail, (list, dict)) else {"detail": e.detail}
+            )
+            response = django.http.JsonResponse(data, status=e.status_code, safe=False)
+            if isinstance(e, rest_framework.exceptions.NotAuthenticated):
+                # Basic auth is what gateways use; 401 tells them to send it.
+                response["WWW-Authenticate"] = 'Basic realm="api"'
+            wait = getattr(e, "wait", None)
+            if wait is not None:
+                response["Retry-After"] = str(wait)
+            return response
+
+    return wrapper
+
+
+@require_GET
+@api_view
+async def reading_list(request):
+    """
+    Newest readings first, ``?limit`` (up to ``MAX_LIMIT``) at a time,
+    paged by id with ``?before=<id>``. Takes the same filters and
+    ``?fields`` as ``/api/readings/``.
+    """
+    try:
+        limit = int(
+            request.GET.get("limit", django.conf.settings.REST_FRAMEWORK["PAGE_SIZE"])
+        )
+    except ValueError:
+        raise rest_framework.exceptions.ValidationError({"limit": ["Not a number."]})
+    if not 1 <= limit <= MAX_LIMIT:
+        raise rest_framework.exceptions.ValidationError(
+            {"limit": [f"Must be between 1 and {MAX_LIMIT}."]}
+        )
+    readings = filters.Reading(
+        request.GET,
+        queryset=sensors.models.Reading.objects.filter(owner=request.user),
+    )
+    if not readings.is_valid():
+        raise rest_framework.exceptions.ValidationError(readings.errors)
+    before = request.GET.get("before")
+    if before:
+        try:
+            before = uuid.UUID(before)
+        except ValueError:
+            raise rest_framework.exceptions.ValidationError(
+                {"before": ["Not a valid id."]}
+            )
+
+    rows = sensors.serializers.ReadingRows(request)
+    columns = rows.columns + ([] if "id" in rows.columns else ["id"])
+    if django.conf.settings.SENSORS_COMPACT_READS:
+        page = await sync_to_async(_compact_page)(
+            request.user.id, readings.form.cleaned_data, before, limit, columns
+        )
+    else:
+        queryset = readings.qs.with_device_name().order_by("-id")
+        if before:
+            queryset = queryset.filter(id__lt=before)
+        page = [row async for row in queryset.values_list(*columns)[: limit + 1]]
+    next_url = None
+    if len(page) > limit:
+        page = page[:limit]
+        query = request.GET.copy()
+        query["before"] = str(page[-1][columns.index("id")])
+        next_url = request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+    return django.http.JsonResponse(
+        {"next": next_url, "results": rows.to_representation(page)}
+    )
+
+
+def _compact_page(owner_id, params, before, limit, columns):
+    # reading_list's page, plus one, from the compact layout.
+    compact = sensors.compact.filtered(owner_id, params).order_by("-id")
+    if before:
+        compact = compact.filter(id__lt=before)
+    rows = compact.values_list(*sensors.compact.COLUMNS)[: limit + 1]
+    return sensors.compact.decode_rows(owner_id, rows, columns)
+
+
+@require_GET
+@api_view
+async def reading_aggregate(request):
+    """
+    The same as ``/api/readings/aggregate/``.
+    """
+    query = sensors.serializers.AggregateQuerySerializer(data=request.GET)
+    query.is_valid(raise_exception=True)
+    data = await sync_to_async(sensors.views.aggregate_data)(
+        request.user.id, query.validated_data
+    )
+    return django.http.JsonResponse(data)
+
+
+@require_GET
+@api_view
+async def device_latest(request):
+    """
+    The same as ``/api/devices/latest/``.
+    """
+    states = (
+        sensors.models.DeviceState.objects.filter(owner=request.user)
+        .with_device_name()
+        .order_by("mac")
+    )
+    data = sensors.serializers.DeviceStateSerializer(
+        [state async for state in states], many=True
+    ).data
+    return django.http.JsonResponse(data, safe=False)
+
+
+@require_POST
+@api_view
+async def reading_bulk(request):
+    """
+    The same as ``/api/readings/bulk/``, including buffered mode's 202.
+    """
+    try:
+        data = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise rest_framework.exceptions.ParseError(f"JSON parse error - {e}")
+    rows = sensors.ingest.validate_readings(data)
+    if django.conf.settings.SENSORS_INGEST_BUFFER:
+        buffer = sensors.buffer.get_buffer()
+        ack = await sync_to_async(buffer.submit, thread_sensitive=False)(
+            request.user.id, rows
+        )
+        status = 202
+    else:
+        readings = await sync_to_async(sensors.ingest.save_readings)(
+            request.user.id, rows
+        )
+        ack = sensors.ingest.ack(readings)
+        status = 201
+    logger.info("async ingest", count=ack["count"], buffered=status == 202)
+    return django.http.JsonResponse(ack, status=status)
+
+
+def _stream_rows(owner_id, readings):
+    # Runs in a thread: looking up device names can hit the database.
+    timestamp = rest_framework.fields.DateTimeField().to_representation
+    rows = []
+    for reading in readings:
+        row = {name: getattr(reading, name) for name in STREAM_FIELDS}
+        row["id"] = str(row["id"])
+        row["timestamp"] = timestamp(row["timestamp"])
+        row["device_name"] = sensors.models.get_device_name(owner_id, reading.mac)
+        rows.append(row)
+    return rows
+
+
+def _newer_readings(owner_id, last_id):
+    return list(
+        sensors.models.Reading.objects.filter(owner_id=owner_id, id__gt=last_id)
+        .order_by("id")
+        .only(*STREAM_FIELDS)[:MAX_LIMIT]
+    )
+
+
+def _stream_start(request):
+    last_id = request.headers.get("Last-Event-ID")
+    if last_id:
+        try:
+            return uuid.UUID(last_id)
+        except ValueError:
+            pass
+    after = request.GET.get("after")
+    if after:
+        field = rest_framework.fields.UUIDField()
+        try:
+            return field.to_internal_value(after)
+        except rest_framework.exceptions.ValidationError as e:
+            raise rest_framework.exceptions.ValidationError({"after": e.detail})
+    since = request.GET.get("since")
+    if since:
+        field = rest_framework.fields.DateTimeField()
+        try:
+            return uuid7_floor(field.to_internal_value(since))
+        except rest_framework.exceptions.ValidationError as e:
+            raise rest_framework.exceptions.ValidationError({"since": e.detail})
+    return uuid7_floor(datetime.datetime.now(datetime.timezone.utc))
+
+
+@require_GET
+@api_view
+async def reading_stream(request):
+    """
+    Server-sent events of the user's readings as they're ingested, after
+    ``?after`` (a reading id), from ``?since`` (a timestamp; default now), or
+    after the ``Last-Event-ID`` a reconnecting ``EventSource`` sends. Each ``readings`` event is a JSON
+    list of readings and its id is the last reading's id.
+
+    The stream ends after ``SENSORS_LIVE_STREAM_SECONDS`` and the browser
+    reconnects where it left off. With ``SENSORS_LIVE_STREAM`` off it
+    answers 204, which tells ``EventSource`` not to reconnect.
+    """
+    if not django.conf.settings.SENSORS_LIVE_STREAM:
+        return django.http.HttpResponse(status=204)
+    owner_id = request.user.id
+    last_id = _stream_start(request)
+    subscription = sensors.live.broker.subscribe(owner_id)
+
+    async def events():
+        nonlocal last_id
+        deadline = time.monotonic() + django.conf.settings.SENSORS_LIVE_STREAM_SECONDS
+        # Read from the database whenever ingest in this process says there's
+        # something new, and every STREAM_KEEPALIVE seconds in case another
+        # process ingested. Ids follow commit order, so nothing can commit
+        # behind last_id once it has been sent.
+        woken = True
+        try:
+            yield f"retry: {STREAM_RETRY_MS}\n\n"
+            while time.monotonic() < deadline:
+                subscription.reset()
+                readings = await sync_to_async(_newer_readings)(owner_id, last_id)
+                if readings:
+                    last_id = readings[-1].id
+                    rows = await sync_to_async(_stream_rows)(owner_id, readings)
+                    data = json.dumps(rows, separators=(",", ":"))
+                    yield f"id: {last_id}\nevent: readings\ndata: {data}\n\n"
+                    if len(readings) == MAX_LIMIT:
+                        continue
+                elif not woken:
+                    yield ": keepalive\n\n"
+                woken = await subscription.wait(STREAM_KEEPALIVE)
+        finally:
+            sensors.live.broker.unsubscribe(subscription)
+
+    response = django.http.StreamingHttpResponse(
+        events(), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    # Don't let a proxy (or GZipMiddleware) hold events back.
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,408 @@
+"""
+Buffered ingest with group commit.
+
+With ``SENSORS_INGEST_BUFFER`` on, ingest requests are validated, appended
+to a spool file and queued, and the request returns straight away. One
+writer thread per process then inserts everything queued in a single
+transaction every ``SENSORS_INGEST_FLUSH_MS`` milliseconds, or sooner once
+``SENSORS_INGEST_FLUSH_ROWS`` rows are waiting, so a burst of gateway POSTs
+costs one SQLite commit instead of one each. Readings get their ids in that
+transaction, as they do on the unbuffered paths, so ids follow commit order
+(see ``sensors.ingest.save_readings``); the 202 can't include them.
+
+The spool is what makes this safe across restarts. Each process appends to
+its own segment file under ``SENSORS_INGEST_SPOOL_DIR``, holding an
+exclusive ``flock`` on it, and starts a new segment whenever it takes a
+batch to write. The transaction that writes a segment's readings also adds a
+``SpoolCommit`` row for it, and the file is deleted once it has committed.
+Any segment that isn't locked belongs to a process that died, and is
+replayed by the next writer to start (or ``replay_ingest_spool``), skipping
+whatever its ``SpoolCommit`` rows say already committed.
+
+A batch that fails because the database is locked or busy is retried. One
+that fails any other way is written an entry (request) at a time, and the
+entries that still fail are appended to a file of the segment's name under
+``dead-letter/`` in the spool directory, for someone to look at, rather than
+holding up everything behind them.
+"""
+
+import atexit
+import datetime
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import django.conf
+import django.db
+import rest_framework.exceptions
+import structlog
+
+import sensors.ingest
+import sensors.models
+from sensors.uuid7 import get_uuid7_many
+
+logger = structlog.get_logger()
+
+DEAD_LETTER_DIR = "dead-letter"
+
+
+class Segment:
+    """
+    A spool file, exclusively locked for as long as it's open.
+    """
+
+    def __init__(self, path, file):
+        self.path = path
+        self.file = file
+
+    @classmethod
+    def create(cls, directory):
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f"{os.getpid()}-{uuid.uuid4().hex}.jsonl"
+        # Lock it before it's visible under a name that recovery looks for.
+        tmp = directory / f".{name}.tmp"
+        # Held open, and so locked, until the segment is closed.
+        file = open(tmp, "a")  # noqa: SIM115
+        fcntl.flock(file, fcntl.LOCK_EX)
+        os.rename(tmp, directory / name)
+        return cls(directory / name, file)
+
+    @classmethod
+    def claim(cls, path):
+        """
+        Lock an existing segment, or return ``None`` if a live process holds
+        it (or it has gone).
+        """
+        try:
+            file = open(path)  # noqa: SIM115
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return None
+        return cls(path, file)
+
+    def append(self, entry):
+        self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        # Into the page cache, so it survives the process; fsyncing every
+        # request would cost what the buffer is there to save.
+        self.file.flush()
+
+    def entries(self):
+        self.file.seek(0)
+        for line in self.file:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by a crash mid-write was never acked.
+                continue
+
+    def close(self):
+        self.file.close()
+
+    def remove(self):
+        self.path.unlink(missing_ok=True)
+        self.close()
+
+
+def _spool_entry(owner_id, rows):
+    return {
+        "owner_id": owner_id.hex,
+        "readings": [
+            {**row, "timestamp": row["timestamp"].isoformat()} for row in rows
+        ],
+    }
+
+
+def _rows_from_entry(entry):
+    rows = [
+        {**row, "timestamp": datetime.datetime.fromisoformat(row["timestamp"])}
+        for row in entry["readings"]
+    ]
+    return uuid.UUID(entry["owner_id"]), rows
+
+
+def write_batch(batch, segment=None, entry=None):
+    """
+    Insert ``[(owner_id, rows), ...]`` of cleaned reading dicts, giving them
+    their ids, and update the derived tables, in one transaction. With
+    ``segment`` (a spool segment's name), also record that it, or just its
+    ``entry``th entry, has committed.
+    """
+    by_owner = {}
+    for owner_id, rows in batch:
+        by_owner.setdefault(owner_id, []).extend(rows)
+    with django.db.transaction.atomic():
+        ids = iter(get_uuid7_many(sum(map(len, by_owner.values()))))
+        readings = {
+            owner_id: [
+                sensors.models.Reading(id=next(ids), owner_id=owner_id, **row)
+                for row in rows
+            ]
+            for owner_id, rows in by_owner.items()
+        }
+        sensors.models.Reading.objects.bulk_create(
+            [reading for owner in readings.values() for reading in owner]
+        )
+        for owner_id, owner_readings in readings.items():
+            sensors.ingest.update_derived(owner_id, owner_readings)
+        if segment is not None:
+            sensors.models.SpoolCommit.objects.create(segment=segment, entry=entry)
+
+
+def write_segment(segment, entries, forget=()):
+    """
+    Write the spooled ``entries`` (``(owner_id, rows)`` pairs, in the order
+    they were appended to ``segment``) that haven't committed yet, and
+    delete the ``SpoolCommit`` rows of the segments named in ``forget``.
+    Returns the number of readings inserted.
+
+    Raises ``OperationalError`` if the database is locked or busy, to be
+    retried; entries that fail any other way are dead-lettered.
+    """
+    name = segment.path.name
+    committed = set(
+        sensors.models.SpoolCommit.objects.filter(segment=name).values_list(
+            "entry", flat=True
+        )
+    )
+    if None in committed:
+        return 0
+    todo = [(index, e) for index, e in enumerate(entries) if index not in committed]
+    try:
+        with django.db.transaction.atomic():
+            sensors.models.SpoolCommit.objects.filter(segment__in=forget).delete()
+            write_batch([e for _, e in todo], name)
+        return _count(e for _, e in todo)
+    except django.db.OperationalError:
+        raise
+    except Exception:
+        logger.exception("ingest batch failed, writing it a request at a time")
+
+    inserted = 0
+    for index, e in todo:
+        try:
+            write_batch([e], name, index)
+            inserted += _count([e])
+        except django.db.OperationalError:
+            raise
+        except Exception as error:
+            logger.exception("ingest request failed, dead-lettered", segment=name)
+            dead_letter(segment, e, error)
+            sensors.models.SpoolCommit.objects.create(segment=name, entry=index)
+    return inserted
+
+
+def dead_letter(segment, entry, error):
+    """
+    Append a spooled entry that can't be written, and why, to the segment's
+    dead-letter file.
+    """
+    directory = segment.path.parent / DEAD_LETTER_DIR
+    directory.mkdir(parents=True, exist_ok=True)
+    owner_id, rows = entry
+    line = {**_spool_entry(owner_id, rows), "error": repr(error)}
+    with open(directory / segment.path.name, "a") as f:
+        f.write(json.dumps(line, separators=(",", ":")) + "\n")
+
+
+def _count(entries):
+    return sum(len(rows) for _, rows in entries)
+
+
+def replay_segment(segment):
+    """
+    Insert a dead process's spooled readings that never committed, then
+    delete the segment. Returns the number of readings inserted.
+    """
+    inserted = write_segment(
+        segment, [_rows_from_entry(entry) for entry in segment.entries()]
+    )
+    segment.remove()
+    sensors.models.SpoolCommit.objects.filter(segment=segment.path.name).delete()
+    return inserted
+
+
+def replay_spool(directory):
+    """
+    Replay every unlocked segment in ``directory``, and forget the
+    ``SpoolCommit`` rows of segments that have gone. Returns the number of
+    readings inserted.
+    """
+    # Names read before the directory is listed: a segment that's missing
+    # from the listing was deleted, not yet to be created.
+    names = set(sensors.models.SpoolCommit.objects.values_list("segment", flat=True))
+    paths = sorted(Path(directory).glob("*.jsonl"))
+    sensors.models.SpoolCommit.objects.filter(
+        segment__in=names - {path.name for path in paths}
+    ).delete()
+
+    inserted = 0
+    for path in paths:
+        segment = Segment.claim(path)
+        if segment is None:
+            continue
+        try:
+            count = replay_segment(segment)
+        finally:
+            segment.close()
+        logger.info("replayed ingest spool", path=str(path), count=count)
+        inserted += count
+    return inserted
+
+
+class IngestBuffer:
+    def __init__(self, spool_dir, flush_ms=200, flush_rows=5_000, max_pending=100_000):
+        self.spool_dir = Path(spool_dir)
+        self.flush_interval = flush_ms / 1000
+        self.flush_rows = flush_rows
+        self.max_pending = max_pending
+        self.condition = threading.Condition()
+        self.queue = []
+        self.segment = None
+        # Segments deleted since the last flush.
+        self.removed = []
+        self.pending = 0
+        self.thread = None
+        self.stopping = False
+        self.commits = 0
+
+    def submit(self, owner_id, rows, timeout=1.0):
+        """
+        Spool and queue cleaned reading dicts, returning the ack for them.
+
+        Waits up to ``timeout`` seconds for room if more than ``max_pending``
+        rows are already waiting to be written, then gives up with a 429 so
+        the gateway backs off and retries.
+        """
+        entry = _spool_entry(owner_id, rows)
+        with self.condition:
+            self._start()
+            if not self.condition.wait_for(
+                lambda: (
+                    self.pending + len(rows) <= self.max_pending or not self.pending
+                ),
+                timeout,
+            ):
+                raise rest_framework.exceptions.Throttled(
+                    wait=1, detail="Ingest buffer is full."
+                )
+            if self.segment is None:
+                self.segment = Segment.create(self.spool_dir)
+            self.segment.append(entry)
+            self.queue.append((owner_id, rows))
+            self.pending += len(rows)
+            if self.pending >= self.flush_rows:
+                self.condition.notify_all()
+        # The ids are given when the readings are written.
+        return {"count": len(rows), "first_id": None, "last_id": None}
+
+    def flush(self):
+        """
+        Write whatever is queued now, in the calling thread.
+        """
+        self._flush(self._take(wait=False))
+
+    def drain(self, timeout=None):
+        """
+        Wait up to ``timeout`` seconds for everything submitted so far to be
+        written. Returns whether it was.
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending, timeout)
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+            thread = self.thread
+        if thread is not None:
+            thread.join()
+
+    def stats(self):
+        with self.condition:
+            return {"pending": self.pending, "commits": self.commits}
+
+    def _start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self._run, name="ingest-writer", daemon=True
+            )
+            self.thread.start()
+            atexit.register(self.stop)
+
+    def _take(self, wait=True):
+        with self.condition:
+            if wait:
+                self.condition.wait_for(
+                    lambda: self.stopping or self.pending >= self.flush_rows,
+                    self.flush_interval,
+                )
+            batch, segment = self.queue, self.segment
+            self.queue, self.segment = [], None
+            return batch, segment
+
+    def _flush(self, taken):
+        batch, segment = taken
+        if not batch:
+            return
+        while True:
+            try:
+                write_segment(segment, batch, forget=self.removed)
+                break
+            except (django.db.OperationalError, OSError):
+                # The database is locked or busy, or the disk is full.
+                logger.exception("ingest flush failed", rows=_count(batch))
+                if self.stopping:
+                    # Leave the segment for the next process to replay.
+                    segment.close()
+                    return
+                time.sleep(self.flush_interval)
+        segment.remove()
+        with self.condition:
+            # Its SpoolCommit rows go in the next flush's transaction.
+            self.removed = [segment.path.name]
+            self.pending -= _count(batch)
+            self.commits += 1
+            self.condition.notify_all()
+
+    def _run(self):
+        try:
+            replay_spool(self.spool_dir)
+        except Exception:
+            logger.exception("ingest spool replay failed")
+        while True:
+            self._flush(self._take())
+            with self.condition:
+                if self.stopping and not self.queue:
+                    break
+        try:
+            sensors.models.SpoolCommit.objects.filter(segment__in=self.removed).delete()
+        except django.db.OperationalError:
+            # Replay forgets them instead.
+            logger.exception("ingest spool cleanup failed")
+        django.db.connection.close()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            settings = django.conf.settings
+            _buffer = IngestBuffer(
+                settings.SENSORS_INGEST_SPOOL_DIR,
+                flush_ms=settings.SENSORS_INGEST_FLUSH_MS,
+                flush_rows=settings.SENSORS_INGEST_FLUSH_ROWS,
+                max_pending=settings.SENSORS_INGEST_MAX_PENDING,
+            )
+        return _buffer
@@ -0,0 +1,131 @@
+"""
+Caching of aggregate and chart queries, in Django's default cache.
+
+Bucketed aggregates are cached a block of ``BLOCK_BUCKETS`` whole buckets at
+a time, so overlapping ranges (every viewer's "last 24 hours" a few seconds
+apart) share most of their work; only the partial buckets at either end of
+a range are read each time. Cache keys carry the owner's version from
+``sensors.conditional``:
+
+* A block that ended more than ``SENSORS_CLOSED_RANGE_SECONDS`` ago is
+  keyed on ``User.readings_changed`` only, so it stays put until something
+  rewrites history: an edit, a delete, pruning, or a late reading (see
+  ``sensors.ingest.update_derived``).
+* Any other block, and any whole-range result, is keyed on
+  ``User.readings_version``, so it's superseded as soon as any reading
+  commits, whatever its id.
+
+The version lives in the database rather than the cache, so this stays
+correct with a per-process cache and several workers.
+"""
+
+import datetime
+import hashlib
+import math
+
+import django.conf
+import django.core.cache
+
+import sensors.conditional
+import sensors.metrics
+import sensors.rollups
+import sensors.timeseries
+
+BLOCK_BUCKETS = 100
+
+# Closed blocks don't change, but give their space back eventually.
+CLOSED_TIMEOUT = 7 * 24 * 60 * 60
+OPEN_TIMEOUT = 10 * 60
+
+
+def _key(*parts):
+    return "sensors:" + hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def _datetime(epoch):
+    return datetime.datetime.fromtimestamp(epoch, tz=datetime.timezone.utc)
+
+
+def _closed_before():
+    return datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+        seconds=django.conf.settings.SENSORS_CLOSED_RANGE_SECONDS
+    )
+
+
+def aggregate(owner_id, start, end, bucket, metrics, macs=None):
+    """
+    ``sensors.rollups.aggregate``, with whole buckets read from the cache.
+    """
+    first = -(-math.ceil(start.timestamp()) // bucket) * bucket
+    last = math.floor(end.timestamp()) // bucket * bucket
+    if first >= last:
+        return sensors.rollups.aggregate(
+            owner_id, start, end, bucket, metrics, macs=macs
+        )
+
+    cache = django.core.cache.cache
+    readings_version, changed, _ = sensors.conditional.version(owner_id)
+    closed = _closed_before().timestamp()
+    macs = sorted(macs) if macs else None
+    span = bucket * BLOCK_BUCKETS
+    blocks = {}
+    for block in range(first // span * span, last, span):
+        version = changed if block + span <= closed else readings_version
+        blocks[block] = _key(
+            "aggregate", owner_id, version, bucket, block, metrics, macs
+        )
+    cached = cache.get_many(blocks.values())
+    sensors.metrics.CACHE_REQUESTS.inc(len(cached), cache="aggregate", result="hit")
+    sensors.metrics.CACHE_REQUESTS.inc(
+        len(blocks) - len(cached), cache="aggregate", result="miss"
+    )
+
+    partials = []
+    if start.timestamp() < first:
+        partials += sensors.rollups.aggregate(
+            owner_id, start, _datetime(first), bucket, metrics, macs=macs
+        )
+    for block, key in blocks.items():
+        block_partials = cached.get(key)
+        if block_partials is None:
+            block_partials = list(
+                sensors.rollups.aggregate(
+                    owner_id,
+                    _datetime(block),
+                    _datetime(block + span),
+                    bucket,
+                    metrics,
+                    macs=macs,
+                )
+            )
+            timeout = CLOSED_TIMEOUT if block + span <= closed else OPEN_TIMEOUT
+            cache.set(key, block_partials, timeout)
+        partials += [p for p in block_partials if first <= p["bucket"] < last]
+    if last < end.timestamp():
+        partials += sensors.rollups.aggregate(
+            owner_id, _datetime(last), end, bucket, metrics, macs=macs
+        )
+    return sensors.timeseries.merge_partials(partials, metrics)
+
+
+def decimated_series(owner_id, start, end, metrics, points, macs=None):
+    """
+    ``sensors.timeseries.decimated_series`` of the owner's readings in
+    ``[start, end)``, cached until the range changes.
+    """
+    readings_version, changed, _ = sensors.conditional.version(owner_id)
+    closed = end <= _closed_before()
+    macs = sorted(macs) if macs else None
+    version = changed if closed else readings_version
+    key = _key("series", owner_id, version, start, end, metrics, points, macs)
+    series = django.core.cache.cache.get(key)
+    sensors.metrics.CACHE_REQUESTS.inc(
+        cache="series", result="miss" if series is None else "hit"
+    )
+    if series is None:
+        frame = sensors.timeseries.load_frame(owner_id, start, end, metrics, macs=macs)
+        series = sensors.timeseries.decimated_series(frame, metrics, points)
+        django.core.cache.cache.set(
+            key, series, CLOSED_TIMEOUT if closed else OPEN_TIMEOUT
+        )
+    return series
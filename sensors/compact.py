@@ -0,0 +1,314 @@
+"""
+An optional compact layout for readings.
+
+``sensors_reading`` repeats the owner's UUID, the mac, type and BLE name as
+text on every row, its id as 32 hex characters, its timestamp as a 26
+character string, and every metric as an 8-byte double. ``CompactReading``
+keeps the same readings as a 16-byte id, an integer ``Sensor`` for the
+strings, an integer timestamp in microseconds and small integers for the
+metrics in ``SCALES``, which SQLite stores in one to three bytes.
+
+Scaling is exact for values that are multiples of the scale's step (RuuviTag
+temperatures come in 0.005 °C steps, humidities in 0.0025 %); anything finer
+is rounded. ``compact_readings --report`` counts how many stored values
+would be.
+
+With ``SENSORS_COMPACT_READINGS`` on, ingest, edits, deletes and pruning
+keep it in step with ``sensors_reading``, and ``compact_readings --backfill``
+copies in the readings from before that (it can run while ingest does).
+Once the backfill has finished, ``SENSORS_COMPACT_READS`` serves the
+readings list (sync and async), filtered Parquet downloads, aggregates and
+chart series from this layout instead. Snapshots, rollups and the live
+stream still read ``sensors_reading``.
+"""
+
+import datetime
+
+import django.db
+from django.db import models
+
+import sensors.export
+import sensors.models
+
+# Readings store value * scale, rounded to an integer.
+SCALES = {
+    "temperature": 200,
+    "humidity": 400,
+    "battery": 1000,
+    "rssi": 1,
+}
+
+# Fields that are stored as they are.
+FLOATS = ("gatewayFree", "gatewayLoad")
+
+BATCH_SIZE = 10_000
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+# What ``decode_rows`` takes, from ``values_list``.
+COLUMNS = ("id", "sensor_id", "timestamp", *FLOATS, *SCALES)
+
+
+def _scaled(value, scale):
+    return None if value is None else round(value * scale)
+
+
+def _unscaled(value, scale):
+    return None if value is None else value / scale
+
+
+def _micros(when):
+    return (when - EPOCH) // MICROSECOND
+
+
+def sensor_ids(owner_id, keys):
+    """
+    ``{(mac, type, bleName): sensor id}`` for an owner's ``keys``, creating
+    any sensors that don't exist yet.
+    """
+    keys = set(keys)
+    existing = sensors.models.Sensor.objects.filter(
+        owner_id=owner_id, mac__in={mac for mac, _, _ in keys}
+    )
+
+    def load():
+        return {
+            (mac, type, ble_name): id
+            for id, mac, type, ble_name in existing.values_list(
+                "id", "mac", "type", "bleName"
+            )
+        }
+
+    ids = load()
+    missing = keys - ids.keys()
+    if missing:
+        sensors.models.Sensor.objects.bulk_create(
+            [
+                sensors.models.Sensor(
+                    owner_id=owner_id, mac=mac, type=type, bleName=ble_name
+                )
+                for mac, type, ble_name in missing
+            ],
+            ignore_conflicts=True,
+        )
+        ids = load()
+    return ids
+
+
+def encode(reading, sensor_id):
+    """
+    The ``CompactReading`` for ``reading``.
+    """
+    return sensors.models.CompactReading(
+        id=reading.id,
+        sensor_id=sensor_id,
+        timestamp=_micros(reading.timestamp),
+        **{name: getattr(reading, name) for name in FLOATS},
+        **{
+            name: _scaled(getattr(reading, name), scale)
+            for name, scale in SCALES.items()
+        },
+    )
+
+
+def decode(compact, sensor):
+    """
+    The ``Reading`` that ``compact`` stores, given its ``Sensor``.
+    """
+    return sensors.models.Reading(
+        id=compact.id,
+        owner_id=sensor.owner_id,
+        mac=sensor.mac,
+        type=sensor.type,
+        bleName=sensor.bleName,
+        timestamp=EPOCH + compact.timestamp * MICROSECOND,
+        **{name: getattr(compact, name) for name in FLOATS},
+        **{
+            name: _unscaled(getattr(compact, name), scale)
+            for name, scale in SCALES.items()
+        },
+    )
+
+
+def write(owner_id, readings, replace=False):
+    """
+    Store an owner's ``readings`` in the compact layout too, skipping any
+    already there, or with ``replace``, overwriting them.
+    """
+    ids = sensor_ids(owner_id, [(r.mac, r.type, r.bleName) for r in readings])
+    compact = [encode(r, ids[r.mac, r.type, r.bleName]) for r in readings]
+    if replace:
+        sensors.models.CompactReading.objects.bulk_create(
+            compact,
+            update_conflicts=True,
+            unique_fields=["id"],
+            update_fields=[
+                "sensor",
+                "timestamp",
+                *FLOATS,
+                *SCALES,
+            ],
+        )
+    else:
+        sensors.models.CompactReading.objects.bulk_create(
+            compact, ignore_conflicts=True
+        )
+
+
+def readings(owner_id, macs=None, **timestamps):
+    """
+    An owner's ``CompactReading``s, only for ``macs`` if given, and narrowed
+    by datetime lookups such as ``timestamp__gte=start``.
+    """
+    owner_sensors = sensors.models.Sensor.objects.filter(owner_id=owner_id)
+    if macs:
+        owner_sensors = owner_sensors.filter(mac__in=macs)
+    return sensors.models.CompactReading.objects.filter(
+        sensor__in=owner_sensors,
+        **{lookup: _micros(when) for lookup, when in timestamps.items()},
+    )
+
+
+def filtered(owner_id, data):
+    """
+    ``readings`` narrowed by a valid ``filters.Reading``'s cleaned ``data``.
+    """
+    return readings(
+        owner_id,
+        macs=[data["mac"]] if data.get("mac") else None,
+        **{
+            lookup: data[lookup]
+            for lookup in ("timestamp__gt", "timestamp__lt")
+            if data.get(lookup)
+        },
+    )
+
+
+def decode_rows(owner_id, rows, columns):
+    """
+    Decode an owner's ``values_list(*COLUMNS)`` rows into tuples of
+    ``Reading`` ``columns`` (fields, ``owner_id`` or ``device_name``), as
+    ``Reading`` ``values_list`` rows would have them.
+    """
+    rows = list(rows)
+    sensor_rows = sensors.models.Sensor.objects.in_bulk({row[1] for row in rows})
+    names = {}
+    if "device_name" in columns:
+        names = sensors.models.device_names.prefetch(owner_id)
+    decoded = []
+    for row in rows:
+        values = dict(zip(COLUMNS, row))
+        sensor = sensor_rows[values["sensor_id"]]
+        reading = {
+            "id": values["id"],
+            "owner_id": sensor.owner_id,
+            "mac": sensor.mac,
+            "type": sensor.type,
+            "bleName": sensor.bleName,
+            "device_name": names.get(sensor.mac),
+            "timestamp": EPOCH + values["timestamp"] * MICROSECOND,
+            **{name: values[name] for name in FLOATS},
+            **{name: _unscaled(values[name], scale) for name, scale in SCALES.items()},
+        }
+        decoded.append(tuple(reading[name] for name in columns))
+    return decoded
+
+
+def iter_chunks(owner_id, compact, chunk_size=sensors.export.CHUNK_SIZE):
+    """
+    ``sensors.export.iter_chunks`` for a queryset of an owner's
+    ``CompactReading``s.
+    """
+    compact = compact.order_by("id")
+    last_id = None
+    while True:
+        chunk = compact if last_id is None else compact.filter(id__gt=last_id)
+        rows = list(chunk.values_list(*COLUMNS)[:chunk_size])
+        if not rows:
+            return
+        yield decode_rows(owner_id, rows, sensors.export.READING_SCHEMA.names)
+        last_id = rows[-1][0]
+
+
+def aggregate_readings(owner_id, start, end, bucket, metrics, macs=None):
+    """
+    ``sensors.timeseries.aggregate_readings`` from this layout.
+    """
+    aggregates = {"count": models.Count("id")}
+    for metric in metrics:
+        scale = models.Value(float(SCALES[metric]))
+        aggregates[f"{metric}_count"] = models.Count(metric)
+        aggregates[f"{metric}_sum"] = models.Sum(metric) / scale
+        aggregates[f"{metric}_min"] = models.Min(metric) / scale
+        aggregates[f"{metric}_max"] = models.Max(metric) / scale
+
+    width = models.Value(bucket * 1_000_000)
+    return (
+        readings(owner_id, macs, timestamp__gte=start, timestamp__lt=end)
+        .annotate(bucket=models.F("timestamp") / width * models.Value(bucket))
+        .values("bucket", mac=models.F("sensor__mac"))
+        .annotate(**aggregates)
+        .order_by("mac", "bucket")
+    )
+
+
+def frame_rows(owner_id, start, end, metrics, macs=None):
+    """
+    ``sensors.timeseries.frame_rows`` from this layout, decoded.
+    """
+    rows = (
+        readings(owner_id, macs, timestamp__gte=start, timestamp__lt=end)
+        .order_by("sensor__mac", "timestamp")
+        .values_list("sensor__mac", "timestamp", *metrics)
+    )
+    scales = [SCALES[metric] for metric in metrics]
+    for mac, timestamp, *values in rows:
+        yield (
+            mac,
+            EPOCH + timestamp * MICROSECOND,
+            *map(_unscaled, values, scales),
+        )
+
+
+def backfill(after=None, batch_size=BATCH_SIZE):
+    """
+    Copy readings (with ids after ``after``, if given) into the compact
+    layout, ``batch_size`` at a time in id order, skipping any that are
+    already there.
+
+    Yields the number of readings and the last id in each batch, to resume
+    after.
+    """
+    readings = sensors.models.Reading.objects.order_by("id")
+    while True:
+        if after is not None:
+            batch = list(readings.filter(id__gt=after)[:batch_size])
+        else:
+            batch = list(readings[:batch_size])
+        if not batch:
+            return
+        by_owner = {}
+        for reading in batch:
+            by_owner.setdefault(reading.owner_id, []).append(reading)
+        with django.db.transaction.atomic():
+            for owner_id, owner_readings in by_owner.items():
+                write(owner_id, owner_readings)
+        after = batch[-1].id
+        yield len(batch), after
+
+
+def table_sizes(tables):
+    """
+    ``{name: bytes}`` for each of ``tables`` and their indexes, from SQLite's
+    ``dbstat`` table (which needs SQLite built with it).
+    """
+    with django.db.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT s.name, SUM(s.pgsize) FROM dbstat s "
+            "JOIN sqlite_master m ON m.name = s.name "
+            f"WHERE m.tbl_name IN ({', '.join(['%s'] * len(tables))}) "
+            "GROUP BY s.name ORDER BY m.tbl_name, m.type DESC, s.name",
+            tables,
+        )
+        return dict(cursor.fetchall())
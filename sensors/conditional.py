@@ -0,0 +1,113 @@
+"""
+Conditional GET for reading queries.
+
+Every change to what an owner's reading queries return bumps
+``User.readings_version`` in the transaction that makes it: ingest (see
+``sensors.ingest.update_derived``), and edits, deletes, pruning and device
+renames (``mark_readings_changed``). Reading it versions every reading query
+an owner can make, for the price of one row lookup, so a repeated query with
+nothing new in it gets a 304 instead of being recomputed. A counter rather
+than the newest reading id, because a batch can commit after one with
+higher ids and an id-based validator would never notice it.
+
+A range that ended more than ``SENSORS_CLOSED_RANGE_SECONDS`` ago isn't
+expected to get new readings at all, so those responses may be cached for
+``SENSORS_CLOSED_RANGE_MAX_AGE`` seconds without revalidating. Edits to
+them can take that long to show up.
+"""
+
+import datetime
+import hashlib
+
+import django.conf
+import django.db.models
+import django.utils.cache
+import django.utils.http
+import django.utils.timezone
+
+import sensors.metrics
+import sensors.models
+from sensors.uuid7 import uuid7_datetime
+
+
+def version_query(owner_id):
+    """
+    The query behind ``version``.
+    """
+    newest = (
+        sensors.models.Reading.objects.filter(owner=django.db.models.OuterRef("id"))
+        .order_by("-id")
+        .values("id")[:1]
+    )
+    return (
+        sensors.models.User.objects.filter(id=owner_id)
+        .annotate(newest=django.db.models.Subquery(newest))
+        .values_list("readings_version", "readings_changed", "newest")
+    )
+
+
+def version(owner_id):
+    """
+    The owner's ``readings_version``, ``readings_changed`` and newest
+    reading id (or ``None``).
+    """
+    return version_query(owner_id).get()
+
+
+def validators(request, owner_id, variant=""):
+    """
+    The ETag and Last-Modified datetime for ``request`` by ``owner_id``.
+    ``variant`` distinguishes representations of the same URL, e.g. by the
+    negotiated media type.
+    """
+    readings_version, changed, newest = version(owner_id)
+    key = repr((owner_id, readings_version, request.get_full_path(), variant))
+    etag = f'"{hashlib.sha1(key.encode()).hexdigest()}"'
+    times = [changed]
+    if newest is not None:
+        times.append(uuid7_datetime(newest))
+    return etag, max(filter(None, times), default=None)
+
+
+def is_closed(end):
+    """
+    Whether a range ending at datetime ``end`` (``None`` for open-ended)
+    is over and not expecting any more readings.
+    """
+    if end is None:
+        return False
+    lag = datetime.timedelta(seconds=django.conf.settings.SENSORS_CLOSED_RANGE_SECONDS)
+    return end < django.utils.timezone.now() - lag
+
+
+def respond(request, owner_id, get_response, closed=False, variant=""):
+    """
+    Answer a GET for the owner's readings with a 304 if the client already
+    has the current response, otherwise with ``get_response()``, adding the
+    validators and caching headers to either.
+    """
+    etag, last_modified = validators(request, owner_id, variant)
+    modified = last_modified and int(last_modified.timestamp())
+    response = django.utils.cache.get_conditional_response(
+        request, etag=etag, last_modified=modified
+    )
+    sensors.metrics.CACHE_REQUESTS.inc(
+        cache="conditional", result="miss" if response is None else "hit"
+    )
+    if response is None:
+        response = get_response()
+        if response.status_code != 200:
+            return response
+    response["ETag"] = etag
+    if modified:
+        response["Last-Modified"] = django.utils.http.http_date(modified)
+    if closed:
+        django.utils.cache.patch_cache_control(
+            response,
+            private=True,
+            max_age=django.conf.settings.SENSORS_CLOSED_RANGE_MAX_AGE,
+        )
+    else:
+        django.utils.cache.patch_cache_control(response, private=True, no_cache=True)
+    django.utils.cache.patch_vary_headers(response, ["Accept", "Authorization"])
+    return response
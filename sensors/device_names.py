@@ -0,0 +1,89 @@
+import collections
+import threading
+import time
+
+
+class DeviceNameCache:
+    """
+    Per-process cache of device names keyed by ``(owner_id, mac)``.
+
+    A miss loads the owner's whole ``{mac: name}`` map with ``load`` (one
+    query) and caches every entry, including a ``None`` for the mac that
+    missed, so a page of readings costs at most one query per owner. Entries
+    expire after ``ttl`` seconds, the least recently used are evicted beyond
+    ``maxsize``, and ``invalidate`` drops an owner's entries when one of their
+    devices changes. Invalidation is per process, so ``ttl`` bounds how long
+    other processes can show a stale name.
+    """
+
+    def __init__(self, load, ttl=5, maxsize=4096, clock=time.monotonic):
+        self.load = load
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.generations = collections.Counter()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, owner_id, mac):
+        key = (owner_id, mac)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        names = self.prefetch(owner_id, extra_macs=[mac])
+        return names.get(mac)
+
+    def prefetch(self, owner_id, extra_macs=()):
+        """
+        Load and cache every device name for ``owner_id``, returning the map.
+
+        Macs in ``extra_macs`` that the owner has no device for are cached as
+        ``None``.
+        """
+        with self.lock:
+            generation = self.generations[owner_id]
+        names = self.load(owner_id)
+        with self.lock:
+            if self.generations[owner_id] != generation:
+                # A device changed while we were loading; don't cache a map
+                # that may already be stale.
+                return names
+            expires = self.clock() + self.ttl
+            for mac in extra_macs:
+                self._set((owner_id, mac), (expires, names.get(mac)))
+            for mac, name in names.items():
+                self._set((owner_id, mac), (expires, name))
+        return names
+
+    def invalidate(self, owner_id):
+        with self.lock:
+            self.generations[owner_id] += 1
+            for key in [key for key in self.entries if key[0] == owner_id]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generations.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.entries),
+            }
+
+    def _set(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
@@ -1,3 +1,4 @@
+import django.core.exceptions
 import django_filters
 from . import models
 
@@ -14,3 +15,16 @@ class Reading(django_filters.FilterSet):
         model = models.Reading
         exclude = ["owner"]
         fields = ["mac"]
+
+
+def range_end(params):
+    """
+    The ``timestamp__lt`` in a query's ``params``, or ``None`` if there's no
+    (valid) one.
+    """
+    try:
+        return Reading.base_filters["timestamp__lt"].field.clean(
+            params.get("timestamp__lt")
+        )
+    except django.core.exceptions.ValidationError:
+        return None
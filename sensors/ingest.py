@@ -0,0 +1,306 @@
+"""
+Bulk ingest of readings pushed by the gateways.
+
+Gateways POST JSON arrays of hundreds of readings at a time. Rather than
+running each row through ``ReadingSerializer`` and saving it on its own, the
+batch is validated a column at a time and written with a single
+``bulk_create`` inside one transaction.
+"""
+
+import datetime
+import functools
+import math
+
+import django.conf
+import django.db
+import django.db.models
+import django.utils.dateparse
+import django.utils.timezone
+import rest_framework.exceptions
+
+import sensors.compact
+import sensors.live
+import sensors.metrics
+import sensors.models
+import sensors.rollups
+from sensors.uuid7 import get_uuid7_many
+
+MAX_BATCH_SIZE = 10_000
+
+REQUIRED = "This field is required."
+NOT_NULL = "This field may not be null."
+NOT_BLANK = "This field may not be blank."
+MAX_LENGTH = "Ensure this field has no more than {max_length} characters."
+INVALID_NUMBER = "A valid number is required."
+INVALID_STRING = "Not a valid string."
+INVALID_DATETIME = "Datetime has wrong format."
+
+_MISSING = object()
+
+
+def _string(max_length, required):
+    """
+    A cleaner for a string field. Like the others, it raises ValueError with
+    the field error to report whatever was wrong with the value (including
+    its type), which is what ``validate_readings`` collects per row.
+    """
+
+    def clean(value):
+        if value is _MISSING:
+            if required:
+                raise ValueError(REQUIRED)
+            return None
+        if value is None:
+            if required:
+                raise ValueError(NOT_NULL)
+            return None
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise ValueError(INVALID_STRING)
+        value = str(value).strip()
+        if required and not value:
+            raise ValueError(NOT_BLANK)
+        if len(value) > max_length:
+            raise ValueError(MAX_LENGTH.format(max_length=max_length))
+        return value
+
+    return clean
+
+
+def _float(value):
+    if value is _MISSING or value is None:
+        return None
+    if isinstance(value, str) and len(value) > 1000:
+        raise ValueError(INVALID_NUMBER)
+    try:
+        value = float(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(INVALID_NUMBER)
+    if math.isnan(value) or math.isinf(value):
+        raise ValueError(INVALID_NUMBER)
+    return value
+
+
+def _datetime(value):
+    """
+    Clean an aware datetime, raising ValueError for a value that isn't a
+    string too, as ``validate_readings`` collects them.
+    """
+    if value is _MISSING:
+        raise ValueError(REQUIRED)
+    if value is None:
+        raise ValueError(NOT_NULL)
+    if not isinstance(value, str):
+        raise ValueError(INVALID_DATETIME)
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        parsed = django.utils.dateparse.parse_datetime(value)
+        if parsed is None:
+            raise ValueError(INVALID_DATETIME)
+    if django.utils.timezone.is_naive(parsed):
+        parsed = django.utils.timezone.make_aware(parsed)
+    return parsed
+
+
+# Writable Reading fields, in model order, and how to clean each column.
+COLUMNS = {
+    "gatewayFree": _float,
+    "gatewayLoad": _float,
+    "mac": _string(20, required=True),
+    "timestamp": _datetime,
+    "type": _string(20, required=True),
+    "bleName": _string(20, required=False),
+    "battery": _float,
+    "humidity": _float,
+    "temperature": _float,
+    "rssi": _float,
+}
+
+
+def validate_readings(rows):
+    """
+    Validate a batch of raw reading dicts, one column at a time.
+
+    Returns a list of cleaned dicts suitable for ``Reading(**row)``. Raises a
+    ``ValidationError`` shaped like the one a ``many=True`` serializer would
+    raise: one dict of field errors per input row.
+    """
+    if not isinstance(rows, list):
+        raise rest_framework.exceptions.ValidationError(
+            {
+                "non_field_errors": [
+                    f'Expected a list of items but got type "{type(rows).__name__}".'
+                ]
+            }
+        )
+    if len(rows) > MAX_BATCH_SIZE:
+        raise rest_framework.exceptions.ValidationError(
+            {
+                "non_field_errors": [
+                    f"Ensure this field has no more than {MAX_BATCH_SIZE} elements."
+                ]
+            }
+        )
+
+    errors = [{} for _ in rows]
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors[index]["non_field_errors"] = [
+                f"Invalid data. Expected a dictionary, but got {type(row).__name__}."
+            ]
+    valid = [not e for e in errors]
+
+    columns = {}
+    for name, clean in COLUMNS.items():
+        column = []
+        for index, row in enumerate(rows):
+            if not valid[index]:
+                column.append(None)
+                continue
+            try:
+                column.append(clean(row.get(name, _MISSING)))
+            except ValueError as e:
+                errors[index][name] = [str(e)]
+                column.append(None)
+        columns[name] = column
+
+    if any(errors):
+        raise rest_framework.exceptions.ValidationError(errors)
+
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
+def save_readings(owner_id, rows):
+    """
+    Insert cleaned reading dicts for one owner in a single transaction.
+
+    Returns the list of created ``Reading`` instances, in input order.
+
+    The ids are generated inside the transaction. SQLite transactions here
+    begin ``IMMEDIATE``, taking the write lock, so ids follow commit order:
+    once a reading has committed, every reading that commits after it has a
+    higher id. Snapshots and the live stream rely on that. (It assumes the
+    processes sharing the database share a clock that doesn't step back.)
+    """
+    with django.db.transaction.atomic():
+        ids = get_uuid7_many(len(rows))
+        readings = [
+            sensors.models.Reading(id=id, owner_id=owner_id, **row)
+            for id, row in zip(ids, rows)
+        ]
+        sensors.models.Reading.objects.bulk_create(readings)
+        update_derived(owner_id, readings)
+    return readings
+
+
+def update_derived(owner_id, readings):
+    """
+    Bring the tables derived from readings up to date with newly inserted
+    ``readings``, bump the owner's ``readings_version``, and tell live
+    streams once they commit. Call it inside the transaction that inserted
+    them.
+    """
+    update_device_states(owner_id, readings)
+    sensors.rollups.update_rollups(owner_id, readings)
+    if django.conf.settings.SENSORS_COMPACT_READINGS:
+        sensors.compact.write(owner_id, readings)
+    closed = django.utils.timezone.now() - datetime.timedelta(
+        seconds=django.conf.settings.SENSORS_CLOSED_RANGE_SECONDS
+    )
+    if any(reading.timestamp < closed for reading in readings):
+        # Late enough to land in ranges that are treated as closed.
+        sensors.models.mark_readings_changed([owner_id], rewritten=False)
+    else:
+        sensors.models.User.objects.filter(id=owner_id).update(
+            readings_version=django.db.models.F("readings_version") + 1
+        )
+    django.db.transaction.on_commit(
+        functools.partial(sensors.live.broker.publish, owner_id)
+    )
+    django.db.transaction.on_commit(functools.partial(_count, len(readings)))
+
+
+def _count(readings):
+    sensors.metrics.INGESTED_READINGS.inc(readings)
+    sensors.metrics.INGEST_BATCH_READINGS.observe(readings)
+
+
+def update_device_states(owner_id, readings):
+    """
+    Record the newest of ``readings`` per mac as that device's state, unless
+    the stored state is newer still.
+    """
+    latest = {}
+    for reading in readings:
+        current = latest.get(reading.mac)
+        if current is None or (reading.timestamp, reading.id) > (
+            current.timestamp,
+            current.id,
+        ):
+            latest[reading.mac] = reading
+    if not latest:
+        return
+
+    stored = sensors.models.DeviceState.objects.filter(
+        owner_id=owner_id, mac__in=latest.keys()
+    ).values_list("mac", "timestamp", "reading_id")
+    for mac, timestamp, reading_id in stored:
+        if (timestamp, reading_id) >= (latest[mac].timestamp, latest[mac].id):
+            del latest[mac]
+
+    fields = sensors.models.DeviceState.READING_FIELDS
+    sensors.models.DeviceState.objects.bulk_create(
+        [
+            sensors.models.DeviceState(
+                owner_id=owner_id,
+                mac=mac,
+                reading_id=reading.id,
+                **{field: getattr(reading, field) for field in fields},
+            )
+            for mac, reading in latest.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["owner", "mac"],
+        update_fields=["reading_id", *fields],
+    )
+
+
+def refresh_device_state(owner_id, mac):
+    """
+    Recompute a device's state from its newest remaining reading, after one
+    of its readings was edited or deleted, or drop it if none remain.
+    """
+    reading = (
+        sensors.models.Reading.objects.filter(owner_id=owner_id, mac=mac)
+        .order_by("-timestamp", "-id")
+        .first()
+    )
+    if reading is None:
+        sensors.models.DeviceState.objects.filter(owner_id=owner_id, mac=mac).delete()
+        return
+    fields = sensors.models.DeviceState.READING_FIELDS
+    sensors.models.DeviceState.objects.update_or_create(
+        owner_id=owner_id,
+        mac=mac,
+        defaults={
+            "reading_id": reading.id,
+            **{field: getattr(reading, field) for field in fields},
+        },
+    )
+
+
+def ingest_readings(owner_id, rows):
+    """
+    Validate and save a batch of raw reading dicts, returning a compact ack.
+    """
+    readings = save_readings(owner_id, validate_readings(rows))
+    return ack(readings)
+
+
+def ack(readings):
+    return {
+        "count": len(readings),
+        "first_id": str(readings[0].id) if readings else None,
+        "last_id": str(readings[-1].id) if readings else None,
+    }
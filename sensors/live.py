@@ -0,0 +1,85 @@
+"""
+In-process notification of newly ingested readings, for the live stream.
+
+Ingest publishes the owner once each batch's transaction commits.
+Subscribers are streaming responses running on an event loop, woken with
+``call_soon_threadsafe`` because publishing happens on whichever thread did
+the ingest. A wakeup only tells the stream to look: it reads the readings
+themselves from the database, after the last one it sent, so what it sends
+never depends on which process ingested them. Subscribers only hear about
+batches ingested by their own process, so the stream also looks now and
+then without being woken.
+"""
+
+import asyncio
+import collections
+import threading
+
+
+class Subscription:
+    def __init__(self, owner_id):
+        self.owner_id = owner_id
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+
+    def notify(self):
+        # Called from the publishing thread.
+        try:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+        except RuntimeError:
+            # The loop has closed; the stream is going away.
+            pass
+
+    async def wait(self, timeout):
+        """
+        Wait up to ``timeout`` seconds for something to be published since
+        the last ``reset``. Returns whether anything was.
+        """
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def reset(self):
+        self.wakeup.clear()
+
+
+class Broker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = collections.defaultdict(set)
+
+    def subscribe(self, owner_id):
+        """
+        Subscribe to an owner's readings. Call it on the event loop that
+        will wait for them.
+        """
+        subscription = Subscription(owner_id)
+        with self.lock:
+            self.subscriptions[owner_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.owner_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.owner_id]
+
+    def publish(self, owner_id):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(owner_id, ()))
+        for subscription in subscriptions:
+            subscription.notify()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "owners": len(self.subscriptions),
+                "subscriptions": sum(map(len, self.subscriptions.values())),
+            }
+
+
+broker = Broker()
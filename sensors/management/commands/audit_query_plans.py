@@ -0,0 +1,174 @@
+import datetime
+import re
+
+import django.db
+from django.core.management.base import BaseCommand, CommandError
+
+import sensors.conditional
+import sensors.models
+import sensors.rollups
+import sensors.timeseries
+from sensors.uuid7 import uuid7_floor
+
+# Plan steps that read a whole table or index, or sort rows after reading
+# them.
+FULL_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW)")
+TEMP_BTREE = re.compile(r"USE TEMP B-TREE")
+
+
+def hot_queries(owner_id, mac, now):
+    """
+    ``{name: (queryset, expect, allowed)}``: the queries the API and
+    dashboard run most, built the way the code builds them. The plan must
+    have a step containing ``expect`` (the index constraints the query
+    relies on), and ``allowed`` lists steps that would otherwise be flagged,
+    and why.
+    """
+    day = now - datetime.timedelta(days=1)
+    readings = sensors.models.Reading.objects.filter(owner_id=owner_id)
+    listed = readings.with_device_name().order_by("-id")
+    buckets = {
+        # The bucket is computed from the timestamp, which SQLite can't
+        # group by from an index; it's one range's rows per request.
+        "USE TEMP B-TREE FOR GROUP BY": "grouping by computed bucket",
+        "USE TEMP B-TREE FOR ORDER BY": "ordering by computed bucket",
+    }
+    hour = sensors.rollups.HOUR
+    first = int(day.timestamp()) // hour * hour
+    return {
+        # Newest first, walking the (owner, id) index; with a mac, skipping
+        # other devices' readings on the way.
+        "list": (listed[:100], "(owner_id=?)", {}),
+        "list, keyset page": (
+            listed.filter(id__lt=uuid7_floor(day))[:100],
+            "(owner_id=? AND id<?)",
+            {},
+        ),
+        "list by mac": (listed.filter(mac=mac)[:100], "(owner_id=?)", {}),
+        "list by time range": (
+            listed.filter(timestamp__gt=day, timestamp__lt=now).order_by("timestamp")[
+                :2000
+            ],
+            "(owner_id=? AND timestamp>? AND timestamp<?)",
+            {},
+        ),
+        "conditional GET version": (
+            sensors.conditional.version_query(owner_id),
+            "COVERING INDEX",
+            {},
+        ),
+        "latest per device": (
+            sensors.models.DeviceState.objects.filter(owner_id=owner_id)
+            .with_device_name()
+            .order_by("mac"),
+            "(owner_id=?)",
+            {},
+        ),
+        "aggregate edges": (
+            sensors.timeseries.aggregate_readings(
+                owner_id, day, now, 300, sensors.timeseries.METRICS
+            ),
+            "(owner_id=? AND timestamp>? AND timestamp<?)",
+            buckets,
+        ),
+        "aggregate edges by mac": (
+            sensors.timeseries.aggregate_readings(
+                owner_id, day, now, 300, sensors.timeseries.METRICS, macs=[mac]
+            ),
+            "(owner_id=? AND mac=? AND timestamp>? AND timestamp<?)",
+            buckets,
+        ),
+        "aggregate rollups": (
+            sensors.rollups.rollup_rows(
+                owner_id,
+                hour,
+                first,
+                first + 24 * hour,
+                hour,
+                sensors.timeseries.METRICS,
+            ),
+            "(owner_id=? AND period=? AND bucket>? AND bucket<?)",
+            buckets,
+        ),
+        "chart series": (
+            sensors.timeseries.frame_rows(
+                owner_id, day, now, ["temperature"], macs=[mac]
+            ),
+            "(owner_id=? AND mac=? AND timestamp>? AND timestamp<?)",
+            {},
+        ),
+        "prune batch": (
+            sensors.models.Reading.objects.filter(id__lt=uuid7_floor(day))
+            .order_by("id")
+            .values_list("id", flat=True)[:10_000],
+            "(id<?)",
+            {},
+        ),
+    }
+
+
+def explain(queryset):
+    """
+    ``EXPLAIN QUERY PLAN`` of a queryset, as a list of plan steps.
+    """
+    sql, params = queryset.query.sql_with_params()
+    connection = django.db.connections[queryset.db]
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [detail for _, _, _, detail in cursor.fetchall()]
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN the hot reading queries and fail if any of them scans a "
+        "whole table or sorts through a temporary B-tree where it shouldn't. "
+        "Run it before deploying."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--owner", help="Username to build the queries for; default the first."
+        )
+        parser.add_argument(
+            "--verbose-plans", action="store_true", help="Print every plan."
+        )
+
+    def handle(self, *args, owner, verbose_plans, **options):
+        users = sensors.models.User.objects.order_by("date_joined")
+        if owner:
+            users = users.filter(username=owner)
+        user = users.first()
+        if user is None:
+            raise CommandError("No such user.")
+        mac = (
+            sensors.models.Reading.objects.filter(owner=user)
+            .values_list("mac", flat=True)
+            .first()
+        ) or "00:00:00:00:00:00"
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        problems = 0
+        queries = hot_queries(user.id, mac, now)
+        for name, (queryset, expect, allowed) in queries.items():
+            plan = explain(queryset)
+            flagged = [
+                step
+                for step in plan
+                if (FULL_SCAN.search(step) or TEMP_BTREE.search(step))
+                and step not in allowed
+            ]
+            if not any(expect in step for step in plan):
+                flagged.append(f"no step uses {expect}")
+            problems += len(flagged)
+            self.stdout.write(f"{'FAIL' if flagged else 'ok':<4}  {name}")
+            if verbose_plans:
+                shown = plan + [step for step in flagged if step not in plan]
+            else:
+                shown = flagged
+            for step in shown:
+                note = allowed.get(step)
+                suffix = f"  (allowed: {note})" if note else ""
+                marker = "!" if step in flagged else " "
+                self.stdout.write(f"   {marker} {step}{suffix}")
+        if problems:
+            raise CommandError(f"{problems} plan steps need an index.")
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+import sensors.ingest
+import sensors.models
+
+
+class Command(BaseCommand):
+    help = "Rebuild each device's latest-reading state from the readings table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--owner", help="Only this username.")
+
+    def handle(self, *args, owner, **options):
+        owners = sensors.models.User.objects.all()
+        if owner:
+            owners = owners.filter(username=owner)
+        for user in owners:
+            macs = (
+                sensors.models.Reading.objects.filter(owner=user)
+                .values_list("mac", flat=True)
+                .distinct()
+            )
+            latest = []
+            for mac in macs:
+                latest.append(
+                    sensors.models.Reading.objects.filter(owner=user, mac=mac)
+                    .order_by("-timestamp", "-id")
+                    .first()
+                )
+            with transaction.atomic():
+                sensors.models.DeviceState.objects.filter(owner=user).delete()
+                sensors.ingest.update_device_states(user.id, latest)
+            self.stdout.write(f"{user.username}: {len(latest)} devices")
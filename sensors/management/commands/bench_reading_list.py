@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+import sensors.models
+
+
+class Command(BaseCommand):
+    help = (
+        "Time /api/readings/ pages through ReadingSerializer and through the "
+        "serializer-free fast path, and check they return the same bytes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("--limit", type=int, default=10_000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--format", default="json", choices=["json", "msgpack"])
+        parser.add_argument("--fields", default="")
+
+    def handle(self, *args, username, limit, repeat, format, fields, **options):
+        try:
+            user = sensors.models.User.objects.get(username=username)
+        except sensors.models.User.DoesNotExist:
+            raise CommandError(f"No user {username!r}")
+        client = Client(HTTP_HOST="localhost")
+        client.force_login(user)
+        url = f"/api/readings/?limit={limit}&format={format}"
+        if fields:
+            url += f"&fields={fields}"
+
+        results = {}
+        for name, fast in (("serializer", False), ("fast", True)):
+            with override_settings(SENSORS_FAST_READING_LIST=fast):
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    response = client.get(url)
+                    timings.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise CommandError(f"{url} returned {response.status_code}")
+            results[name] = (min(timings), response.content)
+            self.stdout.write(
+                f"{name:<10} {min(timings) * 1000:8.1f} ms "
+                f"{len(response.content):>10,} bytes"
+            )
+
+        speedup = results["serializer"][0] / results["fast"][0]
+        self.stdout.write(f"speedup    {speedup:8.1f}x")
+        if results["serializer"][1] != results["fast"][1]:
+            raise CommandError("The fast path's output differs from the serializer's")
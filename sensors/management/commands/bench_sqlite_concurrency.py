@@ -0,0 +1,138 @@
+import multiprocessing
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+import sensors.sqlite
+
+# SQLite's own defaults, with the same busy_timeout so the comparison is
+# about locking rather than how long a blocked worker waits.
+STOCK_PRAGMAS = {"journal_mode": "DELETE", "synchronous": "FULL"}
+
+MACS = [f"AA:BB:CC:DD:EE:{i:02X}" for i in range(20)]
+
+
+def _rows(count, start):
+    return [
+        (random.choice(MACS), start + i, 20 + random.random() * 5) for i in range(count)
+    ]
+
+
+def _worker(role, path, pragmas, seconds, batch_size, results):
+    connection = sqlite3.connect(path, isolation_level=None)
+    sensors.sqlite.apply_pragmas(connection.cursor(), pragmas)
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            if role == "writer":
+                connection.execute("BEGIN IMMEDIATE")
+                connection.executemany(
+                    "INSERT INTO reading (mac, timestamp, temperature) "
+                    "VALUES (?, ?, ?)",
+                    _rows(batch_size, int(time.time())),
+                )
+                connection.execute("COMMIT")
+            else:
+                connection.execute(
+                    "SELECT mac, count(*), avg(temperature) FROM reading "
+                    "WHERE mac = ? AND timestamp >= ? GROUP BY mac",
+                    (random.choice(MACS), int(time.time()) - 86400),
+                ).fetchall()
+        except sqlite3.OperationalError:
+            # "database is locked": busy_timeout ran out.
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+    connection.close()
+    results.put((role, latencies, errors))
+
+
+class Command(BaseCommand):
+    help = (
+        "Run concurrent reader and writer processes against a scratch SQLite "
+        "database, with SQLite's stock settings and with SENSORS_SQLITE_PRAGMAS, "
+        "and compare throughput and latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=4)
+        parser.add_argument("--writers", type=int, default=2)
+        parser.add_argument("--seconds", type=float, default=5)
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--rows", type=int, default=200_000, help="Rows to seed the table with."
+        )
+
+    def handle(self, *args, readers, writers, seconds, batch_size, rows, **options):
+        busy_timeout = settings.SENSORS_SQLITE_PRAGMAS.get("busy_timeout", 5000)
+        profiles = {
+            "stock": {**STOCK_PRAGMAS, "busy_timeout": busy_timeout},
+            "tuned": settings.SENSORS_SQLITE_PRAGMAS,
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            for name, pragmas in profiles.items():
+                path = str(Path(directory) / f"{name}.sqlite3")
+                self.seed(path, pragmas, rows)
+                results = multiprocessing.Queue()
+                processes = [
+                    multiprocessing.Process(
+                        target=_worker,
+                        args=(role, path, pragmas, seconds, batch_size, results),
+                    )
+                    for role in ["reader"] * readers + ["writer"] * writers
+                ]
+                for process in processes:
+                    process.start()
+                collected = [results.get() for _ in processes]
+                for process in processes:
+                    process.join()
+                for role in ("reader", "writer"):
+                    latencies = [
+                        latency
+                        for r, worker_latencies, _ in collected
+                        if r == role
+                        for latency in worker_latencies
+                    ]
+                    errors = sum(e for r, _, e in collected if r == role)
+                    self.report(name, role, latencies, errors, seconds)
+
+    def seed(self, path, pragmas, rows):
+        connection = sqlite3.connect(path, isolation_level=None)
+        sensors.sqlite.apply_pragmas(connection.cursor(), pragmas)
+        connection.execute(
+            "CREATE TABLE reading (id INTEGER PRIMARY KEY, mac TEXT, "
+            "timestamp INTEGER, temperature REAL)"
+        )
+        connection.execute("CREATE INDEX reading_mac ON reading (mac, timestamp)")
+        connection.execute("BEGIN")
+        connection.executemany(
+            "INSERT INTO reading (mac, timestamp, temperature) VALUES (?, ?, ?)",
+            _rows(rows, int(time.time()) - rows),
+        )
+        connection.execute("COMMIT")
+        connection.close()
+
+    def report(self, profile, role, latencies, errors, seconds):
+        if not latencies:
+            self.stdout.write(f"{profile:<6} {role:<7} no operations, {errors} errors")
+            return
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        self.stdout.write(
+            f"{profile:<6} {role:<7} {len(latencies) / seconds:9,.0f} ops/s "
+            f"p50 {statistics.median(latencies) * 1000:7.2f} ms "
+            f"p99 {p99 * 1000:7.2f} ms "
+            f"max {latencies[-1] * 1000:8.2f} ms "
+            f"{errors} errors"
+        )
@@ -0,0 +1,33 @@
+import functools
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from sensors.uuid7 import LockedUUIDv7Generator, UUIDv7Generator
+
+
+class Command(BaseCommand):
+    help = "Compare per-call UUIDv7 generation with generate_many()."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=10_000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, count, repeat, **options):
+        cases = {
+            "per-call": lambda g: [g() for _ in range(count)],
+            "generate_many": lambda g: g.generate_many(count),
+        }
+        for generator_class in (UUIDv7Generator, LockedUUIDv7Generator):
+            for name, case in cases.items():
+                generator = generator_class()
+                best = min(
+                    timeit.repeat(
+                        functools.partial(case, generator), number=1, repeat=repeat
+                    )
+                )
+                self.stdout.write(
+                    f"{generator_class.__name__:<22} {name:<14} "
+                    f"{best * 1e9 / count:8.0f} ns/uuid "
+                    f"{count / best:12,.0f} uuids/s"
+                )
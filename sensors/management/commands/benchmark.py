@@ -0,0 +1,341 @@
+import datetime
+import json
+import math
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+import django
+import django.core.cache
+import django.db
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+import sensors.buffer
+import sensors.ingest
+import sensors.models
+import sensors.rollups
+from sensors.uuid7 import uuid7_at
+
+USERNAME = "benchmark"
+INGEST_USERNAME = "benchmark-ingest"
+
+# Settings that change what's being measured.
+RECORDED_SETTINGS = [
+    "SENSORS_SQLITE_PRAGMAS",
+    "SENSORS_FAST_READING_LIST",
+    "SENSORS_INGEST_BUFFER",
+    "SENSORS_COMPACT_READINGS",
+    "SENSORS_COMPACT_READS",
+]
+
+
+def _reading(rng, owner_id, mac, when):
+    # RuuviTag-like values, in the steps the tags report them in.
+    day = 2 * math.pi * (when.timestamp() % 86400) / 86400
+    return sensors.models.Reading(
+        id=uuid7_at(when),
+        owner_id=owner_id,
+        mac=mac,
+        type="ruuvi",
+        bleName="",
+        timestamp=when,
+        temperature=round((18 + 4 * math.sin(day) + rng.gauss(0, 0.3)) * 200) / 200,
+        humidity=round((55 + 10 * math.cos(day) + rng.gauss(0, 1)) * 400) / 400,
+        battery=round(rng.uniform(2.8, 3.1), 3),
+        rssi=rng.randint(-95, -50),
+        gatewayFree=rng.uniform(1e5, 2e5),
+        gatewayLoad=rng.uniform(0, 2),
+    )
+
+
+def _body(reading):
+    body = {name: getattr(reading, name) for name in sensors.ingest.COLUMNS}
+    body["timestamp"] = reading.timestamp.isoformat()
+    return body
+
+
+def _summary(timings):
+    return {
+        "timings_ms": [round(t * 1000, 3) for t in timings],
+        "min_ms": round(min(timings) * 1000, 3),
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "max_ms": round(max(timings) * 1000, 3),
+    }
+
+
+def _commit():
+    try:
+        run = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return run.stdout.strip(), bool(dirty.stdout.strip())
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic fleet in a separate SQLite file and time bulk "
+        "ingest, /api/readings/ pages at several offsets, latest_readings, "
+        "get_chart_data and the Parquet download against it, writing the "
+        "results (with the commit) to a JSON file. The fleet is kept and "
+        "reused by later runs with the same shape; --compare prints the "
+        "change from an earlier run's results."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database",
+            type=Path,
+            default=Path(tempfile.gettempdir()) / "sensors-benchmark.sqlite3",
+            help="SQLite file for the fleet; never the configured database.",
+        )
+        parser.add_argument("--devices", type=int, default=50)
+        parser.add_argument("--days", type=int, default=30)
+        parser.add_argument(
+            "--interval", type=int, default=60, help="Seconds between readings."
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--fresh", action="store_true", help="Regenerate the fleet."
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--offsets",
+            default="0,1000,10000,100000,1000000",
+            help="Comma-separated list offsets to time.",
+        )
+        parser.add_argument("--limit", type=int, default=100)
+        parser.add_argument(
+            "--ingest-batches", type=int, default=20, help="Bulk POSTs to time."
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--output", type=Path, default=Path("benchmark.json"))
+        parser.add_argument(
+            "--compare", type=Path, help="An earlier run's JSON to compare with."
+        )
+
+    def handle(self, *args, database, **options):
+        configured = Path(settings.DATABASES["default"]["NAME"]).resolve()
+        if database.resolve() == configured:
+            raise CommandError("Use a separate file, not the configured database.")
+        fleet = {
+            "devices": options["devices"],
+            "days": options["days"],
+            "interval": options["interval"],
+            "seed": options["seed"],
+        }
+        baseline = (
+            json.loads(options["compare"].read_text()) if options["compare"] else None
+        )
+
+        self.use_database(database, fleet, options["fresh"])
+        user = sensors.models.User.objects.get(username=USERNAME)
+        fleet["readings"] = sensors.models.Reading.objects.filter(owner=user).count()
+        self.client = Client(HTTP_HOST="localhost")
+        self.client.force_login(user)
+        self.repeat = options["repeat"]
+
+        results = {}
+        results["ingest_bulk"] = self.ingest(
+            options["ingest_batches"], options["batch_size"]
+        )
+        for offset in [int(o) for o in options["offsets"].split(",") if o]:
+            if offset < fleet["readings"]:
+                results[f"list_offset_{offset}"] = self.get(
+                    f"/api/readings/?format=json&limit={options['limit']}"
+                    f"&offset={offset}"
+                )
+        results["latest_readings"] = self.timed(user.latest_readings)
+        results["chart_data_cold"] = self.timed(user.get_chart_data, cold=True)
+        results["chart_data_warm"] = self.timed(user.get_chart_data)
+        results["download_parquet"] = self.get("/download-parquet/")
+        mac = sensors.models.Device.objects.filter(owner=user).values_list(
+            "mac", flat=True
+        )[0]
+        results["download_parquet_one_device"] = self.get(
+            f"/download-parquet/?mac={mac}"
+        )
+
+        commit, dirty = _commit()
+        report = {
+            "commit": commit,
+            "dirty": dirty,
+            "started": self.started.isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "settings": {name: getattr(settings, name) for name in RECORDED_SETTINGS},
+            "fleet": fleet,
+            "repeat": self.repeat,
+            "results": results,
+        }
+        options["output"].write_text(json.dumps(report, indent=2, default=str) + "\n")
+
+        for name, result in results.items():
+            line = f"{name:<32} {result['median_ms']:10.1f} ms"
+            if "readings_per_second" in result:
+                line += f" {result['readings_per_second']:12,.0f} readings/s"
+            if "bytes" in result:
+                line += f" {result['bytes']:14,} bytes"
+            if baseline and name in baseline["results"]:
+                before = baseline["results"][name]["median_ms"]
+                line += f"  {result['median_ms'] / before:5.2f}x"
+            self.stdout.write(line)
+        if baseline:
+            self.stdout.write(f"compared with {baseline.get('commit')}")
+        self.stdout.write(f"results written to {options['output']}")
+
+    def use_database(self, path, fleet, fresh):
+        """
+        Point the default connection at ``path`` (as the test runner does),
+        migrate it, and generate the fleet unless it's already there.
+        """
+        self.started = datetime.datetime.now(datetime.timezone.utc)
+        spec = path.with_suffix(".fleet.json")
+        if fresh or not spec.exists() or json.loads(spec.read_text()) != fleet:
+            for stale in (path, Path(f"{path}-wal"), Path(f"{path}-shm"), spec):
+                stale.unlink(missing_ok=True)
+        connection = django.db.connections["default"]
+        connection.close()
+        settings.DATABASES["default"]["NAME"] = str(path)
+        connection.settings_dict["NAME"] = str(path)
+        call_command("migrate", verbosity=0, interactive=False)
+        django.core.cache.cache.clear()
+        sensors.models.device_names.clear()
+        if not spec.exists():
+            self.generate(fleet)
+            spec.write_text(json.dumps(fleet))
+
+    def generate(self, fleet):
+        rng = random.Random(fleet["seed"])
+        user = sensors.models.User.objects.create_user(USERNAME)
+        macs = [
+            ":".join(f"{rng.randrange(256):02X}" for _ in range(6))
+            for _ in range(fleet["devices"])
+        ]
+        sensors.models.Device.objects.bulk_create(
+            sensors.models.Device(owner=user, mac=mac, name=f"Sensor {i + 1}")
+            for i, mac in enumerate(macs)
+        )
+        end = self.started.replace(second=0, microsecond=0)
+        start = end - datetime.timedelta(days=fleet["days"])
+        step = datetime.timedelta(seconds=fleet["interval"])
+        latest = {}
+        day = datetime.timedelta(days=1)
+        generated = 0
+        when = start
+        while when < end:
+            readings = []
+            for offset, mac in enumerate(macs):
+                # Devices report at their own second of the interval.
+                t = when + datetime.timedelta(seconds=offset % fleet["interval"])
+                while t < min(when + day, end):
+                    readings.append(_reading(rng, user.id, mac, t))
+                    t += step
+            with django.db.transaction.atomic():
+                sensors.models.Reading.objects.bulk_create(readings, batch_size=5000)
+            # Each device's readings are in time order.
+            latest.update((reading.mac, reading) for reading in readings)
+            generated += len(readings)
+            when += day
+            self.stdout.write(f"generated {generated:,} readings up to {when:%Y-%m-%d}")
+        with django.db.transaction.atomic():
+            sensors.ingest.update_device_states(user.id, list(latest.values()))
+        written = sensors.rollups.rebuild(owner_id=user.id)
+        self.stdout.write(f"{written:,} rollups")
+
+    def timed(self, function, cold=False):
+        timings = []
+        for _ in range(self.repeat):
+            if cold:
+                django.core.cache.cache.clear()
+                sensors.models.device_names.clear()
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+        return _summary(timings)
+
+    def get(self, url):
+        timings = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            response = self.client.get(url)
+            if response.streaming:
+                size = sum(len(chunk) for chunk in response.streaming_content)
+            else:
+                size = len(response.content)
+            timings.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise CommandError(f"{url} returned {response.status_code}")
+        return {**_summary(timings), "bytes": size}
+
+    def ingest(self, batches, batch_size):
+        # Into an owner of its own, deleted afterwards, so runs don't grow
+        # the fleet.
+        user, _ = sensors.models.User.objects.get_or_create(username=INGEST_USERNAME)
+        client = Client(HTTP_HOST="localhost")
+        client.force_login(user)
+        rng = random.Random(0)
+        macs = [f"AA:BB:CC:DD:EE:{i:02X}" for i in range(16)]
+        timings = []
+        try:
+            for _ in range(batches):
+                now = datetime.datetime.now(datetime.timezone.utc)
+                body = [
+                    _body(
+                        _reading(
+                            rng,
+                            user.id,
+                            macs[i % len(macs)],
+                            now - i * datetime.timedelta(milliseconds=1),
+                        )
+                    )
+                    for i in range(batch_size)
+                ]
+                started = time.perf_counter()
+                response = client.post(
+                    "/api/readings/bulk/",
+                    data=json.dumps(body),
+                    content_type="application/json",
+                )
+                timings.append(time.perf_counter() - started)
+                if response.status_code not in (201, 202):
+                    raise CommandError(
+                        f"bulk ingest returned {response.status_code}: "
+                        f"{response.content[:200]!r}"
+                    )
+        finally:
+            # Buffered readings are written after their 202; deleting their
+            # owner first would fail those writes.
+            if settings.SENSORS_INGEST_BUFFER and not sensors.buffer.get_buffer().drain(
+                timeout=60
+            ):
+                raise CommandError(
+                    f"the ingest buffer didn't drain, so {INGEST_USERNAME} was kept"
+                )
+            user.delete()
+        return {
+            **_summary(timings),
+            "batch_size": batch_size,
+            "readings_per_second": round(batches * batch_size / sum(timings)),
+        }
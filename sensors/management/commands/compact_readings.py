@@ -0,0 +1,141 @@
+import time
+import uuid
+
+import django.db
+from django.core.management.base import BaseCommand, CommandError
+
+import sensors.compact
+import sensors.models
+from sensors.uuid7 import get_uuid7_many
+
+READING_TABLES = ["sensors_reading"]
+COMPACT_TABLES = ["sensors_compactreading", "sensors_sensor"]
+
+
+def _mib(size):
+    return f"{size / 2**20:10.1f} MiB"
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy readings into the compact layout (--backfill), and/or compare "
+        "it with sensors_reading (--report): table and index sizes, values "
+        "that scaling would round, and insert and scan throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--backfill", action="store_true")
+        parser.add_argument(
+            "--after", type=uuid.UUID, help="Resume the backfill after this id."
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=sensors.compact.BATCH_SIZE
+        )
+        parser.add_argument("--report", action="store_true")
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=10_000,
+            help="Newest readings to time inserts and scans with.",
+        )
+
+    def handle(self, *args, backfill, after, batch_size, report, rows, **options):
+        if not backfill and not report:
+            raise CommandError("Pass --backfill and/or --report.")
+        if backfill:
+            copied = 0
+            for count, last in sensors.compact.backfill(after, batch_size):
+                copied += count
+                self.stdout.write(f"copied {copied} readings, up to {last}")
+            self.stdout.write(f"{copied} readings copied")
+        if report:
+            self.sizes()
+            self.throughput(rows)
+
+    def sizes(self):
+        try:
+            before = sensors.compact.table_sizes(READING_TABLES)
+            after = sensors.compact.table_sizes(COMPACT_TABLES)
+        except django.db.OperationalError:
+            raise CommandError("This SQLite wasn't built with the dbstat table.")
+        readings = sensors.models.Reading.objects.count()
+        compact = sensors.models.CompactReading.objects.count()
+        for title, sizes, count in (
+            ("sensors_reading", before, readings),
+            ("compact", after, compact),
+        ):
+            self.stdout.write(f"{title}: {count:,} readings")
+            for name, size in sizes.items():
+                self.stdout.write(f"  {name:<40} {_mib(size)}")
+            total = sum(sizes.values())
+            per_row = f", {total / count:.0f} bytes/reading" if count else ""
+            self.stdout.write(f"  {'total':<40} {_mib(total)}{per_row}")
+        if compact < readings:
+            self.stdout.write(
+                f"{readings - compact:,} readings aren't in the compact layout "
+                "yet; run --backfill for a like-for-like comparison."
+            )
+
+    def throughput(self, rows):
+        sample = list(sensors.models.Reading.objects.order_by("-id")[:rows])
+        if not sample:
+            return
+
+        rounded = dict.fromkeys(sensors.compact.SCALES, 0)
+        for reading in sample:
+            # The reading has all the fields of its Sensor.
+            decoded = sensors.compact.decode(
+                sensors.compact.encode(reading, None), reading
+            )
+            for name in rounded:
+                if getattr(decoded, name) != getattr(reading, name):
+                    rounded[name] += 1
+        self.stdout.write(
+            f"values rounded by scaling, of {len(sample):,} readings: "
+            + ", ".join(f"{name} {count}" for name, count in rounded.items())
+        )
+
+        # Insert copies under new ids, and roll them back.
+        copies = {}
+        for id, reading in zip(get_uuid7_many(len(sample)), sample):
+            copy = sensors.models.Reading(
+                **{f.attname: getattr(reading, f.attname) for f in reading._meta.fields}
+            )
+            copy.id = id
+            copies.setdefault(reading.owner_id, []).append(copy)
+        with django.db.transaction.atomic():
+            started = time.perf_counter()
+            for readings in copies.values():
+                sensors.models.Reading.objects.bulk_create(readings)
+            reading_insert = time.perf_counter() - started
+            started = time.perf_counter()
+            for owner_id, readings in copies.items():
+                sensors.compact.write(owner_id, readings)
+            compact_insert = time.perf_counter() - started
+            django.db.transaction.set_rollback(True)
+
+        first = sample[-1].id
+        started = time.perf_counter()
+        scanned = list(
+            sensors.models.Reading.objects.filter(id__gte=first).order_by("id")
+        )
+        reading_scan = time.perf_counter() - started
+        started = time.perf_counter()
+        compact = list(
+            sensors.models.CompactReading.objects.filter(id__gte=first).order_by("id")
+        )
+        sensor_rows = sensors.models.Sensor.objects.in_bulk(
+            {c.sensor_id for c in compact}
+        )
+        decoded = [sensors.compact.decode(c, sensor_rows[c.sensor_id]) for c in compact]
+        compact_scan = time.perf_counter() - started
+
+        for name, seconds, count in (
+            ("insert sensors_reading", reading_insert, len(sample)),
+            ("insert compact", compact_insert, len(sample)),
+            ("scan sensors_reading", reading_scan, len(scanned)),
+            ("scan compact + decode", compact_scan, len(decoded)),
+        ):
+            self.stdout.write(
+                f"{name:<24} {count / seconds:12,.0f} readings/s ({count:,})"
+            )
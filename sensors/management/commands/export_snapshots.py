@@ -0,0 +1,35 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+import sensors.export
+import sensors.models
+import sensors.snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Append readings newer than each owner's last snapshot to their "
+        "day-partitioned Parquet files."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--owner", help="Only this username.")
+        parser.add_argument("--chunk-size", type=int, default=sensors.export.CHUNK_SIZE)
+        parser.add_argument(
+            "--compact",
+            action="store_true",
+            help="Merge each finished day's files into one.",
+        )
+
+    def handle(self, *args, owner, chunk_size, compact, **options):
+        owners = sensors.models.User.objects.all()
+        if owner:
+            owners = owners.filter(username=owner)
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+        for user in owners:
+            appended = sensors.snapshots.update_snapshot(user.id, chunk_size)
+            self.stdout.write(f"{user.username}: appended {appended} readings")
+            if compact:
+                days = sensors.snapshots.compact_snapshot(user.id, before=today)
+                self.stdout.write(f"{user.username}: compacted {days} days")
@@ -0,0 +1,167 @@
+import asyncio
+import base64
+import datetime
+import json
+import random
+import time
+import urllib.parse
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _readings(count):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return [
+        {
+            "mac": f"AA:BB:CC:DD:EE:{random.randrange(16):02X}",
+            "type": "load-test",
+            "timestamp": (now - datetime.timedelta(seconds=i)).isoformat(),
+            "temperature": 20 + random.random() * 5,
+            "humidity": 50 + random.random() * 10,
+        }
+        for i in range(count)
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Hold --concurrency connections open against a running server for "
+        "--seconds and report throughput, latency and failures. Run it "
+        "against gunicorn (sensors.wsgi) and an ASGI server (sensors.asgi) "
+        "to compare how many concurrent clients each can serve; --trickle "
+        "makes POST clients send their bodies slowly, like gateways on poor "
+        "links."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("url")
+        parser.add_argument("--method", choices=("GET", "POST"), default="GET")
+        parser.add_argument("--concurrency", type=int, default=100)
+        parser.add_argument("--seconds", type=float, default=10)
+        parser.add_argument("--timeout", type=float, default=30)
+        parser.add_argument("--user", help="Username for HTTP Basic auth.")
+        parser.add_argument("--password", default="")
+        parser.add_argument(
+            "--header",
+            action="append",
+            default=[],
+            help='Extra request header, e.g. "Cookie: sessionid=...".',
+        )
+        parser.add_argument(
+            "--rows", type=int, default=100, help="Readings per POST body."
+        )
+        parser.add_argument(
+            "--trickle",
+            type=float,
+            default=0,
+            help="Seconds over which to send each POST body.",
+        )
+
+    def handle(self, *args, url, **options):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme != "http":
+            raise CommandError("Only http:// URLs are supported.")
+        stats = asyncio.run(self.run(parsed, **options))
+        self.report(options["concurrency"], options["seconds"], **stats)
+
+    async def run(
+        self,
+        url,
+        method,
+        concurrency,
+        seconds,
+        timeout,
+        user,
+        password,
+        header,
+        rows,
+        trickle,
+        **options,
+    ):
+        path = url.path or "/"
+        if url.query:
+            path += f"?{url.query}"
+        headers = [
+            f"{method} {path} HTTP/1.1",
+            f"Host: {url.netloc}",
+            "Connection: close",
+            "Accept: application/json",
+        ]
+        if user:
+            token = base64.b64encode(f"{user}:{password}".encode()).decode()
+            headers.append(f"Authorization: Basic {token}")
+        headers += header
+        body = b""
+        if method == "POST":
+            body = json.dumps(_readings(rows)).encode()
+            headers += [
+                "Content-Type: application/json",
+                f"Content-Length: {len(body)}",
+            ]
+        head = ("\r\n".join(headers) + "\r\n\r\n").encode()
+
+        latencies = []
+        statuses = Counter()
+        errors = Counter()
+        deadline = time.monotonic() + seconds
+
+        async def request():
+            reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+            try:
+                writer.write(head)
+                if trickle and body:
+                    pieces = 10
+                    size = -(-len(body) // pieces)
+                    for i in range(0, len(body), size):
+                        writer.write(body[i : i + size])
+                        await writer.drain()
+                        await asyncio.sleep(trickle / pieces)
+                else:
+                    writer.write(body)
+                await writer.drain()
+                status_line = await reader.readline()
+                await reader.read()
+                return int(status_line.split()[1])
+            finally:
+                writer.close()
+
+        async def client():
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    status = await asyncio.wait_for(request(), timeout)
+                except (OSError, asyncio.TimeoutError, IndexError, ValueError) as e:
+                    errors[type(e).__name__] += 1
+                    continue
+                statuses[status] += 1
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return {"latencies": latencies, "statuses": statuses, "errors": errors}
+
+    def report(self, concurrency, seconds, latencies, statuses, errors):
+        self.stdout.write(
+            f"{concurrency} clients for {seconds:g}s: {len(latencies)} responses "
+            f"({len(latencies) / seconds:,.1f}/s)"
+        )
+        self.stdout.write(
+            "statuses: "
+            + (", ".join(f"{s}={n}" for s, n in sorted(statuses.items())) or "none")
+        )
+        self.stdout.write(
+            "errors: "
+            + (", ".join(f"{e}={n}" for e, n in sorted(errors.items())) or "none")
+        )
+        if latencies:
+            latencies.sort()
+
+            def percentile(p):
+                return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+            self.stdout.write(
+                f"latency: p50 {percentile(0.5) * 1000:.1f} ms, "
+                f"p95 {percentile(0.95) * 1000:.1f} ms, "
+                f"p99 {percentile(0.99) * 1000:.1f} ms, "
+                f"max {latencies[-1] * 1000:.1f} ms"
+            )
@@ -0,0 +1,53 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+import sensors.retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete raw readings ingested more than SENSORS_RAW_RETENTION_DAYS ago, "
+        "oldest first in bounded batches, and minute rollups older than "
+        "SENSORS_MINUTE_ROLLUP_RETENTION_DAYS. Hour and day rollups are kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=sensors.retention.BATCH_SIZE
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0,
+            help="Seconds to sleep between batches, to let ingest in.",
+        )
+        parser.add_argument(
+            "--archive",
+            action="store_true",
+            help="Write each batch to Parquet under SENSORS_EXPORT_DIR/pruned/ first.",
+        )
+
+    def handle(self, *args, batch_size, pause, archive, **options):
+        days = settings.SENSORS_RAW_RETENTION_DAYS
+        minute_rollup_days = settings.SENSORS_MINUTE_ROLLUP_RETENTION_DAYS
+        if not days and not minute_rollup_days:
+            raise CommandError(
+                "No retention period set; set SENSORS_RAW_RETENTION_DAYS and/or "
+                "SENSORS_MINUTE_ROLLUP_RETENTION_DAYS."
+            )
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if days:
+            before = now - datetime.timedelta(days=days)
+            deleted = 0
+            for count in sensors.retention.prune_readings(
+                before, batch_size, archive=archive, pause=pause
+            ):
+                deleted += count
+                self.stdout.write(f"deleted {deleted} readings")
+            self.stdout.write(f"{deleted} readings ingested before {before} deleted")
+        if minute_rollup_days:
+            before = now - datetime.timedelta(days=minute_rollup_days)
+            deleted = sensors.retention.prune_minute_rollups(before)
+            self.stdout.write(f"{deleted} minute rollups before {before} deleted")
@@ -0,0 +1,36 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+import sensors.models
+import sensors.rollups
+
+
+def _date(value):
+    return datetime.datetime.combine(
+        datetime.date.fromisoformat(value), datetime.time(), datetime.timezone.utc
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the minute, hour and day rollups from the readings table, "
+        "for whole UTC days."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--owner", help="Only this username.")
+        parser.add_argument(
+            "--start", type=_date, help="First day (YYYY-MM-DD); default the first."
+        )
+        parser.add_argument(
+            "--end", type=_date, help="Day after the last (YYYY-MM-DD); default none."
+        )
+
+    def handle(self, *args, owner, start, end, **options):
+        owners = sensors.models.User.objects.all()
+        if owner:
+            owners = owners.filter(username=owner)
+        for user in owners:
+            written = sensors.rollups.rebuild(start, end, owner_id=user.id)
+            self.stdout.write(f"{user.username}: {written} rollups")
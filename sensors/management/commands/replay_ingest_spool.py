@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+import sensors.buffer
+
+
+class Command(BaseCommand):
+    help = (
+        "Insert readings left in the ingest spool by processes that stopped "
+        "before writing them."
+    )
+
+    def handle(self, *args, **options):
+        inserted = sensors.buffer.replay_spool(settings.SENSORS_INGEST_SPOOL_DIR)
+        self.stdout.write(f"{inserted} readings replayed")
@@ -0,0 +1,322 @@
+"""
+Counters and histograms for ``/metrics``, in the Prometheus text format.
+
+Gunicorn runs several worker processes, so each process adds its samples to
+its own memory-mapped file in ``SENSORS_METRICS_DIR``, and ``/metrics`` sums
+the files. Gunicorn's hooks in ``gunicorn.conf.py`` empty the directory when
+the server starts (a file left by an earlier run would otherwise be summed
+too, or reopened by a worker that gets the same pid) and, when a worker
+exits, fold its file into ``exited.metrics`` with ``retire`` (its counts
+still happened) so files don't pile up.
+
+A file is a 4-byte count of the bytes used, padding, then entries of a
+4-byte key length, the key (JSON of the sample name and labels) padded to 8
+bytes, and a double. Only the owning process writes to a file, and it
+appends an entry before updating the count, so readers never see part of
+one.
+"""
+
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+import django.conf
+import django.db
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+INITIAL_SIZE = 64 * 1024
+
+# Seconds.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Readings.
+BATCH_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10_000)
+
+_metrics = {}
+
+
+def _padding(length):
+    return (8 - (4 + length) % 8) % 8
+
+
+def _entries(data, used):
+    """
+    Yield ``(key, value, value offset)`` for the entries in a file.
+    """
+    pos = 8
+    while pos < used:
+        (length,) = struct.unpack_from("<i", data, pos)
+        pos += 4
+        key = bytes(data[pos : pos + length]).decode()
+        pos += length + _padding(length)
+        (value,) = struct.unpack_from("<d", data, pos)
+        yield key, value, pos
+        pos += 8
+
+
+def _used(data):
+    (used,) = struct.unpack_from("<i", data, 0) if len(data) >= 4 else (0,)
+    return min(used, len(data))
+
+
+class _File:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        # Open for the life of the process.
+        self.file = open(path, "a+b")  # noqa: SIM115
+        size = max(os.fstat(self.file.fileno()).st_size, INITIAL_SIZE)
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        (self.used,) = struct.unpack_from("<i", self.map, 0)
+        if not self.used:
+            self.used = 8
+            struct.pack_into("<i", self.map, 0, self.used)
+        self.positions = {key: pos for key, _, pos in _entries(self.map, self.used)}
+
+    def add(self, key, amount):
+        with self.lock:
+            pos = self.positions.get(key)
+            if pos is None:
+                pos = self._append(key)
+            (value,) = struct.unpack_from("<d", self.map, pos)
+            struct.pack_into("<d", self.map, pos, value + amount)
+
+    def _append(self, key):
+        encoded = key.encode()
+        padded = len(encoded) + _padding(len(encoded))
+        entry = struct.pack(f"<i{padded}sd", len(encoded), encoded, 0.0)
+        while self.used + len(entry) > len(self.map):
+            size = len(self.map) * 2
+            self.map.close()
+            self.file.truncate(size)
+            self.map = mmap.mmap(self.file.fileno(), size)
+        self.map[self.used : self.used + len(entry)] = entry
+        self.used += len(entry)
+        struct.pack_into("<i", self.map, 0, self.used)
+        self.positions[key] = self.used - 8
+        return self.used - 8
+
+
+_file = None
+_file_pid = None
+_file_lock = threading.Lock()
+
+
+def _process_file():
+    # A worker forked after the parent recorded something gets its own file.
+    global _file, _file_pid
+    pid = os.getpid()
+    if _file_pid != pid:
+        with _file_lock:
+            if _file_pid != pid:
+                directory = django.conf.settings.SENSORS_METRICS_DIR
+                directory.mkdir(parents=True, exist_ok=True)
+                _file = _File(directory / f"{pid}.metrics")
+                _file_pid = pid
+    return _file
+
+
+def clear():
+    """
+    Remove every process's file, for when the server starts.
+    """
+    global _exited
+    directory = django.conf.settings.SENSORS_METRICS_DIR
+    for path in directory.glob("*.metrics"):
+        path.unlink(missing_ok=True)
+    _exited = None
+
+
+_exited = None
+
+
+def retire(pid):
+    """
+    Add an exited process's counts to ``exited.metrics`` and remove its file.
+
+    Only one process (gunicorn's arbiter) may call this, as it's the only
+    writer of ``exited.metrics``.
+    """
+    global _exited
+    directory = django.conf.settings.SENSORS_METRICS_DIR
+    path = directory / f"{pid}.metrics"
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return
+    if _exited is None:
+        _exited = _File(directory / "exited.metrics")
+    for key, value, _ in _entries(data, _used(data)):
+        _exited.add(key, value)
+    path.unlink()
+
+
+def _add(name, labels, amount):
+    _process_file().add(json.dumps([name, labels], sort_keys=True), amount)
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        _metrics[name] = self
+
+    def inc(self, amount=1, **labels):
+        _add(self.name, labels, amount)
+
+    def samples(self, values):
+        return sorted(
+            (
+                (name, labels, value)
+                for (name, labels), value in values
+                if name == self.name
+            ),
+            key=lambda sample: sorted(sample[1].items()),
+        )
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        _metrics[name] = self
+
+    def observe(self, value, **labels):
+        # Stored as a count per bucket, made cumulative when collected.
+        bucket = next((b for b in self.buckets if value <= b), math.inf)
+        _add(f"{self.name}_bucket", {**labels, "le": _number(bucket)}, 1)
+        _add(f"{self.name}_sum", labels, value)
+
+    def samples(self, values):
+        series = {}
+        for (name, labels), value in values:
+            if name == f"{self.name}_bucket":
+                labels = dict(labels)
+                le = labels.pop("le")
+                key = tuple(sorted(labels.items()))
+                series.setdefault(key, [{}, 0.0])[0][le] = value
+            elif name == f"{self.name}_sum":
+                series.setdefault(tuple(sorted(labels.items())), [{}, 0.0])[1] = value
+        samples = []
+        for key, (counts, total) in sorted(series.items()):
+            labels = dict(key)
+            cumulative = 0
+            for bound in (*self.buckets, math.inf):
+                cumulative += counts.get(_number(bound), 0)
+                samples.append(
+                    (
+                        f"{self.name}_bucket",
+                        {**labels, "le": _number(bound)},
+                        cumulative,
+                    )
+                )
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+REQUEST_DURATION = Histogram(
+    "sensors_request_duration_seconds",
+    "Time to produce a response (before streaming its body), by URL name.",
+)
+INGESTED_READINGS = Counter(
+    "sensors_ingested_readings_total", "Readings written; rate() is rows per second."
+)
+INGEST_BATCH_READINGS = Histogram(
+    "sensors_ingest_batch_readings",
+    "Readings per ingested batch.",
+    buckets=BATCH_BUCKETS,
+)
+SQLITE_LOCK_WAIT = Histogram(
+    "sensors_sqlite_lock_wait_seconds",
+    "Time BEGIN IMMEDIATE waited for the write lock, retrying while busy.",
+)
+SQLITE_LOCKED = Counter(
+    "sensors_sqlite_locked_errors_total",
+    "Queries that failed because the database stayed locked past busy_timeout.",
+)
+CACHE_REQUESTS = Counter(
+    "sensors_cache_requests_total", "Cache lookups, by cache and hit or miss."
+)
+EXPORT_BYTES = Counter("sensors_export_bytes_total", "Bytes of Parquet and Arrow sent.")
+
+
+def _observe_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    except django.db.OperationalError as e:
+        if "database is locked" in str(e):
+            SQLITE_LOCKED.inc()
+        raise
+    finally:
+        if sql.startswith("BEGIN"):
+            SQLITE_LOCK_WAIT.observe(time.perf_counter() - started)
+
+
+@receiver(connection_created)
+def _instrument_connection(sender, connection, **kwargs):
+    if connection.vendor == "sqlite" and _observe_query not in (
+        connection.execute_wrappers
+    ):
+        connection.execute_wrappers.append(_observe_query)
+
+
+def collect():
+    """
+    ``{(sample name, labels as sorted items): value}`` summed over every
+    process's file.
+    """
+    totals = {}
+    directory = django.conf.settings.SENSORS_METRICS_DIR
+    for path in directory.glob("*.metrics"):
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            continue
+        for key, value, _ in _entries(data, _used(data)):
+            name, labels = json.loads(key)
+            key = (name, tuple(sorted(labels.items())))
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def exposition():
+    """
+    Every metric, in the Prometheus text exposition format (0.0.4).
+    """
+    values = [
+        ((name, dict(labels)), value) for (name, labels), value in collect().items()
+    ]
+    lines = []
+    for name, metric in sorted(_metrics.items()):
+        lines.append(f"# HELP {name} {_escape(metric.documentation)}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        for sample, labels, value in metric.samples(values):
+            if labels:
+                sample += (
+                    "{"
+                    + ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+                    + "}"
+                )
+            lines.append(f"{sample} {_number(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:29
+
+import django.db.models.deletion
+import sensors.uuid7
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sensors", "0005_alter_reading_timestamp_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeviceState",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=sensors.uuid7.get_uuid7,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("mac", models.CharField(max_length=20)),
+                ("reading_id", models.UUIDField()),
+                ("timestamp", models.DateTimeField()),
+                ("gatewayFree", models.FloatField(blank=True, null=True)),
+                ("gatewayLoad", models.FloatField(blank=True, null=True)),
+                ("type", models.CharField(max_length=20)),
+                ("bleName", models.CharField(blank=True, max_length=20, null=True)),
+                ("battery", models.FloatField(blank=True, null=True)),
+                ("humidity", models.FloatField(blank=True, null=True)),
+                ("temperature", models.FloatField(blank=True, null=True)),
+                ("rssi", models.FloatField(blank=True, null=True)),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="device_states",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("owner", "mac"), name="sensors_devicestate_owner_mac"
+                    )
+                ],
+            },
+        ),
+    ]
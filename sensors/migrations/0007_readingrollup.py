@@ -0,0 +1,94 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def _populate(period):
+    # Roll up the readings that predate incremental maintenance. Written out
+    # in SQL rather than with sensors.rollups, which follows the current
+    # models rather than this migration's.
+    return f"""
+        INSERT INTO sensors_readingrollup (
+            owner_id, mac, period, bucket, count,
+            temperature_count, temperature_sum, temperature_min, temperature_max,
+            humidity_count, humidity_sum, humidity_min, humidity_max,
+            battery_count, battery_sum, battery_min, battery_max,
+            rssi_count, rssi_sum, rssi_min, rssi_max
+        )
+        SELECT
+            owner_id, mac, {period},
+            CAST(strftime('%s', timestamp) AS INTEGER) / {period} * {period}
+                AS rollup_bucket,
+            COUNT(*),
+            COUNT(temperature), SUM(temperature), MIN(temperature), MAX(temperature),
+            COUNT(humidity), SUM(humidity), MIN(humidity), MAX(humidity),
+            COUNT(battery), SUM(battery), MIN(battery), MAX(battery),
+            COUNT(rssi), SUM(rssi), MIN(rssi), MAX(rssi)
+        FROM sensors_reading
+        GROUP BY owner_id, mac, rollup_bucket
+    """
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sensors", "0006_devicestate"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReadingRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("mac", models.CharField(max_length=20)),
+                ("period", models.PositiveIntegerField()),
+                ("bucket", models.BigIntegerField()),
+                ("count", models.PositiveIntegerField(default=0)),
+                ("temperature_count", models.PositiveIntegerField(default=0)),
+                ("temperature_sum", models.FloatField(blank=True, null=True)),
+                ("temperature_min", models.FloatField(blank=True, null=True)),
+                ("temperature_max", models.FloatField(blank=True, null=True)),
+                ("humidity_count", models.PositiveIntegerField(default=0)),
+                ("humidity_sum", models.FloatField(blank=True, null=True)),
+                ("humidity_min", models.FloatField(blank=True, null=True)),
+                ("humidity_max", models.FloatField(blank=True, null=True)),
+                ("battery_count", models.PositiveIntegerField(default=0)),
+                ("battery_sum", models.FloatField(blank=True, null=True)),
+                ("battery_min", models.FloatField(blank=True, null=True)),
+                ("battery_max", models.FloatField(blank=True, null=True)),
+                ("rssi_count", models.PositiveIntegerField(default=0)),
+                ("rssi_sum", models.FloatField(blank=True, null=True)),
+                ("rssi_min", models.FloatField(blank=True, null=True)),
+                ("rssi_max", models.FloatField(blank=True, null=True)),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rollups",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("owner", "period", "bucket", "mac"),
+                        name="sensors_readingrollup_key",
+                    )
+                ],
+            },
+        ),
+        *(
+            migrations.RunSQL(_populate(period), migrations.RunSQL.noop)
+            for period in (60, 60 * 60, 24 * 60 * 60)
+        ),
+    ]
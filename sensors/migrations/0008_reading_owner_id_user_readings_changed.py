@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sensors", "0007_readingrollup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="readings_changed",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="reading",
+            index=models.Index(
+                fields=["owner", "id"], name="sensors_rea_owner_i_d95445_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:54
+
+import django.db.models.deletion
+import django.db.models.functions.comparison
+import sensors.models
+import sensors.uuid7
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sensors", "0008_reading_owner_id_user_readings_changed"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Sensor",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("mac", models.CharField(max_length=20)),
+                ("type", models.CharField(max_length=20)),
+                ("bleName", models.CharField(blank=True, max_length=20, null=True)),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="sensors",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="CompactReading",
+            fields=[
+                (
+                    "id",
+                    sensors.models.BinaryUUIDField(
+                        default=sensors.uuid7.get_uuid7,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("timestamp", models.BigIntegerField()),
+                ("gatewayFree", models.FloatField(blank=True, null=True)),
+                ("gatewayLoad", models.FloatField(blank=True, null=True)),
+                ("battery", models.IntegerField(blank=True, null=True)),
+                ("humidity", models.IntegerField(blank=True, null=True)),
+                ("temperature", models.IntegerField(blank=True, null=True)),
+                ("rssi", models.IntegerField(blank=True, null=True)),
+                (
+                    "sensor",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="readings",
+                        to="sensors.sensor",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="sensor",
+            constraint=models.UniqueConstraint(
+                models.F("owner"),
+                models.F("mac"),
+                models.F("type"),
+                django.db.models.functions.comparison.Coalesce(
+                    "bleName", models.Value("")
+                ),
+                name="sensors_sensor_key",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="compactreading",
+            index=models.Index(
+                fields=["sensor", "timestamp"], name="sensors_com_sensor__9cb085_idx"
+            ),
+        ),
+    ]
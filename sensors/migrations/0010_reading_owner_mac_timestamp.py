@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sensors", "0009_compact_readings"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="reading",
+            name="owner",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="readings",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="reading",
+            index=models.Index(
+                fields=["owner", "mac", "timestamp"],
+                name="sensors_rea_owner_i_72f567_idx",
+            ),
+        ),
+    ]
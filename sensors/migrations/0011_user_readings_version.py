@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 20:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sensors", "0010_reading_owner_mac_timestamp"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="readings_version",
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-18 20:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sensors", "0011_user_readings_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SpoolCommit",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("segment", models.CharField(max_length=100)),
+                ("entry", models.PositiveIntegerField(blank=True, null=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["segment", "entry"],
+                        name="sensors_spo_segment_ef1c72_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 20:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sensors", "0012_spoolcommit"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="readings_rewritten",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
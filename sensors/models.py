@@ -1,30 +1,49 @@
+import uuid
 from collections import defaultdict
 from datetime import timedelta
-import time
 from django.db import models
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from sensors.device_names import DeviceNameCache
 from sensors.uuid7 import get_uuid7
 import django.contrib.auth.models
 import django.utils.timezone
-import functools
 
 
-@functools.lru_cache(maxsize=100)
-def _get_device_name(owner, mac, time):
-    try:
-        device = Device.objects.get(owner=owner, mac=mac)
-        return device.name
-    except Device.DoesNotExist:
-        return None
+def _load_device_names(owner_id):
+    return dict(Device.objects.filter(owner_id=owner_id).values_list("mac", "name"))
 
 
-def get_device_name(owner, mac):
-    return _get_device_name(owner, mac, time.time() // 5)
+# Signals only invalidate the process that changed the device; other workers
+# see a rename once their entries expire, within ttl seconds.
+device_names = DeviceNameCache(_load_device_names, ttl=5, maxsize=4096)
+
+
+def get_device_name(owner_id, mac):
+    return device_names.get(owner_id, mac)
+
+
+class DeviceNameQuerySet(models.QuerySet):
+    def with_device_name(self):
+        """
+        Resolve each row's device name, by owner and mac, in SQL rather than
+        per row.
+        """
+        names = Device.objects.filter(
+            owner=models.OuterRef("owner"), mac=models.OuterRef("mac")
+        ).values("name")[:1]
+        return self.annotate(device_name=models.Subquery(names))
 
 
 class Reading(models.Model):
     id = models.UUIDField(primary_key=True, default=get_uuid7, editable=False)
+    # The indexes below all start with the owner.
     owner = models.ForeignKey(
-        "sensors.User", related_name="readings", on_delete=models.CASCADE
+        "sensors.User",
+        related_name="readings",
+        on_delete=models.CASCADE,
+        db_index=False,
     )
     gatewayFree = models.FloatField(null=True, blank=True)
     gatewayLoad = models.FloatField(null=True, blank=True)
@@ -37,56 +56,84 @@ class Reading(models.Model):
     temperature = models.FloatField(null=True, blank=True)
     rssi = models.FloatField(null=True, blank=True)
 
+    objects = DeviceNameQuerySet.as_manager()
+
     @property
     def device_name(self):
-        return get_device_name(self.owner, self.mac)
+        # Set by DeviceNameQuerySet.with_device_name(); only readings loaded
+        # without that annotation fall back to the cache.
+        try:
+            return self._device_name
+        except AttributeError:
+            return get_device_name(self.owner_id, self.mac)
+
+    @device_name.setter
+    def device_name(self, value):
+        self._device_name = value
 
     class Meta:
-        indexes = (models.Index(fields=("owner", "timestamp")),)
+        # Checked by audit_query_plans.
+        indexes = (
+            models.Index(fields=("owner", "timestamp")),
+            # The owner's newest reading, for conditional GETs.
+            models.Index(fields=("owner", "id")),
+            # Charts and aggregates of some of the owner's devices.
+            models.Index(fields=("owner", "mac", "timestamp")),
+        )
 
 
 class User(django.contrib.auth.models.AbstractUser):
     id = models.UUIDField(primary_key=True, default=get_uuid7, editable=False)
+    # When the user's readings last changed other than by ingest (see
+    # mark_readings_changed).
+    readings_changed = models.DateTimeField(null=True, blank=True, editable=False)
+    # When the user's stored readings were last edited, deleted or pruned,
+    # rather than added to (see sensors.snapshots).
+    readings_rewritten = models.DateTimeField(null=True, blank=True, editable=False)
+    # Bumped in the same transaction as any change to the user's readings,
+    # ingest included (see sensors.ingest.update_derived).
+    readings_version = models.BigIntegerField(default=0, editable=False)
 
     def latest_readings(self):
         devices = {device.mac: device for device in Device.objects.filter(owner=self)}
-        macs = devices.keys()
-        qs = (
-            Reading.objects.filter(
-                owner=self,
-                mac__in=macs,
-            )
-            .annotate(
-                latest_timestamp=models.Window(
-                    expression=models.functions.FirstValue("timestamp"),
-                    partition_by=["mac"],
-                    order_by=models.F("timestamp").desc(),
-                )
-            )
-            .filter(timestamp=models.F("latest_timestamp"))
-        )
+        states = DeviceState.objects.filter(owner=self, mac__in=devices.keys())
+        readings = Reading.objects.in_bulk([state.reading_id for state in states])
         latest = []
-        for reading in qs:
-            name = devices[reading.mac].name
-            latest.append([name, reading])
+        for state in states:
+            if state.reading_id in readings:
+                name = devices[state.mac].name
+                latest.append([name, readings[state.reading_id]])
         return latest
 
-    def get_chart_data(self):
-        devices = Device.objects.filter(owner=self)
-        names = {d.mac: d.name for d in devices}
-        readings = Reading.objects.filter(
-            owner=self,
-            mac__in=[d.mac for d in devices],
-            timestamp__gt=django.utils.timezone.now() - timedelta(hours=24),
-        ).order_by("-timestamp")
-        datasets = defaultdict(list)
+    def get_chart_data(self, points=500):
+        # Imported here because sensors.caching imports this module.
+        import sensors.caching
+
+        names = device_names.prefetch(self.id)
+        if not names:
+            # No devices to chart, and no macs would mean every mac.
+            return {"datasets": []}
+        now = django.utils.timezone.now()
+        # Up to the end of this minute, so everyone viewing it this minute
+        # shares one cached series.
+        end = now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        series = sensors.caching.decimated_series(
+            self.id,
+            end - timedelta(hours=24),
+            end,
+            ["temperature"],
+            points,
+            macs=list(names),
+        )
         hour = 60 * 60
-        now = django.utils.timezone.now().timestamp() / hour
-        for reading in readings:
-            name = names[reading.mac]
-            t = reading.timestamp.timestamp() / hour
-            x = now - t
-            datasets[name].append(dict(x=x, y=reading.temperature))
+        now = now.timestamp() / hour
+        datasets = defaultdict(list)
+        for mac, device_series in series.items():
+            if mac not in names:
+                continue
+            for timestamp, temperature in reversed(device_series["temperature"]):
+                x = now - timestamp.timestamp() / hour
+                datasets[names[mac]].append(dict(x=x, y=temperature))
         data = {
             "datasets": [
                 dict(data=data, showLine=True, label=label)
@@ -103,3 +150,209 @@ class Device(models.Model):
     )
     mac = models.CharField(max_length=20)
     name = models.CharField(max_length=50)
+
+
+class DeviceState(models.Model):
+    """
+    The latest reading from each of an owner's devices, kept up to date as
+    readings are ingested, edited and deleted, so "current conditions" cost
+    one row per device.
+
+    The reading's values are copied rather than referenced, so pruning old
+    readings never touches this table.
+    """
+
+    id = models.UUIDField(primary_key=True, default=get_uuid7, editable=False)
+    owner = models.ForeignKey(
+        "sensors.User", related_name="device_states", on_delete=models.CASCADE
+    )
+    mac = models.CharField(max_length=20)
+    reading_id = models.UUIDField()
+    timestamp = models.DateTimeField()
+    gatewayFree = models.FloatField(null=True, blank=True)
+    gatewayLoad = models.FloatField(null=True, blank=True)
+    type = models.CharField(max_length=20)
+    bleName = models.CharField(max_length=20, null=True, blank=True)
+    battery = models.FloatField(null=True, blank=True)
+    humidity = models.FloatField(null=True, blank=True)
+    temperature = models.FloatField(null=True, blank=True)
+    rssi = models.FloatField(null=True, blank=True)
+
+    objects = DeviceNameQuerySet.as_manager()
+
+    # The fields copied from the latest Reading.
+    READING_FIELDS = (
+        "timestamp",
+        "gatewayFree",
+        "gatewayLoad",
+        "type",
+        "bleName",
+        "battery",
+        "humidity",
+        "temperature",
+        "rssi",
+    )
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=("owner", "mac"), name="sensors_devicestate_owner_mac"
+            ),
+        )
+
+
+class ReadingRollup(models.Model):
+    """
+    The count, sum, min and max of each metric from one device over the
+    ``period`` seconds starting at ``bucket`` (epoch seconds). Maintained by
+    ``sensors.rollups`` as readings are ingested.
+    """
+
+    owner = models.ForeignKey(
+        "sensors.User", related_name="rollups", on_delete=models.CASCADE
+    )
+    mac = models.CharField(max_length=20)
+    period = models.PositiveIntegerField()
+    bucket = models.BigIntegerField()
+    count = models.PositiveIntegerField(default=0)
+    temperature_count = models.PositiveIntegerField(default=0)
+    temperature_sum = models.FloatField(null=True, blank=True)
+    temperature_min = models.FloatField(null=True, blank=True)
+    temperature_max = models.FloatField(null=True, blank=True)
+    humidity_count = models.PositiveIntegerField(default=0)
+    humidity_sum = models.FloatField(null=True, blank=True)
+    humidity_min = models.FloatField(null=True, blank=True)
+    humidity_max = models.FloatField(null=True, blank=True)
+    battery_count = models.PositiveIntegerField(default=0)
+    battery_sum = models.FloatField(null=True, blank=True)
+    battery_min = models.FloatField(null=True, blank=True)
+    battery_max = models.FloatField(null=True, blank=True)
+    rssi_count = models.PositiveIntegerField(default=0)
+    rssi_sum = models.FloatField(null=True, blank=True)
+    rssi_min = models.FloatField(null=True, blank=True)
+    rssi_max = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        constraints = (
+            # Also the index for range scans over one owner's period, with or
+            # without a mac.
+            models.UniqueConstraint(
+                fields=("owner", "period", "bucket", "mac"),
+                name="sensors_readingrollup_key",
+            ),
+        )
+
+
+class BinaryUUIDField(models.UUIDField):
+    """
+    A UUID stored as its 16 bytes rather than 32 hex characters. Big-endian,
+    so UUIDv7s still sort by time.
+    """
+
+    def db_type(self, connection):
+        return "blob"
+
+    def get_internal_type(self):
+        # Keeps the backend's text UUID converter off it.
+        return "BinaryField"
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value is None:
+            return None
+        if not isinstance(value, uuid.UUID):
+            value = self.to_python(value)
+        return value.bytes
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return uuid.UUID(bytes=bytes(value))
+
+
+class Sensor(models.Model):
+    """
+    The strings every reading from a device repeats, stored once for
+    ``CompactReading`` to refer to by a small integer.
+    """
+
+    owner = models.ForeignKey(
+        "sensors.User", related_name="sensors", on_delete=models.CASCADE
+    )
+    mac = models.CharField(max_length=20)
+    type = models.CharField(max_length=20)
+    bleName = models.CharField(max_length=20, null=True, blank=True)
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                "owner",
+                "mac",
+                "type",
+                Coalesce("bleName", models.Value("")),
+                name="sensors_sensor_key",
+            ),
+        )
+
+
+class CompactReading(models.Model):
+    """
+    A ``Reading`` in the optional compact layout (see ``sensors.compact``):
+    a binary id, the device's strings moved out to ``Sensor``, the
+    timestamp as microseconds since the epoch, and temperature, humidity,
+    battery and rssi as integers scaled by ``sensors.compact.SCALES``.
+    """
+
+    id = BinaryUUIDField(primary_key=True, default=get_uuid7, editable=False)
+    sensor = models.ForeignKey(
+        Sensor, related_name="readings", on_delete=models.CASCADE, db_index=False
+    )
+    timestamp = models.BigIntegerField()
+    gatewayFree = models.FloatField(null=True, blank=True)
+    gatewayLoad = models.FloatField(null=True, blank=True)
+    battery = models.IntegerField(null=True, blank=True)
+    humidity = models.IntegerField(null=True, blank=True)
+    temperature = models.IntegerField(null=True, blank=True)
+    rssi = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = (models.Index(fields=("sensor", "timestamp")),)
+
+
+class SpoolCommit(models.Model):
+    """
+    A buffered-ingest spool segment, or just its ``entry``th entry, whose
+    readings have committed: written in the same transaction, so replaying
+    the segment after a crash skips them (see ``sensors.buffer``).
+    """
+
+    segment = models.CharField(max_length=100)
+    entry = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = (models.Index(fields=("segment", "entry")),)
+
+
+def mark_readings_changed(owner_ids=None, rewritten=True):
+    """
+    Record that readings (or the device names that go with them) changed
+    in a way their ids don't give away: an edit, a delete, pruning, a rename
+    or a reading landing in a closed range. Conditional GETs and cached
+    blocks need to know. ``None`` marks every user.
+
+    ``rewritten`` says stored readings were changed or removed, not just
+    added to or renamed, which append-only snapshots also need to know.
+    """
+    users = User.objects.all()
+    if owner_ids is not None:
+        users = users.filter(id__in=owner_ids)
+    now = django.utils.timezone.now()
+    changes = {"readings_changed": now}
+    if rewritten:
+        changes["readings_rewritten"] = now
+    users.update(**changes, readings_version=models.F("readings_version") + 1)
+
+
+@receiver([post_save, post_delete], sender=Device)
+def _invalidate_device_names(sender, instance, **kwargs):
+    device_names.invalidate(instance.owner_id)
+    mark_readings_changed([instance.owner_id], rewritten=False)
@@ -0,0 +1,155 @@
+"""
+Per-request performance numbers in the request log.
+
+``PerformanceMiddleware`` counts the SQL queries a request runs and the time
+they take, times serializer and renderer work, and binds ``db_queries``,
+``db_ms``, ``serialize_ms``, ``render_ms`` and ``response_bytes`` into the
+structlog context, so they land on django-structlog's ``request_finished``
+line. A request that runs more queries than its view's budget in
+``SENSORS_QUERY_BUDGETS`` logs a warning, which is how an N+1 (like the old
+per-reading device name lookup) shows up.
+
+The numbers live in a context variable, which ``sync_to_async`` carries into
+the threads the async views run queries on. So the query recorder is added
+to every connection as it's created, rather than with
+``connection.execute_wrapper`` around the view, which would only see the
+request thread's connection.
+"""
+
+import contextlib
+import contextvars
+import time
+
+import django.conf
+import structlog
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+import sensors.metrics
+
+logger = structlog.get_logger()
+
+_stats = contextvars.ContextVar("sensors_perf_stats", default=None)
+
+
+def _new_stats():
+    return {"db_queries": 0, "db_ms": 0.0, "serialize_ms": 0.0, "render_ms": 0.0}
+
+
+@contextlib.contextmanager
+def timer(name):
+    """
+    Add the time spent in the block to the current request's ``<name>_ms``.
+    Does nothing outside a request.
+    """
+    stats = _stats.get()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats[f"{name}_ms"] += (time.perf_counter() - started) * 1000
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats["db_queries"] += 1
+        stats["db_ms"] += (time.perf_counter() - started) * 1000
+
+
+@receiver(connection_created)
+def _instrument_connection(sender, connection, **kwargs):
+    # Persistent connections are reconnected through the same wrapper.
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def query_budget(request):
+    """
+    The most queries the request's view should need, from
+    ``SENSORS_QUERY_BUDGETS`` by URL name, or its ``"default"``.
+    """
+    budgets = django.conf.settings.SENSORS_QUERY_BUDGETS
+    match = request.resolver_match
+    if match is not None and match.view_name in budgets:
+        return budgets[match.view_name]
+    return budgets.get("default")
+
+
+class PerformanceMiddleware:
+    """
+    Goes after django-structlog's ``RequestMiddleware``, so what it binds is
+    logged with the request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        token = _stats.set(_new_stats())
+        try:
+            response = self.get_response(request)
+            self.finish(request, response, started)
+            return response
+        finally:
+            _stats.reset(token)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        token = _stats.set(_new_stats())
+        try:
+            response = await self.get_response(request)
+            self.finish(request, response, started)
+            return response
+        finally:
+            _stats.reset(token)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after this, then the callback runs.
+        started = time.perf_counter()
+        stats = _stats.get()
+
+        def rendered(response):
+            stats["render_ms"] += (time.perf_counter() - started) * 1000
+
+        if stats is not None:
+            response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, request, response, started):
+        view = getattr(request.resolver_match, "view_name", None)
+        sensors.metrics.REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            view=view or "unmatched",
+            method=request.method,
+        )
+        stats = _stats.get()
+        context = {name: round(value, 2) for name, value in stats.items()}
+        if not response.streaming:
+            context["response_bytes"] = len(response.content)
+        structlog.contextvars.bind_contextvars(**context)
+        budget = query_budget(request)
+        if budget is not None and stats["db_queries"] > budget:
+            logger.warning(
+                "query budget exceeded",
+                view=view,
+                db_queries=stats["db_queries"],
+                budget=budget,
+            )
@@ -0,0 +1,60 @@
+import io
+
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+import rest_framework.renderers
+
+import sensors.metrics
+
+
+def as_table(data):
+    """
+    Views hand columnar renderers an Arrow table; anything else (an error, a
+    single object) is rendered as a table of one row per item.
+    """
+    if isinstance(data, pa.Table):
+        return data
+    if isinstance(data, dict):
+        data = [data]
+    return pa.Table.from_pylist(list(data))
+
+
+class ArrowRenderer(rest_framework.renderers.BaseRenderer):
+    """
+    Render an Arrow table as an Arrow IPC stream.
+    """
+
+    media_type = "application/vnd.apache.arrow.stream"
+    format = "arrow"
+    charset = None
+    render_style = "binary"
+    columnar = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        table = as_table(data)
+        sink = pa.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        body = sink.getvalue().to_pybytes()
+        sensors.metrics.EXPORT_BYTES.inc(len(body), format=self.format)
+        return body
+
+
+class ParquetRenderer(rest_framework.renderers.BaseRenderer):
+    """
+    Render an Arrow table as a Parquet file.
+    """
+
+    media_type = "application/vnd.apache.parquet"
+    format = "parquet"
+    charset = None
+    render_style = "binary"
+    columnar = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        sink = io.BytesIO()
+        pq.write_table(as_table(data), sink)
+        body = sink.getvalue()
+        sensors.metrics.EXPORT_BYTES.inc(len(body), format=self.format)
+        return body
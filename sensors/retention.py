@@ -0,0 +1,76 @@
+"""
+Pruning of old raw readings.
+
+Readings are deleted oldest id first, a bounded batch per transaction, so
+the job never holds SQLite's write lock for long. Because ids are UUIDv7,
+"ingested before the cutoff" is an id range and each batch is a primary key
+range delete. The hour and day rollups keep the downsampled history, and
+each batch can first be archived to a Parquet file.
+"""
+
+import time
+from pathlib import Path
+
+import django.conf
+import django.db
+
+import sensors.export
+import sensors.models
+import sensors.rollups
+import sensors.snapshots
+from sensors.uuid7 import uuid7_floor
+
+BATCH_SIZE = 10_000
+
+
+def archive_dir():
+    return Path(django.conf.settings.SENSORS_EXPORT_DIR) / "pruned"
+
+
+def prune_readings(before, batch_size=BATCH_SIZE, archive=False, pause=0):
+    """
+    Delete readings ingested before datetime ``before``, ``batch_size`` at a
+    time in id order, sleeping ``pause`` seconds between batches. With
+    ``archive``, each batch is first written to
+    ``archive_dir()/<first id>.parquet``.
+
+    Yields the number of readings deleted by each batch.
+    """
+    readings = sensors.models.Reading.objects.filter(
+        id__lt=uuid7_floor(before)
+    ).order_by("id")
+    columns = sensors.export.READING_SCHEMA.names if archive else ["id", "owner_id"]
+    owner = columns.index("owner_id")
+    while True:
+        rows = list(readings.values_list(*columns)[:batch_size])
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        if archive:
+            sensors.snapshots.write_tables(
+                archive_dir() / f"{rows[0][0].hex}.parquet",
+                [sensors.export.to_table(rows)],
+            )
+        with django.db.transaction.atomic():
+            deleted, _ = readings.filter(id__lte=last_id).delete()
+            sensors.models.CompactReading.objects.filter(id__lte=last_id).delete()
+            sensors.models.mark_readings_changed({row[owner] for row in rows})
+        yield deleted
+        if pause:
+            time.sleep(pause)
+
+
+def prune_minute_rollups(before):
+    """
+    Delete minute rollups for buckets before datetime ``before``. Returns the
+    number deleted.
+    """
+    rollups = sensors.models.ReadingRollup.objects.filter(
+        period=sensors.rollups.MINUTE, bucket__lt=int(before.timestamp())
+    )
+    with django.db.transaction.atomic():
+        owner_ids = set(rollups.values_list("owner_id", flat=True).distinct())
+        deleted, _ = rollups.delete()
+        if deleted:
+            sensors.models.mark_readings_changed(owner_ids)
+    return deleted
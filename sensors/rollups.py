@@ -0,0 +1,291 @@
+"""
+Per-device rollups of readings at minute, hour and day granularity.
+
+Each ``ReadingRollup`` row holds the count, sum, min and max of every metric
+for one device over one ``period``-second bucket. Ingest folds new readings
+into the rollups in the same transaction that inserts them, so aggregates
+over long ranges read a row per device per bucket instead of every reading.
+Only the edges of a range that don't line up with a rollup bucket are read
+from ``sensors_reading``.
+
+The upsert relies on SQLite's ``ON CONFLICT ... DO UPDATE`` and its
+two-argument ``min()``/``max()``.
+"""
+
+import datetime
+import itertools
+import math
+
+import django.conf
+import django.db
+from django.db import models
+
+import sensors.models
+import sensors.timeseries
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+PERIODS = (MINUTE, HOUR, DAY)
+
+METRICS = sensors.timeseries.METRICS
+
+
+def _epoch(value):
+    return math.floor(value.timestamp())
+
+
+def _datetime(epoch):
+    return datetime.datetime.fromtimestamp(epoch, tz=datetime.timezone.utc)
+
+
+# The rollup table's columns, in the order update_rollups and rebuild write
+# them.
+COLUMNS = [
+    "owner_id",
+    "mac",
+    "period",
+    "bucket",
+    "count",
+    *(
+        f"{metric}_{part}"
+        for metric in METRICS
+        for part in ("count", "sum", "min", "max")
+    ),
+]
+
+# The columns of the rollup table's unique constraint.
+KEY = ("owner_id", "period", "bucket", "mac")
+
+
+def _upsert_sql(connection):
+    quote = connection.ops.quote_name
+    updates = [f"{quote('count')} = {quote('count')} + excluded.{quote('count')}"]
+    for metric in METRICS:
+        count, total, low, high = (
+            quote(f"{metric}_{part}") for part in ("count", "sum", "min", "max")
+        )
+        updates += [
+            f"{count} = {count} + excluded.{count}",
+            # NULL means "no values yet", so it mustn't win a comparison or
+            # poison a sum.
+            (
+                f"{total} = coalesce({total} + excluded.{total}, {total}, "
+                f"excluded.{total})"
+            ),
+            f"{low} = coalesce(min({low}, excluded.{low}), {low}, excluded.{low})",
+            f"{high} = coalesce(max({high}, excluded.{high}), {high}, excluded.{high})",
+        ]
+    return (
+        f"INSERT INTO {quote(sensors.models.ReadingRollup._meta.db_table)} "
+        f"({', '.join(quote(column) for column in COLUMNS)}) "
+        f"VALUES ({', '.join(['%s'] * len(COLUMNS))}) "
+        f"ON CONFLICT ({', '.join(quote(column) for column in KEY)}) "
+        f"DO UPDATE SET {', '.join(updates)}"
+    )
+
+
+def update_rollups(owner_id, readings):
+    """
+    Fold newly inserted ``readings`` into every rollup period. Call it inside
+    the transaction that inserted them.
+    """
+    partials = {}
+    for reading in readings:
+        epoch = _epoch(reading.timestamp)
+        for period in PERIODS:
+            key = (reading.mac, period, epoch // period * period)
+            partial = partials.get(key)
+            if partial is None:
+                partial = partials[key] = [0] + [0, None, None, None] * len(METRICS)
+            partial[0] += 1
+            for index, metric in enumerate(METRICS):
+                value = getattr(reading, metric)
+                if value is None:
+                    continue
+                i = 1 + 4 * index
+                if partial[i] == 0:
+                    partial[i : i + 4] = [1, value, value, value]
+                else:
+                    partial[i] += 1
+                    partial[i + 1] += value
+                    partial[i + 2] = min(partial[i + 2], value)
+                    partial[i + 3] = max(partial[i + 3], value)
+    if not partials:
+        return
+
+    connection = django.db.connections[
+        django.db.router.db_for_write(sensors.models.ReadingRollup)
+    ]
+    owner = sensors.models.ReadingRollup._meta.get_field("owner").get_db_prep_value(
+        owner_id, connection
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            _upsert_sql(connection),
+            [[owner, *key, *partial] for key, partial in partials.items()],
+        )
+
+
+def rebuild(start=None, end=None, owner_id=None):
+    """
+    Recompute the rollups for readings in ``[start, end)`` from scratch,
+    widening the range to whole UTC days so every period's buckets are
+    complete. Either end may be ``None`` for an open range. Days before the
+    raw retention period are never rebuilt.
+
+    Returns the number of rollup rows written.
+    """
+    days = django.conf.settings.SENSORS_RAW_RETENTION_DAYS
+    if days:
+        # Days whose raw readings may have been pruned would lose their
+        # history if rebuilt, so leave them alone.
+        kept = datetime.datetime.now(datetime.timezone.utc).timestamp()
+        kept = _datetime(-(-math.ceil(kept - days * DAY) // DAY) * DAY)
+        start = kept if start is None else max(start, kept)
+        if end is not None and end <= start:
+            return 0
+    if start is not None:
+        start = _datetime(_epoch(start) // DAY * DAY)
+    if end is not None:
+        end = _datetime(-(-math.ceil(end.timestamp()) // DAY) * DAY)
+
+    readings = sensors.models.Reading.objects.all()
+    rollups = sensors.models.ReadingRollup.objects.all()
+    if owner_id is not None:
+        readings = readings.filter(owner_id=owner_id)
+        rollups = rollups.filter(owner_id=owner_id)
+    if start is not None:
+        readings = readings.filter(timestamp__gte=start)
+        rollups = rollups.filter(bucket__gte=_epoch(start))
+    if end is not None:
+        readings = readings.filter(timestamp__lt=end)
+        rollups = rollups.filter(bucket__lt=_epoch(end))
+
+    aggregates = {"rollup_count": models.Count("id")}
+    for metric in METRICS:
+        aggregates[f"rollup_{metric}_count"] = models.Count(metric)
+        aggregates[f"rollup_{metric}_sum"] = models.Sum(metric)
+        aggregates[f"rollup_{metric}_min"] = models.Min(metric)
+        aggregates[f"rollup_{metric}_max"] = models.Max(metric)
+
+    connection = django.db.connections[
+        django.db.router.db_for_write(sensors.models.ReadingRollup)
+    ]
+    quote = connection.ops.quote_name
+    insert = (
+        f"INSERT INTO {quote(sensors.models.ReadingRollup._meta.db_table)} "
+        f"({', '.join(quote(column) for column in COLUMNS)}) "
+    )
+    written = 0
+    with django.db.transaction.atomic(using=connection.alias):
+        rollups.delete()
+        with connection.cursor() as cursor:
+            for period in PERIODS:
+                width = models.Value(period)
+                select = (
+                    readings.order_by()
+                    .annotate(
+                        rollup_bucket=sensors.timeseries.EpochSeconds("timestamp")
+                        / width
+                        * width
+                    )
+                    .values("owner_id", "mac", "rollup_bucket")
+                    .annotate(rollup_period=models.Value(period), **aggregates)
+                    .values_list(
+                        "owner_id",
+                        "mac",
+                        "rollup_period",
+                        "rollup_bucket",
+                        *aggregates,
+                    )
+                )
+                sql, params = select.query.sql_with_params()
+                cursor.execute(insert + sql, params)
+                written += cursor.rowcount
+    return written
+
+
+def rebuild_days(owner_id, timestamps):
+    """
+    Recompute an owner's rollups for the UTC days containing ``timestamps``,
+    e.g. after readings on those days were changed or deleted.
+    """
+    for day in sorted({_epoch(timestamp) // DAY * DAY for timestamp in timestamps}):
+        rebuild(_datetime(day), _datetime(day + DAY), owner_id=owner_id)
+
+
+def rollup_period(bucket):
+    """
+    The longest rollup period that ``bucket`` seconds is a whole multiple
+    of, or ``None``.
+    """
+    for period in reversed(PERIODS):
+        if bucket % period == 0:
+            return period
+    return None
+
+
+def rollup_rows(owner_id, period, first, last, bucket, metrics, macs=None):
+    """
+    The query behind ``rollup_partials``.
+    """
+    rollups = sensors.models.ReadingRollup.objects.filter(
+        owner_id=owner_id, period=period, bucket__gte=first, bucket__lt=last
+    )
+    if macs:
+        rollups = rollups.filter(mac__in=macs)
+
+    aggregates = {"total_count": models.Sum("count")}
+    for metric in metrics:
+        for part, aggregate in (
+            ("count", models.Sum),
+            ("sum", models.Sum),
+            ("min", models.Min),
+            ("max", models.Max),
+        ):
+            aggregates[f"total_{metric}_{part}"] = aggregate(f"{metric}_{part}")
+
+    width = models.Value(bucket)
+    return (
+        rollups.values("mac", total_bucket=models.F("bucket") / width * width)
+        .annotate(**aggregates)
+        .order_by("mac", "total_bucket")
+    )
+
+
+def rollup_partials(owner_id, period, first, last, bucket, metrics, macs=None):
+    """
+    Partial aggregates, shaped like ``aggregate_readings`` returns them, from
+    the ``period`` rollups with buckets in ``[first, last)`` (epoch seconds).
+    """
+    rows = rollup_rows(owner_id, period, first, last, bucket, metrics, macs=macs)
+    for row in rows:
+        yield {key.removeprefix("total_"): value for key, value in row.items()}
+
+
+def aggregate(owner_id, start, end, bucket, metrics, macs=None):
+    """
+    ``aggregate_readings``, but reading whole rollup buckets wherever
+    ``bucket`` is a multiple of a rollup period, and raw readings only for
+    the partial buckets at either end of ``[start, end)``.
+    """
+    period = rollup_period(bucket)
+    if period is not None:
+        first = -(-math.ceil(start.timestamp()) // period) * period
+        last = _epoch(end) // period * period
+    if period is None or first >= last:
+        return sensors.timeseries.aggregate_readings(
+            owner_id, start, end, bucket, metrics, macs=macs
+        )
+
+    partials = itertools.chain(
+        sensors.timeseries.aggregate_readings(
+            owner_id, start, _datetime(first), bucket, metrics, macs=macs
+        ),
+        rollup_partials(owner_id, period, first, last, bucket, metrics, macs=macs),
+        sensors.timeseries.aggregate_readings(
+            owner_id, _datetime(last), end, bucket, metrics, macs=macs
+        ),
+    )
+    return sensors.timeseries.merge_partials(partials, metrics)
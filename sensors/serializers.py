@@ -1,20 +1,188 @@
+from datetime import timedelta
+
+import django.utils.timezone
+import rest_framework.fields
+import rest_framework.reverse
 import rest_framework.serializers
 
 import sensors.models
+import sensors.perf
+import sensors.timeseries
 from drf_queryfields import QueryFieldsMixin
 
 
+class TimedListSerializer(rest_framework.serializers.ListSerializer):
+    """
+    Counts producing ``data`` towards the request's ``serialize_ms``.
+    """
+
+    @property
+    def data(self):
+        with sensors.perf.timer("serialize"):
+            return super().data
+
+
+class TimedSerializerMixin:
+    """
+    Counts producing ``data`` towards the request's ``serialize_ms``; set
+    ``Meta.list_serializer_class = TimedListSerializer`` for ``many=True``.
+    """
+
+    @property
+    def data(self):
+        with sensors.perf.timer("serialize"):
+            return super().data
+
+
 class ReadingSerializer(
-    QueryFieldsMixin, rest_framework.serializers.HyperlinkedModelSerializer
+    TimedSerializerMixin,
+    QueryFieldsMixin,
+    rest_framework.serializers.HyperlinkedModelSerializer,
 ):
     device_name = rest_framework.serializers.CharField(read_only=True)
 
     class Meta:
         model = sensors.models.Reading
         exclude = ["owner"]
+        list_serializer_class = TimedListSerializer
+
+
+class ReadingRows:
+    """
+    Produce exactly what ``ReadingSerializer(many=True).data`` would for a
+    page of readings, from ``values_list`` rows rather than model and
+    serializer instances.
+
+    The output fields (including ``?fields=`` pruning) come from a single
+    ``ReadingSerializer`` instance per request; ``columns`` are what to pass
+    to ``values_list``.
+    """
+
+    PK_PLACEHOLDER = "00000000-0000-0000-0000-000000000000"
+
+    def __init__(self, request):
+        serializer = ReadingSerializer(context={"request": request})
+        self.fields = list(serializer.fields)
+        self.columns = ["id" if name == "url" else name for name in self.fields]
+        url = rest_framework.reverse.reverse(
+            "reading-detail", kwargs={"pk": self.PK_PLACEHOLDER}, request=request
+        )
+        self.url_prefix, self.url_suffix = url.split(self.PK_PLACEHOLDER)
+        self.timestamp = rest_framework.fields.DateTimeField().to_representation
+
+    def to_representation(self, rows):
+        with sensors.perf.timer("serialize"):
+            return self._to_representation(rows)
+
+    def _to_representation(self, rows):
+        converters = []
+        for name in self.fields:
+            if name == "url":
+                converters.append(self.url)
+            elif name == "timestamp":
+                converters.append(self.timestamp)
+            else:
+                converters.append(None)
+        fields = self.fields
+        data = []
+        for row in rows:
+            values = [
+                value if convert is None or value is None else convert(value)
+                for convert, value in zip(converters, row)
+            ]
+            data.append(dict(zip(fields, values)))
+        return data
+
+    def url(self, pk):
+        return f"{self.url_prefix}{pk}{self.url_suffix}"
 
 
-class DeviceSerializer(rest_framework.serializers.HyperlinkedModelSerializer):
+class DeviceSerializer(
+    TimedSerializerMixin, rest_framework.serializers.HyperlinkedModelSerializer
+):
     class Meta:
         model = sensors.models.Device
         exclude = ["owner"]
+        list_serializer_class = TimedListSerializer
+
+
+class AggregateQuerySerializer(rest_framework.serializers.Serializer):
+    """
+    Query parameters for ``/api/readings/aggregate/``.
+
+    ``bucket`` is a duration (e.g. ``300`` or ``01:00:00``); without one, the
+    range is split into about ``points`` buckets. With ``mode=minmax`` each
+    device's series are instead decimated to at most ``points`` raw points,
+    which takes at least 2, over at most ``MAX_RAW_RANGE``.
+    """
+
+    MODES = ("buckets", "minmax")
+
+    start = rest_framework.serializers.DateTimeField(required=False)
+    end = rest_framework.serializers.DateTimeField(required=False)
+    bucket = rest_framework.serializers.DurationField(
+        required=False, min_value=timedelta(seconds=1)
+    )
+    points = rest_framework.serializers.IntegerField(
+        default=300, min_value=1, max_value=sensors.timeseries.MAX_BUCKETS
+    )
+    metrics = rest_framework.serializers.CharField(default="temperature,humidity")
+    mac = rest_framework.serializers.CharField(required=False)
+    mode = rest_framework.serializers.ChoiceField(MODES, default="buckets")
+
+    def validate_metrics(self, value):
+        metrics = [metric for metric in value.split(",") if metric]
+        unknown = set(metrics) - set(sensors.timeseries.METRICS)
+        if unknown or not metrics:
+            raise rest_framework.serializers.ValidationError(
+                f"Choose from {', '.join(sensors.timeseries.METRICS)}."
+            )
+        return metrics
+
+    def validate_mac(self, value):
+        return [mac for mac in value.split(",") if mac]
+
+    def validate(self, attrs):
+        end = attrs.get("end") or django.utils.timezone.now()
+        start = attrs.get("start") or end - timedelta(hours=24)
+        if start >= end:
+            raise rest_framework.serializers.ValidationError(
+                {"start": "Must be before end."}
+            )
+        if "bucket" in attrs:
+            bucket = int(attrs["bucket"].total_seconds())
+        else:
+            bucket = sensors.timeseries.bucket_width(start, end, attrs["points"])
+        if attrs["mode"] == "minmax":
+            if attrs["points"] < 2:
+                raise rest_framework.serializers.ValidationError(
+                    {"points": "Ensure this value is greater than or equal to 2."}
+                )
+            if end - start > sensors.timeseries.MAX_RAW_RANGE:
+                raise rest_framework.serializers.ValidationError(
+                    {
+                        "start": "Range too long for minmax; use at most "
+                        f"{sensors.timeseries.MAX_RAW_RANGE.days} days, "
+                        "or buckets."
+                    }
+                )
+        elif (end - start).total_seconds() / bucket > sensors.timeseries.MAX_BUCKETS:
+            raise rest_framework.serializers.ValidationError(
+                {
+                    "bucket": "Too many buckets; use at most "
+                    f"{sensors.timeseries.MAX_BUCKETS} per range."
+                }
+            )
+        attrs.update(start=start, end=end, bucket=bucket)
+        return attrs
+
+
+class DeviceStateSerializer(
+    TimedSerializerMixin, rest_framework.serializers.ModelSerializer
+):
+    device_name = rest_framework.serializers.CharField(read_only=True)
+
+    class Meta:
+        model = sensors.models.DeviceState
+        exclude = ["id", "owner"]
+        list_serializer_class = TimedListSerializer
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 import structlog
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -57,6 +58,8 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "django_structlog.middlewares.RequestMiddleware",
+    # Inside RequestMiddleware, so its numbers are on the request_finished log.
+    "sensors.perf.PerformanceMiddleware",
     # Disabled because I don't really need it and to reduce writes.
     # "request.middleware.RequestMiddleware",
 ]
@@ -89,8 +92,45 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "database" / "db.sqlite3",
+        # Keep each worker's connection (and its page cache and mmap) across
+        # requests rather than reopening the file every time.
+        "CONN_MAX_AGE": int(os.environ.get("DJANGO_CONN_MAX_AGE", "600")),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            # Take the write lock at BEGIN, so a transaction that reads then
+            # writes waits for busy_timeout instead of failing with "database
+            # is locked" when another worker is writing.
+            "transaction_mode": "IMMEDIATE",
+        },
+    }
+}
+
+# Caches aggregate and chart queries (see sensors.caching). Local memory is
+# per worker; DJANGO_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# with a directory as DJANGO_CACHE_LOCATION shares one cache between them.
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "DJANGO_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.environ.get("DJANGO_CACHE_LOCATION", "sensors"),
     }
 }
+if CACHES["default"]["BACKEND"].startswith("django.core.cache.backends."):
+    CACHES["default"]["OPTIONS"] = {
+        "MAX_ENTRIES": int(os.environ.get("DJANGO_CACHE_MAX_ENTRIES", "10000"))
+    }
+
+# Applied to every new SQLite connection by sensors.sqlite.
+SENSORS_SQLITE_PRAGMAS = {
+    "journal_mode": os.environ.get("SENSORS_SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.environ.get("SENSORS_SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.environ.get("SENSORS_SQLITE_BUSY_TIMEOUT", "5000")),
+    "mmap_size": int(os.environ.get("SENSORS_SQLITE_MMAP_SIZE", str(256 * 2**20))),
+    # Negative means KiB rather than pages.
+    "cache_size": int(os.environ.get("SENSORS_SQLITE_CACHE_SIZE", "-65536")),
+    "temp_store": os.environ.get("SENSORS_SQLITE_TEMP_STORE", "MEMORY"),
+}
 
 
 # Password validation
@@ -151,6 +191,61 @@ REST_FRAMEWORK = {
 
 AUTH_USER_MODEL = "sensors.User"
 
+# List readings as JSON/msgpack straight from database rows rather than
+# through ReadingSerializer. The output is the same either way.
+SENSORS_FAST_READING_LIST = (
+    os.environ.get("SENSORS_FAST_READING_LIST", "True") == "True"
+)
+
+# Acknowledge ingest requests with a 202 once they're spooled, and write them
+# in batches from a writer thread (see sensors.buffer).
+SENSORS_INGEST_BUFFER = os.environ.get("SENSORS_INGEST_BUFFER", "False") == "True"
+SENSORS_INGEST_FLUSH_MS = int(os.environ.get("SENSORS_INGEST_FLUSH_MS", "200"))
+SENSORS_INGEST_FLUSH_ROWS = int(os.environ.get("SENSORS_INGEST_FLUSH_ROWS", "5000"))
+SENSORS_INGEST_MAX_PENDING = int(os.environ.get("SENSORS_INGEST_MAX_PENDING", "100000"))
+SENSORS_INGEST_SPOOL_DIR = Path(
+    os.environ.get("SENSORS_INGEST_SPOOL_DIR", BASE_DIR / "database" / "spool")
+)
+
+# Also keep readings in the compact layout (see sensors.compact).
+SENSORS_COMPACT_READINGS = os.environ.get("SENSORS_COMPACT_READINGS", "False") == "True"
+# And read them from it, once compact_readings --backfill has caught up.
+SENSORS_COMPACT_READS = os.environ.get("SENSORS_COMPACT_READS", "False") == "True"
+
+# Serve the dashboard's live stream (/api/async/readings/stream/). Each open
+# stream holds a whole worker under WSGI, so only turn it on under ASGI.
+SENSORS_LIVE_STREAM = os.environ.get("SENSORS_LIVE_STREAM", "False") == "True"
+SENSORS_LIVE_STREAM_SECONDS = int(os.environ.get("SENSORS_LIVE_STREAM_SECONDS", "300"))
+
+# Reading queries over a range that ended more than this many seconds ago
+# aren't expecting new readings, and may be cached by the browser for
+# SENSORS_CLOSED_RANGE_MAX_AGE seconds (see sensors.conditional).
+SENSORS_CLOSED_RANGE_SECONDS = int(
+    os.environ.get("SENSORS_CLOSED_RANGE_SECONDS", "3600")
+)
+SENSORS_CLOSED_RANGE_MAX_AGE = int(
+    os.environ.get("SENSORS_CLOSED_RANGE_MAX_AGE", "86400")
+)
+
+# Requests that run more SQL queries than this log a "query budget exceeded"
+# warning (see sensors.perf). Budgets are by URL name, with a default.
+SENSORS_QUERY_BUDGETS = {
+    "default": int(os.environ.get("SENSORS_QUERY_BUDGET", "20")),
+    # A cold cache reads each block of buckets separately.
+    "reading-aggregate": 40,
+}
+
+# Each process's /metrics samples are kept in a file here (see
+# sensors.metrics); gunicorn.conf.py empties it when the server starts.
+# Scrapers authenticate with "Authorization: Bearer <SENSORS_METRICS_TOKEN>";
+# without a token, /metrics is only for staff users.
+SENSORS_METRICS_DIR = Path(
+    os.environ.get(
+        "SENSORS_METRICS_DIR", Path(tempfile.gettempdir()) / "sensors-metrics"
+    )
+)
+SENSORS_METRICS_TOKEN = os.environ.get("SENSORS_METRICS_TOKEN", "")
+
 
 LOGGING = {
     "version": 1,
@@ -238,5 +333,18 @@ STATICFILES_DIRS = [
     BASE_DIR / "dist",
 ]
 
+# Where export_snapshots keeps each owner's Parquet snapshot.
+SENSORS_EXPORT_DIR = Path(
+    os.environ.get("SENSORS_EXPORT_DIR", BASE_DIR / "database" / "exports")
+)
+
+# prune_readings deletes raw readings that were ingested more than this many
+# days ago, and minute rollups older than the second setting; the hour and
+# day rollups are kept. 0 keeps everything.
+SENSORS_RAW_RETENTION_DAYS = int(os.environ.get("SENSORS_RAW_RETENTION_DAYS", "0"))
+SENSORS_MINUTE_ROLLUP_RETENTION_DAYS = int(
+    os.environ.get("SENSORS_MINUTE_ROLLUP_RETENTION_DAYS", "0")
+)
+
 LOGIN_URL = "/api/auth/login/"
 LOGIN_REDIRECT_URL = "/"
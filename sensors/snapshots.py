@@ -0,0 +1,215 @@
+"""
+Append-only Parquet snapshots of each owner's readings.
+
+Reading ids follow commit order (see ``sensors.ingest.save_readings``), so
+each run of ``export_snapshots`` only has to export rows with an id greater
+than the last one it wrote. Rows are partitioned into one directory per
+(UTC) day under ``SENSORS_EXPORT_DIR/<owner id>/``, and ``manifest.json``
+records the files, the last exported id and the owner's
+``readings_rewritten`` when the snapshot was started.
+
+Late readings still get ids after the last exported one, so they're
+appended like any others. Anything that rewrites readings rather than
+adding them (an edit, a delete, pruning) sets ``readings_rewritten``, and a
+snapshot with a different one is stale: downloads stop using it, and the
+next run starts it over.
+"""
+
+import collections
+import datetime
+import json
+import os
+import uuid
+from pathlib import Path
+
+import django.conf
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import sensors.export
+import sensors.models
+
+MANIFEST = "manifest.json"
+
+TIMESTAMP = sensors.export.READING_SCHEMA.names.index("timestamp")
+
+
+def owner_dir(owner_id):
+    return Path(django.conf.settings.SENSORS_EXPORT_DIR) / owner_id.hex
+
+
+def read_manifest(owner_id):
+    try:
+        with open(owner_dir(owner_id) / MANIFEST) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return new_manifest(owner_id, None)
+
+
+def new_manifest(owner_id, rewritten):
+    return {
+        "owner_id": owner_id.hex,
+        "readings_rewritten": rewritten,
+        "last_id": None,
+        "rows": 0,
+        "files": [],
+    }
+
+
+def readings_rewritten(owner_id):
+    """
+    The owner's ``readings_rewritten``, as it's kept in the manifest.
+    """
+    rewritten = (
+        sensors.models.User.objects.filter(id=owner_id)
+        .values_list("readings_rewritten", flat=True)
+        .get()
+    )
+    return rewritten and rewritten.isoformat()
+
+
+def write_manifest(owner_id, manifest):
+    path = owner_dir(owner_id) / MANIFEST
+    tmp = _tmp_path(path)
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _tmp_path(path):
+    # Files are written under a temporary name and renamed over the target,
+    # so readers never see a partial file.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path.with_name(f".{path.name}.tmp")
+
+
+def write_tables(path, tables):
+    """
+    Write Arrow tables in ``READING_SCHEMA`` to one Parquet file at ``path``,
+    replacing it atomically.
+    """
+    tmp = _tmp_path(path)
+    with pq.ParquetWriter(tmp, sensors.export.READING_SCHEMA) as writer:
+        for table in tables:
+            writer.write_table(table)
+    os.replace(tmp, path)
+
+
+def update_snapshot(owner_id, chunk_size=sensors.export.CHUNK_SIZE):
+    """
+    Append the owner's readings newer than the manifest's ``last_id``, or
+    start the snapshot over if their ``readings_rewritten`` has changed.
+
+    Returns the number of rows appended.
+    """
+    # Read before the readings, so a change made while they're exported
+    # is caught next time.
+    rewritten = readings_rewritten(owner_id)
+    manifest = read_manifest(owner_id)
+    if manifest.get("readings_rewritten") != rewritten:
+        stale = [owner_dir(owner_id) / entry["path"] for entry in manifest["files"]]
+        manifest = new_manifest(owner_id, rewritten)
+        write_manifest(owner_id, manifest)
+        for path in stale:
+            path.unlink(missing_ok=True)
+    readings = sensors.models.Reading.objects.filter(owner_id=owner_id)
+    if manifest["last_id"] is not None:
+        readings = readings.filter(id__gt=uuid.UUID(manifest["last_id"]))
+
+    appended = 0
+    for rows in sensors.export.iter_chunks(readings, chunk_size):
+        days = collections.defaultdict(list)
+        for row in rows:
+            day = row[TIMESTAMP].astimezone(datetime.timezone.utc).date()
+            days[day.isoformat()].append(row)
+        for day, day_rows in sorted(days.items()):
+            path = f"{day}/{day_rows[0][0].hex}.parquet"
+            write_tables(
+                owner_dir(owner_id) / path, [sensors.export.to_table(day_rows)]
+            )
+            manifest["files"].append(
+                {
+                    "path": path,
+                    "day": day,
+                    "rows": len(day_rows),
+                    "first_id": str(day_rows[0][0]),
+                    "last_id": str(day_rows[-1][0]),
+                }
+            )
+        manifest["last_id"] = str(rows[-1][0])
+        manifest["rows"] += len(rows)
+        write_manifest(owner_id, manifest)
+        appended += len(rows)
+    return appended
+
+
+def compact_snapshot(owner_id, before):
+    """
+    Merge each day's files into one, for days before ``before`` (a date) that
+    no longer receive new readings.
+
+    Returns the number of days compacted.
+    """
+    manifest = read_manifest(owner_id)
+    by_day = collections.defaultdict(list)
+    for entry in manifest["files"]:
+        by_day[entry["day"]].append(entry)
+
+    compacted = 0
+    for day, entries in sorted(by_day.items()):
+        if len(entries) < 2 or datetime.date.fromisoformat(day) >= before:
+            continue
+        entries.sort(key=lambda entry: entry["first_id"])
+        paths = [owner_dir(owner_id) / entry["path"] for entry in entries]
+        path = f"{day}/{uuid.UUID(entries[0]['first_id']).hex}-all.parquet"
+        merged = owner_dir(owner_id) / path
+        write_tables(merged, (pq.read_table(part) for part in paths))
+
+        manifest["files"] = [e for e in manifest["files"] if e["day"] != day] + [
+            {
+                "path": path,
+                "day": day,
+                "rows": sum(entry["rows"] for entry in entries),
+                "first_id": entries[0]["first_id"],
+                "last_id": max(entry["last_id"] for entry in entries),
+            }
+        ]
+        write_manifest(owner_id, manifest)
+        for part in paths:
+            if part != merged:
+                part.unlink()
+        compacted += 1
+
+    manifest["files"].sort(key=lambda entry: (entry["day"], entry["first_id"]))
+    write_manifest(owner_id, manifest)
+    return compacted
+
+
+def snapshot_tables(owner_id):
+    """
+    The owner's snapshot as an iterable of Arrow tables followed by any
+    readings newer than the snapshot, or ``None`` if there's no usable
+    snapshot (none yet, or a stale one).
+
+    Only the readings after the manifest's ``last_id`` come from the
+    database, via a primary key range.
+    """
+    manifest = read_manifest(owner_id)
+    stale = manifest.get("readings_rewritten") != readings_rewritten(owner_id)
+    if stale or manifest["last_id"] is None:
+        return None
+    paths = [owner_dir(owner_id) / entry["path"] for entry in manifest["files"]]
+    if not all(path.exists() for path in paths):
+        return None
+
+    def tables():
+        for path in paths:
+            for batch in pq.ParquetFile(path).iter_batches():
+                yield pa.Table.from_batches([batch])
+        newer = sensors.models.Reading.objects.filter(
+            owner_id=owner_id, id__gt=uuid.UUID(manifest["last_id"])
+        )
+        for rows in sensors.export.iter_chunks(newer):
+            yield sensors.export.to_table(rows)
+
+    return tables()
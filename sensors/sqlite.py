@@ -0,0 +1,33 @@
+"""
+Per-connection SQLite tuning.
+
+Every new connection gets ``SENSORS_SQLITE_PRAGMAS`` applied. WAL lets the
+dashboard's reads carry on while a gateway's batch is being written, instead
+of queueing behind the rollback journal's exclusive lock.
+"""
+
+import re
+
+import django.conf
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Pragma values are spliced into the statement, so only allow plain words and
+# integers.
+_VALUE = re.compile(r"-?\w+")
+
+
+def apply_pragmas(cursor, pragmas):
+    for name, value in pragmas.items():
+        value = str(value)
+        if not _VALUE.fullmatch(name) or not _VALUE.fullmatch(value):
+            raise ValueError(f"Bad SQLite pragma: {name}={value}")
+        cursor.execute(f"PRAGMA {name} = {value}")
+
+
+@receiver(connection_created)
+def _tune_connection(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        apply_pragmas(cursor, django.conf.settings.SENSORS_SQLITE_PRAGMAS)
@@ -1 +1,1497 @@
-# Create your tests here.
+import asyncio
+import base64
+import datetime
+import io
+import itertools
+import json
+import tempfile
+import unittest.mock
+import uuid
+from pathlib import Path
+
+import django.core.cache
+import django.db
+import django.test
+import django.utils.timezone
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+from asgiref.sync import sync_to_async
+
+import sensors.async_views
+import sensors.buffer
+import sensors.caching
+import sensors.device_names
+import sensors.export
+import sensors.ingest
+import sensors.live
+import sensors.metrics
+import sensors.models
+import sensors.retention
+import sensors.rollups
+import sensors.snapshots
+import sensors.timeseries
+import sensors.uuid7
+from sensors.uuid7 import uuid7_at
+
+MAC = "00:00:00:00:00:01"
+
+
+class ReadingsTestCase(django.test.TestCase):
+    def setUp(self):
+        self.user = sensors.models.User.objects.create_user("owner", password="pw")
+        self.client.force_login(self.user)
+        django.core.cache.cache.clear()
+
+    def rows(self, count=1, mac=MAC, at=None, **values):
+        """
+        Cleaned reading dicts a second apart, the last at ``at`` (default
+        now).
+        """
+        at = at or django.utils.timezone.now()
+        return sensors.ingest.validate_readings(
+            [
+                {
+                    "mac": mac,
+                    "type": "RuuviTag",
+                    "timestamp": (
+                        at - datetime.timedelta(seconds=count - 1 - index)
+                    ).isoformat(),
+                    "temperature": 20.0 + index,
+                    **values,
+                }
+                for index in range(count)
+            ]
+        )
+
+    def save(self, count=1, **kwargs):
+        return sensors.ingest.save_readings(self.user.id, self.rows(count, **kwargs))
+
+    def use_export_dir(self):
+        """
+        Point ``SENSORS_EXPORT_DIR`` at a temporary directory for the test.
+        """
+        exports = tempfile.TemporaryDirectory()
+        self.addCleanup(exports.cleanup)
+        settings = django.test.override_settings(SENSORS_EXPORT_DIR=Path(exports.name))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        return Path(exports.name)
+
+    def save_behind(self, when, **kwargs):
+        """
+        Save a reading whose id was minted at ``when``, as a batch that
+        committed after newer ids would be.
+        """
+        (row,) = self.rows(**kwargs)
+        reading = sensors.models.Reading(id=uuid7_at(when), owner=self.user, **row)
+        with django.db.transaction.atomic():
+            sensors.models.Reading.objects.bulk_create([reading])
+            sensors.ingest.update_derived(self.user.id, [reading])
+        return reading
+
+
+class ConditionalGetTests(ReadingsTestCase):
+    url = "/api/readings/"
+
+    def test_not_modified(self):
+        self.save(3)
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_new_readings(self):
+        self.save(3)
+        etag = self.client.get(self.url)["ETag"]
+        self.save(1)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_batch_committed_behind_newer_ids(self):
+        (newest,) = self.save(1)
+        etag = self.client.get(self.url)["ETag"]
+        self.save_behind(newest.timestamp - datetime.timedelta(seconds=1))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 2)
+
+    def test_delete(self):
+        readings = self.save(2)
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.delete(f"{self.url}{readings[0].id}/")
+        self.assertEqual(response.status_code, 204)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class CachingTests(ReadingsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.at = django.utils.timezone.now() - datetime.timedelta(minutes=5)
+        self.start = self.at - datetime.timedelta(hours=2)
+        self.end = self.at + datetime.timedelta(minutes=10)
+
+    def count(self):
+        partials = sensors.caching.aggregate(
+            self.user.id, self.start, self.end, 60, ["temperature"]
+        )
+        return sum(partial["count"] for partial in partials)
+
+    def series(self):
+        series = sensors.caching.decimated_series(
+            self.user.id, self.start, self.end, ["temperature"], 100
+        )
+        return len(series[MAC]["temperature"])
+
+    def test_open_block_sees_batch_committed_behind_newer_ids(self):
+        self.save(3, at=self.at)
+        self.assertEqual(self.count(), 3)
+        self.save_behind(self.at, at=self.at - datetime.timedelta(minutes=1))
+        self.assertEqual(self.count(), 4)
+
+    def test_series_sees_batch_committed_behind_newer_ids(self):
+        self.save(3, at=self.at)
+        self.assertEqual(self.series(), 3)
+        self.save_behind(self.at, at=self.at - datetime.timedelta(minutes=1))
+        self.assertEqual(self.series(), 4)
+
+    def test_closed_block_sees_late_reading(self):
+        self.start -= datetime.timedelta(days=1)
+        self.save(3, at=self.at - datetime.timedelta(days=1))
+        self.assertEqual(self.count(), 3)
+        self.save(1, at=self.at - datetime.timedelta(days=1, minutes=1))
+        self.assertEqual(self.count(), 4)
+
+    def test_chart_without_devices(self):
+        self.save(3)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.user.get_chart_data(), {"datasets": []})
+
+    def test_chart(self):
+        sensors.models.Device.objects.create(owner=self.user, mac=MAC, name="Porch")
+        self.save(3)
+        (dataset,) = self.user.get_chart_data()["datasets"]
+        self.assertEqual(dataset["label"], "Porch")
+        self.assertEqual(len(dataset["data"]), 3)
+
+
+class ReadingRowsTests(ReadingsTestCase):
+    """
+    The fast reading list gives exactly what the serializer does.
+    """
+
+    url = "/api/readings/"
+
+    def setUp(self):
+        super().setUp()
+        sensors.models.Device.objects.create(owner=self.user, mac=MAC, name="Shed")
+        at = django.utils.timezone.now().replace(microsecond=123456)
+        self.save(3, at=at, humidity=50.25, bleName="tag")
+        # No device, so no name; no humidity or BLE name.
+        self.save(3, mac="00:00:00:00:00:02", at=at)
+
+    def get(self, params, fast):
+        with self.settings(SENSORS_FAST_READING_LIST=fast):
+            response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def assertSame(self, params):
+        expected = self.get(params, fast=False)
+        self.assertEqual(self.get(params, fast=True), expected)
+        return expected
+
+    def test_default(self):
+        data = self.assertSame({})
+        self.assertEqual(data["count"], 6)
+        names = {row["device_name"] for row in data["results"]}
+        self.assertEqual(names, {"Shed", None})
+        self.assertIn(None, {row["humidity"] for row in data["results"]})
+        self.assertIn(".123456+", data["results"][0]["timestamp"])
+
+    def test_fields(self):
+        self.assertSame({"fields": "device_name,mac,timestamp,temperature,humidity"})
+        self.assertSame({"fields!": "url,gatewayFree"})
+
+    def test_ordering_and_filters(self):
+        self.assertSame({"ordering": "timestamp", "mac": MAC, "limit": 2})
+
+    def test_cursor(self):
+        params = {"pagination": "cursor", "limit": 4, "ordering": "timestamp"}
+        first = self.assertSame(params)
+        self.assertEqual(len(first["results"]), 4)
+        cursor = first["next"].split("cursor=")[1].split("&")[0]
+        second = self.assertSame({**params, "cursor": cursor})
+        self.assertEqual(len(second["results"]), 2)
+
+    def test_without_count(self):
+        data = self.assertSame({"count": "false", "limit": 2, "offset": 1})
+        self.assertIsNone(data["count"])
+
+
+class PaginationTests(ReadingsTestCase):
+    url = "/api/readings/"
+
+    def setUp(self):
+        super().setUp()
+        self.ids = [str(reading.id) for reading in self.save(7)]
+
+    def get(self, url=None, params=None, **headers):
+        response = self.client.get(url or self.url, params, **headers)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def ids_of(self, data):
+        return [row["url"].rstrip("/").rsplit("/", 1)[1] for row in data["results"]]
+
+    def walk(self, params):
+        ids = []
+        url = None
+        while True:
+            data = self.get(url, None if url else params).json()
+            ids += self.ids_of(data)
+            url = data["next"]
+            if url is None:
+                return ids
+
+    def test_offset(self):
+        data = self.get(params={"limit": 3, "offset": 3}).json()
+        self.assertEqual(data["count"], 7)
+        self.assertEqual(self.ids_of(data), self.ids[::-1][3:6])
+        self.assertIn("offset=6", data["next"])
+        self.assertIsNotNone(data["previous"])
+        self.assertEqual(self.walk({"limit": 3}), self.ids[::-1])
+
+    def test_without_count(self):
+        data = self.get(params={"limit": 3, "count": "false"}).json()
+        self.assertIsNone(data["count"])
+        self.assertEqual(self.ids_of(data), self.ids[::-1][:3])
+        self.assertIn("offset=3", data["next"])
+        self.assertEqual(self.walk({"limit": 3, "count": "false"}), self.ids[::-1])
+        last = self.get(params={"limit": 3, "offset": 6, "count": "false"}).json()
+        self.assertIsNone(last["next"])
+
+    def test_cursor(self):
+        data = self.get(params={"pagination": "cursor", "limit": 3}).json()
+        self.assertNotIn("count", data)
+        self.assertIn("cursor=", data["next"])
+        self.assertEqual(
+            self.walk({"pagination": "cursor", "limit": 3}), self.ids[::-1]
+        )
+        self.assertEqual(
+            self.walk({"pagination": "cursor", "limit": 3, "ordering": "id"}),
+            self.ids,
+        )
+        self.assertEqual(
+            self.walk({"pagination": "cursor", "limit": 2, "ordering": "timestamp"}),
+            self.ids,
+        )
+
+    def test_cursor_previous(self):
+        first = self.get(params={"pagination": "cursor", "limit": 3}).json()
+        second = self.get(first["next"]).json()
+        back = self.get(second["previous"]).json()
+        self.assertEqual(self.ids_of(back), self.ids_of(first))
+
+    def test_link_headers(self):
+        response = self.get(
+            params={"limit": 3, "offset": 3, "format": "arrow"},
+        )
+        self.assertEqual(response["X-Total-Count"], "7")
+        self.assertIn('rel="next"', response["Link"])
+        self.assertIn('rel="previous"', response["Link"])
+        response = self.get(
+            params={"pagination": "cursor", "limit": 3, "format": "arrow"}
+        )
+        self.assertNotIn("X-Total-Count", response)
+        self.assertIn('rel="next"', response["Link"])
+        self.assertNotIn('rel="previous"', response["Link"])
+
+    def test_invalid_cursor(self):
+        for cursor in (
+            "garbage",
+            base64.b64encode(b"o=-5").decode(),
+            base64.b64encode(b"p=zzz").decode(),
+            base64.b64encode(b"p=2026-01-01&o=1").decode(),
+        ):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(self.url, {"cursor": cursor})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json(), {"detail": "Invalid cursor"})
+
+
+class ColumnarRendererTests(ReadingsTestCase):
+    url = "/api/readings/"
+
+    def setUp(self):
+        super().setUp()
+        sensors.models.Device.objects.create(owner=self.user, mac=MAC, name="Shed")
+        self.save(3, humidity=50.25)
+        self.save(2, mac="00:00:00:00:00:02")
+
+    def table(self, format, **params):
+        response = self.client.get(self.url, {**params, "format": format})
+        self.assertEqual(response.status_code, 200)
+        if format == "arrow":
+            self.assertEqual(
+                response["Content-Type"], "application/vnd.apache.arrow.stream"
+            )
+            return pa.ipc.open_stream(response.content).read_all()
+        self.assertEqual(response["Content-Type"], "application/vnd.apache.parquet")
+        return pq.read_table(io.BytesIO(response.content))
+
+    def test_same_rows_as_json(self):
+        results = self.client.get(self.url).json()["results"]
+        for format in ("arrow", "parquet"):
+            with self.subTest(format=format):
+                table = self.table(format)
+                self.assertTrue(table.schema.equals(sensors.export.API_SCHEMA))
+                rows = table.to_pylist()
+                self.assertEqual(len(rows), len(results))
+                for row, result in zip(rows, results):
+                    result = dict(result)
+                    pk = result.pop("url").rstrip("/").rsplit("/", 1)[1]
+                    self.assertEqual(row.pop("id"), uuid.UUID(pk).hex)
+                    self.assertEqual(
+                        row.pop("timestamp"),
+                        datetime.datetime.fromisoformat(result.pop("timestamp")),
+                    )
+                    self.assertEqual(row, result)
+
+    def test_fields(self):
+        for format in ("arrow", "parquet"):
+            with self.subTest(format=format):
+                table = self.table(format, fields="temperature,mac,device_name")
+                self.assertEqual(
+                    table.column_names, ["device_name", "mac", "temperature"]
+                )
+                self.assertEqual(table.schema.field("temperature").type, pa.float64())
+                table = self.table(format, **{"fields!": "id,gatewayFree"})
+                self.assertEqual(
+                    table.column_names,
+                    [
+                        name
+                        for name in sensors.export.API_SCHEMA.names
+                        if name not in ("id", "gatewayFree")
+                    ],
+                )
+
+
+@unittest.mock.patch.object(sensors.buffer.IngestBuffer, "_start")
+class IngestBufferTests(ReadingsTestCase):
+    def setUp(self):
+        super().setUp()
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        self.spool = Path(spool.name)
+        self.buffer = sensors.buffer.IngestBuffer(self.spool, flush_ms=1)
+
+    def readings(self):
+        return sensors.models.Reading.objects.filter(owner=self.user)
+
+    def test_flush(self, start):
+        first = self.buffer.submit(self.user.id, self.rows(2))
+        self.buffer.submit(self.user.id, self.rows(3))
+        self.assertEqual(first, {"count": 2, "first_id": None, "last_id": None})
+        self.buffer.flush()
+        self.assertEqual(self.readings().count(), 5)
+        self.assertEqual(self.buffer.stats(), {"pending": 0, "commits": 1})
+        self.assertEqual(list(self.spool.glob("*.jsonl")), [])
+
+    def test_drain(self, start):
+        self.buffer.submit(self.user.id, self.rows(2))
+        self.assertFalse(self.buffer.drain(timeout=0))
+        self.buffer.flush()
+        self.assertTrue(self.buffer.drain(timeout=0))
+
+    def test_ids_follow_commit_order(self, start):
+        self.buffer.submit(self.user.id, self.rows(2))
+        taken = self.buffer._take(wait=False)
+        (saved,) = self.save(1)
+        self.buffer._flush(taken)
+        buffered = self.readings().exclude(id=saved.id)
+        self.assertTrue(all(reading.id > saved.id for reading in buffered))
+
+    def test_replay_skips_committed_segment(self, start):
+        self.buffer.submit(self.user.id, self.rows(2))
+        batch, segment = self.buffer._take(wait=False)
+        sensors.buffer.write_segment(segment, batch)
+        # The process dies before deleting the segment.
+        segment.close()
+        self.assertEqual(sensors.buffer.replay_spool(self.spool), 0)
+        self.assertEqual(self.readings().count(), 2)
+        self.assertEqual(list(self.spool.glob("*.jsonl")), [])
+        self.assertFalse(sensors.models.SpoolCommit.objects.exists())
+
+    def test_replay(self, start):
+        self.buffer.submit(self.user.id, self.rows(2))
+        self.buffer._take(wait=False)[1].close()
+        self.assertEqual(sensors.buffer.replay_spool(self.spool), 2)
+        self.assertEqual(self.readings().count(), 2)
+
+    def test_locked_database_retried(self, start):
+        self.buffer.submit(self.user.id, self.rows(3))
+        write_batch = sensors.buffer.write_batch
+        calls = []
+
+        def locked_once(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise django.db.OperationalError("database is locked")
+            return write_batch(*args, **kwargs)
+
+        with (
+            unittest.mock.patch.object(sensors.buffer, "write_batch", locked_once),
+            self.assertLogs("sensors.buffer", "ERROR"),
+        ):
+            self.buffer.flush()
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.readings().count(), 3)
+        self.assertEqual(self.buffer.stats(), {"pending": 0, "commits": 1})
+
+    def test_failed_request_dead_lettered(self, start):
+        update_derived = sensors.ingest.update_derived
+
+        def fail_bad(owner_id, readings):
+            if any(reading.mac == "bad" for reading in readings):
+                raise ValueError("bad reading")
+            update_derived(owner_id, readings)
+
+        self.buffer.submit(self.user.id, self.rows(2))
+        self.buffer.submit(self.user.id, self.rows(1, mac="bad"))
+        self.buffer.submit(self.user.id, self.rows(3))
+        with (
+            unittest.mock.patch.object(sensors.ingest, "update_derived", fail_bad),
+            self.assertLogs("sensors.buffer", "ERROR") as logs,
+        ):
+            self.buffer.flush()
+        self.assertIn("dead-lettered", logs.output[-1])
+        self.assertEqual(self.readings().count(), 5)
+        self.assertEqual(self.buffer.stats(), {"pending": 0, "commits": 1})
+        (dead,) = (self.spool / sensors.buffer.DEAD_LETTER_DIR).iterdir()
+        (line,) = dead.read_text().splitlines()
+        entry = json.loads(line)
+        self.assertEqual(entry["readings"][0]["mac"], "bad")
+        self.assertIn("bad reading", entry["error"])
+        self.assertEqual(list(self.spool.glob("*.jsonl")), [])
+
+
+class ExportTests(ReadingsTestCase):
+    url = "/download-parquet/"
+
+    def setUp(self):
+        super().setUp()
+        self.at = django.utils.timezone.now().replace(microsecond=0)
+        self.readings = self.save(5, at=self.at)
+        self.readings += self.save(4, mac="00:00:00:00:00:02", at=self.at)
+        self.readings.sort(key=lambda reading: reading.id)
+        # Small chunks, so every download spans several.
+        chunk_size = unittest.mock.patch.object(
+            sensors.export.stream_readings, "__defaults__", (2,)
+        )
+        chunk_size.start()
+        self.addCleanup(chunk_size.stop)
+
+    def test_iter_chunks(self):
+        readings = sensors.models.Reading.objects.filter(owner=self.user)
+        chunks = list(sensors.export.iter_chunks(readings.order_by("-id"), 4))
+        self.assertEqual([len(rows) for rows in chunks], [4, 4, 1])
+        self.assertEqual(
+            [row[0] for rows in chunks for row in rows],
+            [reading.id for reading in self.readings],
+        )
+        chunks = list(sensors.export.iter_chunks(readings.filter(mac=MAC), 2))
+        self.assertEqual([len(rows) for rows in chunks], [2, 2, 1])
+        self.assertEqual(list(sensors.export.iter_chunks(readings.none(), 2)), [])
+
+    def download(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        content = b"".join(response.streaming_content)
+        return pq.ParquetFile(io.BytesIO(content))
+
+    def ids(self, readings):
+        return [reading.id.hex for reading in readings]
+
+    def test_stream(self):
+        file = self.download()
+        self.assertEqual(file.metadata.num_row_groups, 5)
+        table = file.read()
+        self.assertTrue(table.schema.equals(sensors.export.READING_SCHEMA))
+        self.assertEqual(table.column("id").to_pylist(), self.ids(self.readings))
+
+    def test_filters(self):
+        middle = self.at - datetime.timedelta(seconds=2)
+        cases = [
+            ({"mac": MAC}, lambda reading: reading.mac == MAC),
+            ({"timestamp__gt": middle.isoformat()}, lambda r: r.timestamp > middle),
+            ({"timestamp__lt": middle.isoformat()}, lambda r: r.timestamp < middle),
+            (
+                {"mac": MAC, "timestamp__lt": middle.isoformat()},
+                lambda r: r.mac == MAC and r.timestamp < middle,
+            ),
+        ]
+        for params, wanted in cases:
+            with self.subTest(params=params):
+                table = self.download(**params).read()
+                self.assertEqual(
+                    table.column("id").to_pylist(),
+                    self.ids(filter(wanted, self.readings)),
+                )
+
+    def test_nothing_matches(self):
+        table = self.download(mac="nope").read()
+        self.assertEqual(table.num_rows, 0)
+        self.assertTrue(table.schema.equals(sensors.export.READING_SCHEMA))
+
+    def test_invalid_filter(self):
+        response = self.client.get(self.url, {"timestamp__gt": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("timestamp__gt", response.json())
+
+
+class SnapshotTests(ReadingsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_export_dir()
+
+    def update(self):
+        return sensors.snapshots.update_snapshot(self.user.id)
+
+    def download(self):
+        response = self.client.get("/download-parquet/")
+        self.assertEqual(response.status_code, 200)
+        content = b"".join(response.streaming_content)
+        return pq.read_table(io.BytesIO(content)).column("id").to_pylist()
+
+    def test_update(self):
+        readings = self.save(3)
+        self.assertEqual(self.update(), 3)
+        self.assertEqual(self.update(), 0)
+        readings += self.save(2)
+        self.assertEqual(self.update(), 2)
+        readings += self.save(1)
+        self.assertEqual(self.download(), [reading.id.hex for reading in readings])
+
+    def test_late_reading_appended(self):
+        readings = self.save(3)
+        self.update()
+        readings += self.save(
+            1, at=django.utils.timezone.now() - datetime.timedelta(days=2)
+        )
+        self.assertIsNotNone(sensors.snapshots.snapshot_tables(self.user.id))
+        self.assertEqual(self.update(), 1)
+        manifest = sensors.snapshots.read_manifest(self.user.id)
+        self.assertEqual(manifest["rows"], 4)
+        self.assertEqual(len(manifest["files"]), 2)
+        self.assertEqual(self.download(), [reading.id.hex for reading in readings])
+
+    def test_delete(self):
+        readings = self.save(3)
+        self.update()
+        self.client.delete(f"/api/readings/{readings[0].id}/")
+        self.assertIsNone(sensors.snapshots.snapshot_tables(self.user.id))
+        self.assertEqual(self.download(), [reading.id.hex for reading in readings[1:]])
+        self.assertEqual(self.update(), 2)
+        self.assertIsNotNone(sensors.snapshots.snapshot_tables(self.user.id))
+        self.assertEqual(self.download(), [reading.id.hex for reading in readings[1:]])
+
+    def test_edit(self):
+        (reading,) = self.save(1)
+        self.update()
+        response = self.client.patch(
+            f"/api/readings/{reading.id}/",
+            {"temperature": 30.0},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(sensors.snapshots.snapshot_tables(self.user.id))
+        self.assertEqual(self.update(), 1)
+        (table,) = sensors.snapshots.snapshot_tables(self.user.id)
+        self.assertEqual(table.column("temperature").to_pylist(), [30.0])
+
+
+class RollupTests(ReadingsTestCase):
+    """
+    Rollups kept up incrementally match ``rebuild()`` and aggregating the
+    readings directly.
+    """
+
+    def setUp(self):
+        super().setUp()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def at(self, seconds):
+        return self.midnight + datetime.timedelta(seconds=seconds)
+
+    def ingest(self, *readings):
+        """
+        Save ``(mac, seconds after midnight, temperature, humidity)``
+        readings as one batch.
+        """
+        return sensors.ingest.save_readings(
+            self.user.id,
+            sensors.ingest.validate_readings(
+                [
+                    {
+                        "mac": mac,
+                        "type": "RuuviTag",
+                        "timestamp": self.at(seconds).isoformat(),
+                        "temperature": temperature,
+                        "humidity": humidity,
+                    }
+                    for mac, seconds, temperature, humidity in readings
+                ]
+            ),
+        )
+
+    def rollups(self):
+        return sorted(
+            sensors.models.ReadingRollup.objects.filter(owner=self.user).values_list(
+                *sensors.rollups.COLUMNS
+            )
+        )
+
+    def direct(self):
+        """
+        Rollup rows worked out from the readings here, in Python.
+        """
+        partials = {}
+        for reading in sensors.models.Reading.objects.filter(owner=self.user):
+            epoch = int(reading.timestamp.timestamp())
+            for period in sensors.rollups.PERIODS:
+                key = (reading.owner_id, reading.mac, period, epoch // period * period)
+                partial = partials.setdefault(
+                    key, {metric: [] for metric in sensors.rollups.METRICS}
+                )
+                partial["count"] = partial.get("count", 0) + 1
+                for metric in sensors.rollups.METRICS:
+                    value = getattr(reading, metric)
+                    if value is not None:
+                        partial[metric].append(value)
+        rows = []
+        for key, partial in partials.items():
+            row = [*key, partial["count"]]
+            for metric in sensors.rollups.METRICS:
+                values = partial[metric]
+                if values:
+                    row += [len(values), sum(values), min(values), max(values)]
+                else:
+                    row += [0, None, None, None]
+            rows.append(tuple(row))
+        return sorted(rows)
+
+    def assertConsistent(self):
+        incremental = self.rollups()
+        self.assertEqual(incremental, self.direct())
+        sensors.rollups.rebuild(owner_id=self.user.id)
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_boundaries(self):
+        other = "00:00:00:00:00:02"
+        # Either side of midnight, and of the hour and minute boundaries
+        # either side of it.
+        self.ingest(
+            (MAC, -3601, 20.5, 50.25),
+            (MAC, -3599, 21.0, None),
+            (MAC, -61, 19.75, 49.5),
+            (MAC, -1, 19.5, 49.75),
+            (other, -1, 18.0, None),
+        )
+        self.ingest(
+            (MAC, 0, 19.25, 50.0),
+            (MAC, 59, 19.0, None),
+            (MAC, 60, 18.75, 50.5),
+            (other, 3599, 17.5, 40.0),
+            (other, 3600, 17.25, 40.25),
+        )
+        # Into buckets the first batch already filled.
+        self.ingest((MAC, -2, 22.0, 51.0), (MAC, 30, 17.0, 48.0))
+        self.assertConsistent()
+
+    def test_late_reading(self):
+        self.ingest((MAC, 0, 20.0, 50.0), (MAC, 10, 21.0, 51.0))
+        # A day late, into a bucket that's otherwise long finished.
+        self.ingest((MAC, -86400 + 30, 15.0, None))
+        self.assertConsistent()
+
+    def test_edit_and_delete(self):
+        readings = self.ingest(
+            (MAC, -30, 20.0, 50.0),
+            (MAC, 30, 21.0, 51.0),
+            (MAC, 90, 22.0, 52.0),
+        )
+        url = f"/api/readings/{readings[0].id}/"
+        response = self.client.patch(
+            url,
+            {"timestamp": self.at(3700).isoformat(), "temperature": 25.5},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertConsistent()
+        response = self.client.delete(f"/api/readings/{readings[2].id}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertConsistent()
+
+
+class RetentionTests(ReadingsTestCase):
+    def setUp(self):
+        super().setUp()
+        now = django.utils.timezone.now()
+        self.cutoff = now - datetime.timedelta(days=1)
+        old = now - datetime.timedelta(days=10)
+        # Across an hour boundary, ingested (by id) ten days ago.
+        self.old = [
+            self.save_behind(when, at=when)
+            for when in (
+                old.replace(minute=58) + index * datetime.timedelta(minutes=1)
+                for index in range(5)
+            )
+        ]
+        self.new = self.save(2)
+        self.other = sensors.models.User.objects.create_user("other")
+        sensors.ingest.save_readings(self.other.id, self.rows(2))
+
+    def prune(self, **kwargs):
+        return list(sensors.retention.prune_readings(self.cutoff, **kwargs))
+
+    def remaining(self):
+        return set(
+            sensors.models.Reading.objects.filter(owner=self.user).values_list(
+                "id", flat=True
+            )
+        )
+
+    def versions(self):
+        return dict(
+            sensors.models.User.objects.values_list("username", "readings_version")
+        )
+
+    def test_batches(self):
+        self.assertEqual(self.prune(batch_size=2), [2, 2, 1])
+        self.assertEqual(self.remaining(), {reading.id for reading in self.new})
+        self.assertEqual(self.prune(batch_size=2), [])
+
+    def test_cutoff_by_id(self):
+        millisecond = datetime.timedelta(milliseconds=1)
+        before = self.save_behind(self.cutoff - millisecond)
+        at = self.save_behind(self.cutoff)
+        after = self.save_behind(self.cutoff + millisecond)
+        self.assertEqual(sum(self.prune()), 6)
+        remaining = self.remaining()
+        self.assertNotIn(before.id, remaining)
+        self.assertIn(at.id, remaining)
+        self.assertIn(after.id, remaining)
+
+    def test_archive(self):
+        self.use_export_dir()
+        self.prune(batch_size=2, archive=True)
+        paths = sorted(sensors.retention.archive_dir().glob("*.parquet"))
+        self.assertEqual(len(paths), 3)
+        tables = [pq.read_table(path) for path in paths]
+        for table in tables:
+            self.assertTrue(table.schema.equals(sensors.export.READING_SCHEMA))
+        rows = pa.concat_tables(tables).to_pylist()
+        self.assertEqual(
+            [row["id"] for row in rows], [reading.id.hex for reading in self.old]
+        )
+        self.assertEqual(
+            [row["temperature"] for row in rows],
+            [reading.temperature for reading in self.old],
+        )
+
+    def test_rollups_kept(self):
+        rollups = sensors.models.ReadingRollup.objects.filter(owner=self.user)
+        coarse = rollups.exclude(period=sensors.rollups.MINUTE)
+        expected = list(coarse.values())
+        self.prune()
+        self.assertEqual(list(coarse.values()), expected)
+
+        minutes = rollups.filter(period=sensors.rollups.MINUTE)
+        recent = set(
+            minutes.filter(bucket__gte=self.cutoff.timestamp()).values_list("bucket")
+        )
+        self.assertEqual(sensors.retention.prune_minute_rollups(self.cutoff), 5)
+        self.assertEqual(set(minutes.values_list("bucket")), recent)
+        self.assertTrue(recent)
+        self.assertEqual(list(coarse.values()), expected)
+
+    def test_only_affected_owners_invalidated(self):
+        versions = self.versions()
+        self.prune(batch_size=2)
+        self.assertEqual(self.versions()["owner"], versions["owner"] + 3)
+        self.assertEqual(self.versions()["other"], versions["other"])
+        sensors.retention.prune_minute_rollups(self.cutoff)
+        self.assertEqual(self.versions()["owner"], versions["owner"] + 4)
+        self.assertEqual(self.versions()["other"], versions["other"])
+
+
+@django.test.override_settings(SENSORS_LIVE_STREAM=True)
+class LiveStreamTests(ReadingsTestCase):
+    url = "/api/async/readings/stream/"
+
+    def setUp(self):
+        super().setUp()
+        self.async_client.force_login(self.user)
+        self.since = django.utils.timezone.now() - datetime.timedelta(minutes=1)
+
+    async def stream(self, **params):
+        response = await self.async_client.get(
+            self.url, params or {"since": self.since.isoformat()}
+        )
+        self.assertEqual(response.status_code, 200)
+        return aiter(response.streaming_content)
+
+    async def next_event(self, content):
+        while True:
+            chunk = (await asyncio.wait_for(anext(content), 5)).decode()
+            if "event: readings" in chunk:
+                return [row["id"] for row in json.loads(chunk.split("data: ", 1)[1])]
+
+    @unittest.mock.patch.object(sensors.async_views, "STREAM_KEEPALIVE", 0.05)
+    async def test_catches_up_with_other_processes(self):
+        first = await sync_to_async(self.save)(2)
+        content = await self.stream()
+        self.assertEqual(
+            await self.next_event(content), [str(reading.id) for reading in first]
+        )
+        # Not published here, as if another process had ingested it.
+        second = await sync_to_async(self.save)(1)
+        self.assertEqual(
+            await self.next_event(content), [str(reading.id) for reading in second]
+        )
+        await content.aclose()
+
+    @unittest.mock.patch.object(sensors.async_views, "STREAM_KEEPALIVE", 60)
+    async def test_woken_by_ingest(self):
+        content = await self.stream()
+        await anext(content)
+        readings = await sync_to_async(self.save)(3)
+        sensors.live.broker.publish(self.user.id)
+        self.assertEqual(
+            await self.next_event(content), [str(reading.id) for reading in readings]
+        )
+        await content.aclose()
+
+    @unittest.mock.patch.object(sensors.async_views, "STREAM_KEEPALIVE", 0.05)
+    async def test_after(self):
+        first = await sync_to_async(self.save)(2)
+        content = await self.stream(after=str(first[0].id))
+        self.assertEqual(await self.next_event(content), [str(first[1].id)])
+        await content.aclose()
+
+    async def test_after_invalid(self):
+        response = await self.async_client.get(self.url, {"after": "nope"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("after", response.json())
+
+
+class DeviceStateTests(ReadingsTestCase):
+    def latest(self):
+        response = self.client.get("/api/devices/latest/")
+        return {state["mac"]: state["temperature"] for state in response.json()}
+
+    def test_ingest(self):
+        self.save(3)
+        self.save(1, mac="00:00:00:00:00:02", temperature=5.0)
+        self.assertEqual(self.latest(), {MAC: 22.0, "00:00:00:00:00:02": 5.0})
+
+    def test_edit(self):
+        readings = self.save(3)
+        response = self.client.patch(
+            f"/api/readings/{readings[-1].id}/",
+            {"temperature": 30.0},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.latest(), {MAC: 30.0})
+
+    def test_edit_mac(self):
+        readings = self.save(3)
+        response = self.client.patch(
+            f"/api/readings/{readings[-1].id}/",
+            {"mac": "00:00:00:00:00:02"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.latest(), {MAC: 21.0, "00:00:00:00:00:02": 22.0})
+
+    def test_delete(self):
+        readings = self.save(3)
+        self.client.delete(f"/api/readings/{readings[-1].id}/")
+        self.assertEqual(self.latest(), {MAC: 21.0})
+
+    def test_delete_last(self):
+        (reading,) = self.save(1)
+        self.client.delete(f"/api/readings/{reading.id}/")
+        self.assertEqual(self.latest(), {})
+        self.assertFalse(sensors.models.DeviceState.objects.exists())
+
+
+class UUIDv7Tests(django.test.SimpleTestCase):
+    # A clock reading at the start of a millisecond.
+    NOW = 1_760_000_000_000 * sensors.uuid7.NS_IN_MS
+
+    def generator(self, clock=None):
+        generator = sensors.uuid7.UUIDv7Generator()
+        generator.unix_time_ns_func = clock or (lambda: self.NOW)
+        return generator
+
+    def assertMonotonic(self, ids):
+        self.assertEqual(ids, sorted(set(ids)))
+
+    def assertV7(self, value):
+        self.assertEqual(value.version, 7)
+        self.assertEqual(value.variant, uuid.RFC_4122)
+
+    def mixed(self, generator):
+        ids = [generator()]
+        ids += generator.generate_many(5)
+        ids.append(generator())
+        ids.append(generator())
+        ids += generator.generate_many(1)
+        ids += generator.generate_many(300)
+        ids.append(generator())
+        return ids
+
+    def test_mixed_calls_frozen_clock(self):
+        ids = self.mixed(self.generator())
+        self.assertMonotonic(ids)
+        for value in ids:
+            self.assertV7(value)
+
+    def test_mixed_calls_ticking_clock(self):
+        ticks = itertools.count(self.NOW, 100_000)
+        ids = self.mixed(self.generator(lambda: next(ticks)))
+        self.assertMonotonic(ids)
+
+    def test_clock_going_backwards(self):
+        readings = iter([self.NOW, self.NOW - 10**9, self.NOW - 2 * 10**9] * 3)
+        generator = self.generator(lambda: next(readings))
+        ids = [generator(), *generator.generate_many(3), generator()]
+        ids += [*generator.generate_many(2), generator(), generator()]
+        self.assertMonotonic(ids)
+
+    def test_shared_generator(self):
+        generator = sensors.uuid7.LockedUUIDv7Generator()
+        ids = [generator(), *generator.generate_many(10), generator()]
+        self.assertMonotonic(ids)
+
+    def test_generate_many_overflow(self):
+        generator = self.generator()
+        first = generator()
+        generator.prev_rand_b = sensors.uuid7.V7_RAND_B_LIMIT - 10
+        ids = generator.generate_many(3)
+        self.assertMonotonic([first, *ids])
+        for value in ids:
+            self.assertV7(value)
+        # Moved on to the next tick of rand_a, in the same millisecond.
+        self.assertEqual(ids[0].int >> 80, first.int >> 80)
+        self.assertEqual((ids[0].int >> 64) & 0xFFF, ((first.int >> 64) & 0xFFF) + 1)
+
+    def test_generate_many_overflow_into_next_millisecond(self):
+        # The last rand_a tick of the millisecond.
+        generator = self.generator(lambda: self.NOW + sensors.uuid7.NS_IN_MS - 1)
+        first = generator()
+        self.assertEqual((first.int >> 64) & 0xFFF, 0xFFF)
+        generator.prev_rand_b = sensors.uuid7.V7_RAND_B_LIMIT - 10
+        ids = generator.generate_many(3)
+        self.assertMonotonic([first, *ids])
+        self.assertEqual(ids[0].int >> 80, (first.int >> 80) + 1)
+
+    def test_call_overflow(self):
+        # Frozen until the generator sleeps for the clock to tick.
+        ticks = iter([self.NOW, self.NOW, self.NOW + sensors.uuid7.NS_IN_MS])
+        generator = self.generator(lambda: next(ticks))
+        first = generator()
+        generator.prev_rand_b = sensors.uuid7.V7_RAND_B_LIMIT - 1
+        with (
+            unittest.mock.patch("time.sleep"),
+            self.assertWarns(UserWarning),
+        ):
+            second = generator()
+        self.assertMonotonic([first, second])
+        self.assertV7(second)
+        self.assertEqual(second.int >> 80, (first.int >> 80) + 1)
+
+    def test_floor_and_datetime(self):
+        when = datetime.datetime(2026, 1, 2, 3, 4, 5, 678000, datetime.timezone.utc)
+        floor = sensors.uuid7.uuid7_floor(when)
+        self.assertV7(floor)
+        self.assertEqual(sensors.uuid7.uuid7_datetime(floor), when)
+        at = uuid7_at(when)
+        self.assertV7(at)
+        self.assertEqual(sensors.uuid7.uuid7_datetime(at), when)
+        self.assertLessEqual(floor, at)
+        self.assertLess(
+            at, sensors.uuid7.uuid7_floor(when + datetime.timedelta(milliseconds=1))
+        )
+        self.assertLess(uuid7_at(when - datetime.timedelta(milliseconds=1)), floor)
+
+
+class DeviceNameCacheTests(django.test.SimpleTestCase):
+    def setUp(self):
+        self.now = 0
+        self.loads = []
+        self.names = {"a": "Porch"}
+        self.cache = sensors.device_names.DeviceNameCache(
+            self.load, clock=lambda: self.now
+        )
+
+    def load(self, owner_id):
+        self.loads.append(owner_id)
+        return dict(self.names)
+
+    def test_one_load_per_owner(self):
+        self.assertEqual(self.cache.get(1, "a"), "Porch")
+        self.assertIsNone(self.cache.get(1, "b"))
+        self.assertIsNone(self.cache.get(1, "b"))
+        self.assertEqual(self.loads, [1, 1])
+
+    def test_rename_elsewhere_seen_within_ttl(self):
+        self.cache.get(1, "a")
+        # Renamed by another process, so not invalidated here.
+        self.names["a"] = "Garden"
+        self.assertEqual(self.cache.get(1, "a"), "Porch")
+        self.now += self.cache.ttl
+        self.assertLessEqual(self.cache.ttl, 5)
+        self.assertEqual(self.cache.get(1, "a"), "Garden")
+
+    def test_invalidate(self):
+        self.cache.get(1, "a")
+        self.names["a"] = "Garden"
+        self.cache.invalidate(1)
+        self.assertEqual(self.cache.get(1, "a"), "Garden")
+
+
+class MetricsTests(django.test.SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings = django.test.override_settings(SENSORS_METRICS_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # This process gets a file in the directory, and there are only these
+        # metrics.
+        for patcher in [
+            unittest.mock.patch.object(sensors.metrics, "_file_pid", None),
+            unittest.mock.patch.object(sensors.metrics, "_file", None),
+            unittest.mock.patch.object(sensors.metrics, "_exited", None),
+            unittest.mock.patch.dict(sensors.metrics._metrics, clear=True),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.requests = sensors.metrics.Counter("requests_total", "Requests.")
+        self.latency = sensors.metrics.Histogram(
+            "latency_seconds", "Latency.", buckets=(0.1, 1)
+        )
+
+    def other_process(self, pid, *samples):
+        """
+        Write ``(name, labels, amount)`` samples as process ``pid`` would.
+        """
+        other = sensors.metrics._File(self.directory / f"{pid}.metrics")
+        for name, labels, amount in samples:
+            other.add(json.dumps([name, labels], sort_keys=True), amount)
+        other.map.close()
+        other.file.close()
+
+    def test_sums_across_files(self):
+        self.requests.inc(view="a")
+        self.requests.inc(2, view="b")
+        self.latency.observe(0.05)
+        self.other_process(
+            1,
+            ("requests_total", {"view": "a"}, 3),
+            ("latency_seconds_bucket", {"le": "1"}, 1),
+            ("latency_seconds_sum", {}, 0.5),
+        )
+        self.assertEqual(
+            sensors.metrics.collect(),
+            {
+                ("requests_total", (("view", "a"),)): 4,
+                ("requests_total", (("view", "b"),)): 2,
+                ("latency_seconds_bucket", (("le", "0.1"),)): 1,
+                ("latency_seconds_bucket", (("le", "1"),)): 1,
+                ("latency_seconds_sum", ()): 0.55,
+            },
+        )
+
+    def test_exposition(self):
+        self.requests.inc(view='say "hi"\n')
+        self.latency.observe(0.05)
+        self.latency.observe(0.5)
+        self.other_process(1, ("latency_seconds_bucket", {"le": "+Inf"}, 1))
+        self.assertEqual(
+            sensors.metrics.exposition(),
+            "# HELP latency_seconds Latency.\n"
+            "# TYPE latency_seconds histogram\n"
+            'latency_seconds_bucket{le="0.1"} 1.0\n'
+            'latency_seconds_bucket{le="1"} 2.0\n'
+            'latency_seconds_bucket{le="+Inf"} 3.0\n'
+            "latency_seconds_sum 0.55\n"
+            "latency_seconds_count 3.0\n"
+            "# HELP requests_total Requests.\n"
+            "# TYPE requests_total counter\n"
+            'requests_total{view="say \\"hi\\"\\n"} 1.0\n',
+        )
+
+    def test_retire(self):
+        self.other_process(1, ("requests_total", {}, 1))
+        self.other_process(2, ("requests_total", {}, 2))
+        sensors.metrics.retire(1)
+        sensors.metrics.retire(2)
+        sensors.metrics.retire(3)
+        self.assertEqual(
+            sorted(path.name for path in self.directory.iterdir()), ["exited.metrics"]
+        )
+        self.assertEqual(sensors.metrics.collect(), {("requests_total", ()): 3})
+
+    def test_clear(self):
+        self.requests.inc()
+        self.other_process(1, ("requests_total", {}, 1))
+        sensors.metrics.clear()
+        self.assertEqual(sensors.metrics.collect(), {})
+
+
+class AggregateTests(ReadingsTestCase):
+    url = "/api/readings/aggregate/"
+
+    def setUp(self):
+        super().setUp()
+        now = django.utils.timezone.now().replace(second=0, microsecond=0)
+        self.start = now - datetime.timedelta(hours=4, seconds=17)
+        self.end = now - datetime.timedelta(seconds=29)
+        # Every 37 seconds, so buckets hold different counts.
+        readings = []
+        for index in range(400):
+            readings.append(
+                {
+                    "mac": MAC,
+                    "type": "RuuviTag",
+                    "timestamp": (
+                        self.start + datetime.timedelta(seconds=37 * index - 60)
+                    ).isoformat(),
+                    "temperature": 15 + (index * 7 % 40) / 4,
+                    "humidity": None if index % 5 == 0 else 40 + index % 9,
+                }
+            )
+        sensors.ingest.save_readings(
+            self.user.id, sensors.ingest.validate_readings(readings)
+        )
+
+    def get(self, **params):
+        params = {
+            "start": self.start.isoformat(),
+            "end": self.end.isoformat(),
+            **params,
+        }
+        return self.client.get(self.url, params)
+
+    def expected(self, start, end, bucket):
+        """
+        ``{bucket: (count, temperature min, mean, max)}`` worked out here.
+        """
+        buckets = {}
+        for reading in sensors.models.Reading.objects.filter(
+            owner=self.user, timestamp__gte=start, timestamp__lt=end
+        ):
+            epoch = int(reading.timestamp.timestamp()) // bucket * bucket
+            buckets.setdefault(epoch, []).append(reading.temperature)
+        return {
+            epoch: (len(values), min(values), sum(values) / len(values), max(values))
+            for epoch, values in buckets.items()
+        }
+
+    def assertBuckets(self, data, start, end, bucket):
+        (device,) = data["devices"]
+        actual = {}
+        for summary in device["buckets"]:
+            epoch = datetime.datetime.fromisoformat(summary["timestamp"]).timestamp()
+            self.assertEqual(epoch % bucket, 0)
+            temperature = summary["temperature"]
+            actual[int(epoch)] = (
+                summary["count"],
+                temperature["min"],
+                temperature["mean"],
+                temperature["max"],
+            )
+        expected = self.expected(start, end, bucket)
+        self.assertEqual(actual.keys(), expected.keys())
+        for epoch, (count, low, mean, high) in expected.items():
+            self.assertEqual(actual[epoch][0], count)
+            self.assertEqual(actual[epoch][1], low)
+            self.assertAlmostEqual(actual[epoch][2], mean)
+            self.assertEqual(actual[epoch][3], high)
+
+    def test_bucket_width(self):
+        start = self.start
+        hours = datetime.timedelta(hours=1)
+        self.assertEqual(
+            sensors.timeseries.bucket_width(start, start + 24 * hours, 300), 300
+        )
+        self.assertEqual(sensors.timeseries.bucket_width(start, start + hours, 60), 60)
+        self.assertEqual(
+            sensors.timeseries.bucket_width(start, start + hours, 1000), 60
+        )
+        self.assertEqual(
+            sensors.timeseries.bucket_width(start, start + 24 * 400 * hours, 10),
+            40 * 24 * 60 * 60,
+        )
+
+    def test_buckets(self):
+        for bucket in (60, 300, 3600):
+            with self.subTest(bucket=bucket):
+                response = self.get(bucket=bucket, metrics="temperature")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()["bucket"], bucket)
+                self.assertBuckets(response.json(), self.start, self.end, bucket)
+
+    def test_across_cached_blocks(self):
+        # 60 second buckets make blocks of 100 minutes, so four hours spans
+        # several, and the later request reuses the cached ones.
+        self.assertEqual(sensors.caching.BLOCK_BUCKETS, 100)
+        first = self.get(bucket=60).json()
+        self.assertBuckets(first, self.start, self.end, 60)
+        start = self.start + datetime.timedelta(minutes=41, seconds=3)
+        response = self.client.get(
+            self.url,
+            {"start": start.isoformat(), "end": self.end.isoformat(), "bucket": 60},
+        )
+        self.assertBuckets(response.json(), start, self.end, 60)
+        self.assertEqual(self.get(bucket=60).json(), first)
+
+    def test_merge_partials(self):
+        def partial(bucket, count, low, high, total):
+            return {
+                "mac": MAC,
+                "bucket": bucket,
+                "count": count,
+                "temperature_count": count,
+                "temperature_sum": total,
+                "temperature_min": low,
+                "temperature_max": high,
+            }
+
+        merged = sensors.timeseries.merge_partials(
+            [
+                partial(120, 2, 1.0, 3.0, 4.0),
+                partial(60, 1, 5.0, 5.0, 5.0),
+                partial(120, 0, None, None, None),
+                partial(120, 1, 0.5, 0.5, 0.5),
+            ],
+            ["temperature"],
+        )
+        self.assertEqual(
+            merged,
+            [partial(60, 1, 5.0, 5.0, 5.0), partial(120, 3, 0.5, 3.0, 4.5)],
+        )
+
+    def test_empty_range(self):
+        start = self.start - datetime.timedelta(days=3)
+        params = {
+            "start": start.isoformat(),
+            "end": (start + datetime.timedelta(hours=1)).isoformat(),
+        }
+        for mode in ("buckets", "minmax"):
+            with self.subTest(mode=mode):
+                response = self.client.get(self.url, {**params, "mode": mode})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()["devices"], [])
+
+    def test_start_after_end(self):
+        response = self.get(start=self.end.isoformat(), end=self.start.isoformat())
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("start", response.json())
+
+    def test_too_many_buckets(self):
+        response = self.get(bucket=1)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("bucket", response.json())
+
+    def test_minmax_points(self):
+        for points in (2, 3, 50):
+            with self.subTest(points=points):
+                response = self.get(mode="minmax", points=points)
+                self.assertEqual(response.status_code, 200)
+                (device,) = response.json()["devices"]
+                for series in device["series"].values():
+                    self.assertLessEqual(len(series), points)
+        for points in (0, 1, sensors.timeseries.MAX_BUCKETS + 1):
+            with self.subTest(points=points):
+                response = self.get(mode="minmax", points=points)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("points", response.json())
+
+
+class DecimationTests(ReadingsTestCase):
+    url = "/api/readings/aggregate/"
+
+    def frame(self, count):
+        self.save(count)
+        now = django.utils.timezone.now()
+        return sensors.timeseries.load_frame(
+            self.user.id, now - datetime.timedelta(hours=1), now, ["temperature"]
+        )
+
+    def test_at_most_points(self):
+        frame = self.frame(50)
+        for points in (2, 3, 7, 10, 49, 50, 100):
+            series = sensors.timeseries.decimated_series(frame, ["temperature"], points)
+            self.assertLessEqual(len(series[MAC]["temperature"]), points)
+
+    def test_one_point(self):
+        with self.assertRaises(ValueError):
+            sensors.timeseries.decimate(self.frame(5), "temperature", 1)
+
+    def test_minmax_points(self):
+        response = self.client.get(self.url, {"mode": "minmax", "points": 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("points", response.json())
+
+    def test_minmax_range(self):
+        end = django.utils.timezone.now()
+        response = self.client.get(
+            self.url,
+            {
+                "mode": "minmax",
+                "start": (end - datetime.timedelta(days=60)).isoformat(),
+                "end": end.isoformat(),
+            },
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("start", response.json())
+
+    def test_minmax(self):
+        self.save(20)
+        response = self.client.get(
+            self.url, {"mode": "minmax", "points": 5, "metrics": "temperature"}
+        )
+        self.assertEqual(response.status_code, 200)
+        (device,) = response.json()["devices"]
+        self.assertLessEqual(len(device["series"]["temperature"]), 5)
+
+
+@django.test.override_settings(SENSORS_COMPACT_READINGS=True)
+class CompactReadsTests(ReadingsTestCase):
+    """
+    Reads from the compact layout match those from ``sensors_reading`` for
+    values on its steps.
+    """
+
+    def setUp(self):
+        super().setUp()
+        sensors.models.Device.objects.create(owner=self.user, mac=MAC, name="Shed")
+        self.end = django.utils.timezone.now().replace(microsecond=0)
+        for mac in (MAC, "00:00:00:00:00:02"):
+            self.save(
+                150,
+                mac=mac,
+                at=self.end - datetime.timedelta(seconds=1),
+                humidity=50.25,
+                battery=2.875,
+                rssi=-70,
+                gatewayFree=0.1,
+            )
+
+    def get(self, url, params=None, compact=False):
+        django.core.cache.cache.clear()
+        with self.settings(SENSORS_COMPACT_READS=compact):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assertSameJSON(self, url, params=None):
+        expected = self.get(url, params).json()
+        self.assertEqual(self.get(url, params, compact=True).json(), expected)
+        return expected
+
+    def test_list(self):
+        url = "/api/readings/"
+        self.assertSameJSON(url)
+        data = self.assertSameJSON(
+            url,
+            {
+                "mac": MAC,
+                "timestamp__gt": (self.end - datetime.timedelta(minutes=1)).isoformat(),
+                "ordering": "timestamp",
+                "fields": "device_name,mac,timestamp,temperature,humidity",
+                "limit": 20,
+                "offset": 10,
+            },
+        )
+        self.assertEqual(data["results"][0]["device_name"], "Shed")
+        self.assertEqual(len(data["results"]), 20)
+
+    def test_list_cursor(self):
+        params = {"pagination": "cursor", "ordering": "timestamp", "limit": 40}
+        pages = {}
+        for compact in (False, True):
+            response = self.get("/api/readings/", params, compact).json()
+            results = response["results"]
+            response = self.get(response["next"], compact=compact).json()
+            pages[compact] = results + response["results"]
+        self.assertEqual(len(pages[False]), 80)
+        self.assertEqual(pages[True], pages[False])
+
+    def test_async_list(self):
+        url = "/api/async/readings/"
+        first = self.assertSameJSON(url, {"limit": 30})
+        before = first["results"][-1]["url"].rstrip("/").rsplit("/", 1)[-1]
+        self.assertSameJSON(url, {"limit": 30, "before": before, "mac": MAC})
+
+    def test_export(self):
+        params = {"mac": MAC}
+        tables = [
+            pq.read_table(
+                io.BytesIO(
+                    b"".join(
+                        self.get(
+                            "/download-parquet/", params, compact
+                        ).streaming_content
+                    )
+                )
+            )
+            for compact in (False, True)
+        ]
+        self.assertEqual(tables[0].num_rows, 150)
+        self.assertTrue(tables[1].equals(tables[0]))
+
+    def test_aggregate(self):
+        start = self.end - datetime.timedelta(minutes=10)
+        args = (self.user.id, start, self.end, 60, sensors.timeseries.METRICS)
+        expected = list(sensors.timeseries.aggregate_readings(*args))
+        self.assertEqual(sum(partial["count"] for partial in expected), 300)
+        with self.settings(SENSORS_COMPACT_READS=True):
+            partials = list(sensors.timeseries.aggregate_readings(*args))
+        self.assertEqual(partials, expected)
+
+        params = {"start": start.isoformat(), "end": self.end.isoformat()}
+        data = self.assertSameJSON("/api/readings/aggregate/", params)
+        self.assertEqual(len(data["devices"]), 2)
+        data = self.assertSameJSON(
+            "/api/readings/aggregate/", {**params, "mode": "minmax", "points": 10}
+        )
+        self.assertEqual(len(data["devices"]), 2)
+
+
+class AsyncReadingListTests(ReadingsTestCase):
+    url = "/api/async/readings/"
+
+    def test_limit(self):
+        self.save(3)
+        response = self.client.get(self.url, {"limit": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 2)
+        self.assertIsNotNone(response.json()["next"])
+
+    def test_invalid_limit(self):
+        self.save(3)
+        for limit in ("0", "-3", "many", "1001"):
+            with self.subTest(limit=limit):
+                response = self.client.get(self.url, {"limit": limit})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("limit", response.json())
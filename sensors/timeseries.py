@@ -0,0 +1,233 @@
+"""
+Server-side bucketing of readings for the dashboard charts.
+"""
+
+import datetime
+import math
+import operator
+
+import django.conf
+import polars as pl
+from django.db import models
+
+import sensors.compact
+import sensors.models
+
+METRICS = ("temperature", "humidity", "battery", "rssi")
+
+# Bucket widths, in seconds, that a requested number of points is rounded up
+# to, so that the buckets line up with whole minutes, hours and days.
+NICE_BUCKETS = (
+    60,
+    2 * 60,
+    5 * 60,
+    10 * 60,
+    15 * 60,
+    30 * 60,
+    60 * 60,
+    2 * 60 * 60,
+    3 * 60 * 60,
+    6 * 60 * 60,
+    12 * 60 * 60,
+    24 * 60 * 60,
+    7 * 24 * 60 * 60,
+)
+
+MAX_BUCKETS = 10_000
+
+# Decimation reads every raw reading in its range.
+MAX_RAW_RANGE = datetime.timedelta(days=31)
+
+
+class EpochSeconds(models.Func):
+    """
+    Whole seconds since the epoch of a (SQLite) datetime column.
+    """
+
+    function = "strftime"
+    template = "CAST(%(function)s(%(expressions)s) AS INTEGER)"
+    output_field = models.IntegerField()
+
+    def __init__(self, expression, **extra):
+        super().__init__(models.Value("%s"), expression, **extra)
+
+
+def bucket_width(start, end, points):
+    """
+    The bucket width, in seconds, that fits ``start`` to ``end`` into about
+    ``points`` buckets.
+    """
+    width = math.ceil((end - start).total_seconds() / points)
+    for nice in NICE_BUCKETS:
+        if nice >= width:
+            return nice
+    return width
+
+
+def aggregate_readings(owner_id, start, end, bucket, metrics, macs=None):
+    """
+    Partial aggregates of ``metrics`` per device per ``bucket`` seconds for
+    readings in ``[start, end)``.
+
+    Yields dicts with ``mac``, ``bucket`` (epoch seconds), ``count`` and, for
+    each metric, ``<metric>_count``, ``_sum``, ``_min`` and ``_max``, ordered
+    by mac and bucket.
+    """
+    if django.conf.settings.SENSORS_COMPACT_READS:
+        return sensors.compact.aggregate_readings(
+            owner_id, start, end, bucket, metrics, macs=macs
+        )
+    readings = sensors.models.Reading.objects.filter(
+        owner_id=owner_id, timestamp__gte=start, timestamp__lt=end
+    )
+    if macs:
+        readings = readings.filter(mac__in=macs)
+
+    aggregates = {"count": models.Count("id")}
+    for metric in metrics:
+        aggregates[f"{metric}_count"] = models.Count(metric)
+        aggregates[f"{metric}_sum"] = models.Sum(metric)
+        aggregates[f"{metric}_min"] = models.Min(metric)
+        aggregates[f"{metric}_max"] = models.Max(metric)
+
+    bucket = models.Value(bucket)
+    return (
+        readings.annotate(bucket=EpochSeconds("timestamp") / bucket * bucket)
+        .values("mac", "bucket")
+        .annotate(**aggregates)
+        .order_by("mac", "bucket")
+    )
+
+
+def merge_partials(partials, metrics):
+    """
+    Combine partial aggregates that share a mac and bucket, e.g. from rollups
+    and from the raw readings at the edges of a range, ordered by mac and
+    bucket.
+    """
+    merged = {}
+    for partial in partials:
+        key = (partial["mac"], partial["bucket"])
+        current = merged.get(key)
+        if current is None:
+            merged[key] = dict(partial)
+            continue
+        current["count"] += partial["count"]
+        for metric in metrics:
+            current[f"{metric}_count"] += partial[f"{metric}_count"]
+            for part, combine in (("sum", operator.add), ("min", min), ("max", max)):
+                name = f"{metric}_{part}"
+                if current[name] is None:
+                    current[name] = partial[name]
+                elif partial[name] is not None:
+                    current[name] = combine(current[name], partial[name])
+    return [merged[key] for key in sorted(merged)]
+
+
+def summarise(partials, metrics, device_names, format_timestamp):
+    """
+    Shape partial aggregates into the aggregate API response: per device,
+    per bucket, the min, mean and max of each metric.
+    """
+    devices = {}
+    for partial in partials:
+        mac = partial["mac"]
+        device = devices.get(mac)
+        if device is None:
+            device = devices[mac] = {
+                "mac": mac,
+                "device_name": device_names.get(mac),
+                "buckets": [],
+            }
+        summary = {
+            "timestamp": format_timestamp(
+                datetime.datetime.fromtimestamp(
+                    partial["bucket"], tz=datetime.timezone.utc
+                )
+            ),
+            "count": partial["count"],
+        }
+        for metric in metrics:
+            count = partial[f"{metric}_count"]
+            summary[metric] = {
+                "min": partial[f"{metric}_min"],
+                "mean": partial[f"{metric}_sum"] / count if count else None,
+                "max": partial[f"{metric}_max"],
+            }
+        device["buckets"].append(summary)
+    return list(devices.values())
+
+
+def frame_rows(owner_id, start, end, metrics, macs=None):
+    """
+    The query behind ``load_frame``.
+    """
+    readings = sensors.models.Reading.objects.filter(
+        owner_id=owner_id, timestamp__gte=start, timestamp__lt=end
+    )
+    if macs:
+        readings = readings.filter(mac__in=macs)
+    return readings.order_by("mac", "timestamp").values_list(
+        "mac", "timestamp", *metrics
+    )
+
+
+def load_frame(owner_id, start, end, metrics, macs=None):
+    """
+    Readings in ``[start, end)`` as a Polars frame of mac, timestamp and
+    ``metrics``, sorted by mac and timestamp.
+    """
+    if django.conf.settings.SENSORS_COMPACT_READS:
+        rows = sensors.compact.frame_rows(owner_id, start, end, metrics, macs=macs)
+    else:
+        rows = frame_rows(owner_id, start, end, metrics, macs=macs)
+    schema = {"mac": pl.String, "timestamp": pl.Datetime("us", "UTC")}
+    schema.update((metric, pl.Float64) for metric in metrics)
+    return pl.DataFrame(list(rows), schema=schema, orient="row")
+
+
+def decimate(frame, metric, points):
+    """
+    Min/max-preserving decimation of each device's ``metric`` series down to
+    at most ``points`` points.
+
+    Each series is split into ``points // 2`` equal-width time bins and only
+    the lowest and highest reading in each bin is kept, so short spikes (a
+    freezer door left open) survive where averaging would flatten them. So
+    ``points`` must be at least 2.
+    Expects ``frame`` sorted by mac and timestamp, as ``load_frame`` returns
+    it, and keeps that order.
+    """
+    if points < 2:
+        raise ValueError("Decimation needs at least 2 points, a min and a max.")
+    bins = points // 2
+    t = pl.col("timestamp").dt.epoch("ms")
+    t0 = t.min().over("mac")
+    span = t.max().over("mac") - t0 + 1
+    frame = (
+        frame.select("mac", "timestamp", metric)
+        .drop_nulls(metric)
+        .with_row_index("row")
+        .with_columns(bin=(t - t0) * bins // span)
+    )
+    extremes = frame.group_by("mac", "bin").agg(
+        low=pl.col("row").get(pl.col(metric).arg_min()),
+        high=pl.col("row").get(pl.col(metric).arg_max()),
+    )
+    keep = pl.concat([extremes["low"], extremes["high"]])
+    return frame.filter(pl.col("row").is_in(keep.implode())).drop("row", "bin")
+
+
+def decimated_series(frame, metrics, points):
+    """
+    ``{mac: {metric: [(timestamp, value), ...]}}`` with each series decimated
+    to at most ``points`` points.
+    """
+    series = {}
+    for metric in metrics:
+        decimated = decimate(frame, metric, points)
+        for (mac,), group in decimated.group_by("mac", maintain_order=True):
+            series.setdefault(mac, {})[metric] = group.select(
+                "timestamp", metric
+            ).rows()
+    return series
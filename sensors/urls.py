@@ -19,6 +19,7 @@ from django.contrib import admin
 from django.urls import path, include
 import rest_framework.routers
 import sensors.views
+import sensors.async_views
 
 router = rest_framework.routers.DefaultRouter()
 router.register(r"readings", sensors.views.ReadingViewSet)
@@ -29,6 +30,11 @@ urlpatterns = [
     path("", sensors.views.Home.as_view(), name="home"),
     # path("c/", sensors.views.Chart.as_view(), name="chart"),
     path("api/", include(router.urls)),
+    path("api/async/readings/", sensors.async_views.reading_list),
+    path("api/async/readings/aggregate/", sensors.async_views.reading_aggregate),
+    path("api/async/readings/bulk/", sensors.async_views.reading_bulk),
+    path("api/async/readings/stream/", sensors.async_views.reading_stream),
+    path("api/async/devices/latest/", sensors.async_views.device_latest),
     path("api/auth/", include("rest_framework.urls", namespace="rest_framework")),
     # path("test/", sensors.views.Test.as_view(), name="test"),
     path(
@@ -36,4 +42,5 @@ urlpatterns = [
         sensors.views.DownloadParquet.as_view(),
         name="download=parquet",
     ),
+    path("metrics", sensors.views.Metrics.as_view(), name="metrics"),
 ]
@@ -1,11 +1,15 @@
+import datetime
+import math
 import uuid
 import time
 import secrets
+import threading
 import warnings
+from itertools import accumulate
 
 from typing import Final, Callable
 
-__all__ = ["UUIDv7Generator", "uuid7"]
+__all__ = ["UUIDv7Generator", "LockedUUIDv7Generator", "uuid7"]
 
 NS_IN_MS: Final = 10**6
 
@@ -27,6 +31,11 @@ V7_RAND_B_RND_BITS: Final = 62
 # there's a timestamp collision.
 V7_RAND_B_INC_BITS: Final = 31
 
+# generate_many() starts each block from a rand_b with one fewer random bit,
+# leaving 2**61 of headroom for the increments within the block.
+V7_RAND_B_BLOCK_BITS: Final = 61
+V7_RAND_B_LIMIT: Final = 1 << V7_RAND_B_NUM_BITS
+
 
 class UUIDv7Generator:
     prev_rand_a = -1
@@ -68,7 +77,7 @@ class UUIDv7Generator:
             increment = self.randbits_func(V7_RAND_B_INC_BITS) + 1
             rand_b = self.prev_rand_b + increment
 
-            if rand_b >= (1 << (V7_RAND_B_NUM_BITS + 1)) - 1:
+            if rand_b >= V7_RAND_B_LIMIT:
                 # On the average case, we'd have had to increment rand_b over
                 # a billion times (i.e. generate a billion UUIDs without the
                 # clock stepping forward) for this to happen. If it *does*
@@ -103,9 +112,134 @@ class UUIDv7Generator:
 
         return uuid.UUID(int=uuid_int)
 
+    def generate_many(self, n):
+        """
+        Reserve a monotonic block of ``n`` UUIDs with a single clock read and
+        a single random draw.
+
+        Every UUID in the block shares the timestamp (and rand_a) of the first
+        one and steps rand_b forward by a random 31-bit increment, as the
+        per-call generator does when the clock hasn't ticked.
+        """
+        if n <= 0:
+            return []
+
+        unix_time_ms, remainder_ns = divmod(self.unix_time_ns_func(), NS_IN_MS)
+        rand_a = int((remainder_ns / NS_IN_MS) * (2**V7_RAND_A_NUM_BITS))
+
+        if (unix_time_ms, rand_a) > (self.prev_unix_time_ms, self.prev_rand_a):
+            rand_b = self.randbits_func(V7_RAND_B_BLOCK_BITS)
+        else:
+            unix_time_ms = self.prev_unix_time_ms
+            rand_a = self.prev_rand_a
+            rand_b = self.prev_rand_b
+
+        # One draw of 32 bits per UUID; each increment uses the top 31.
+        increments = memoryview(
+            self.randbits_func(32 * n).to_bytes(4 * n, "little")
+        ).cast("I")
+        rand_bs = self._accumulate(rand_b, increments)
+
+        if rand_bs[-1] >= V7_RAND_B_LIMIT:
+            # Not enough room left in rand_b at this timestamp: move on to the
+            # next clock tick rather than sleeping until it arrives, and start
+            # the block again from a fresh rand_b there.
+            rand_a += 1
+            if rand_a == 2**V7_RAND_A_NUM_BITS:
+                rand_a = 0
+                unix_time_ms += 1
+            rand_b = self.randbits_func(V7_RAND_B_BLOCK_BITS)
+            rand_bs = self._accumulate(rand_b, increments)
+
+        prefix = self._pack(unix_time_ms, rand_a, 0)
+        self.prev_uuid_int = prefix | rand_bs[-1]
+        self.prev_unix_time_ms = unix_time_ms
+        self.prev_rand_a = rand_a
+        self.prev_rand_b = rand_bs[-1]
+
+        UUID = uuid.UUID
+        return [UUID(int=prefix | rand_b) for rand_b in rand_bs]
+
+    @staticmethod
+    def _accumulate(rand_b, increments):
+        return list(
+            accumulate(
+                increments,
+                lambda total, inc: total + (inc >> 1) + 1,
+                initial=rand_b,
+            )
+        )[1:]
+
+    @staticmethod
+    def _pack(unix_time_ms, rand_a, rand_b):
+        return (
+            (unix_time_ms << 80)
+            | (V7_VER << 76)
+            | (rand_a << 64)
+            | (V7_VAR << 62)
+            | (rand_b)
+        )
 
-uuid7 = UUIDv7Generator()
+
+class LockedUUIDv7Generator(UUIDv7Generator):
+    """
+    A UUIDv7Generator that can be shared between threads, e.g. by threaded
+    gunicorn workers or the dev server.
+    """
+
+    def __init__(self):
+        # Re-entrant, because __call__ calls itself again on counter overflow.
+        self.lock = threading.RLock()
+
+    def __call__(self):
+        with self.lock:
+            return super().__call__()
+
+    def generate_many(self, n):
+        with self.lock:
+            return super().generate_many(n)
+
+
+uuid7 = LockedUUIDv7Generator()
 
 
 def get_uuid7():
     return uuid7()
+
+
+def get_uuid7_many(n):
+    return uuid7.generate_many(n)
+
+
+def uuid7_floor(when):
+    """
+    The smallest UUIDv7 that could be generated at datetime ``when``: every
+    id generated earlier sorts below it, so an id range stands in for a time
+    range.
+    """
+    unix_time_ms = math.floor(when.timestamp() * 1000)
+    return uuid.UUID(int=UUIDv7Generator._pack(unix_time_ms, 0, 0))
+
+
+def uuid7_at(when):
+    """
+    A random UUIDv7 as if it had been generated at datetime ``when``, for
+    backdated readings.
+    """
+    unix_time_ms = math.floor(when.timestamp() * 1000)
+    return uuid.UUID(
+        int=UUIDv7Generator._pack(
+            unix_time_ms,
+            secrets.randbits(V7_RAND_A_NUM_BITS),
+            secrets.randbits(V7_RAND_B_RND_BITS),
+        )
+    )
+
+
+def uuid7_datetime(value):
+    """
+    When UUIDv7 ``value`` was generated, to the millisecond.
+    """
+    return datetime.datetime.fromtimestamp(
+        (value.int >> 80) / 1000, datetime.timezone.utc
+    )
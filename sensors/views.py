@@ -2,19 +2,37 @@ import django.views
 import django.http
 import django.db
 import django.conf
+import hmac
 import json
-import io
 
+import pyarrow as pa
 import structlog
+import rest_framework.exceptions
 import rest_framework.filters
 import rest_framework.viewsets
 import rest_framework.permissions
+import rest_framework.decorators
+import rest_framework.response
+import rest_framework.status
+import rest_framework.fields
+import rest_framework.settings
 from django.contrib.auth.mixins import LoginRequiredMixin
-import polars as pl
 
 import sensors.serializers
 import sensors.permissions
 import sensors.models
+import sensors.ingest
+import sensors.buffer
+import sensors.caching
+import sensors.compact
+import sensors.conditional
+import sensors.export
+import sensors.metrics
+import sensors.snapshots
+import sensors.pagination
+import sensors.renderers
+import sensors.rollups
+import sensors.timeseries
 from . import filters
 
 logger = structlog.get_logger()
@@ -40,7 +58,13 @@ class ReadingViewSet(rest_framework.viewsets.ModelViewSet):
     queryset = sensors.models.Reading.objects.none()
     serializer_class = sensors.serializers.ReadingSerializer
     filterset_class = filters.Reading
-    ordering_fields = ["timestamp"]
+    pagination_class = sensors.pagination.ReadingPagination
+    renderer_classes = [
+        *rest_framework.settings.api_settings.DEFAULT_RENDERER_CLASSES,
+        sensors.renderers.ArrowRenderer,
+        sensors.renderers.ParquetRenderer,
+    ]
+    ordering_fields = ["timestamp", "id"]
 
     def get_queryset(self):
         """
@@ -48,15 +72,278 @@ class ReadingViewSet(rest_framework.viewsets.ModelViewSet):
         for the currently authenticated user.
         """
         user = self.request.user
-        return sensors.models.Reading.objects.filter(owner=user).order_by("-id")
+        return (
+            sensors.models.Reading.objects.filter(owner=user)
+            .with_device_name()
+            .order_by("-id")
+        )
+
+    fast_list_formats = ("json", "msgpack")
+
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format == "api":
+            # The browsable API's page holds more than the readings.
+            return self.render_list(request, *args, **kwargs)
+        return sensors.conditional.respond(
+            request,
+            request.user.id,
+            lambda: self.render_list(request, *args, **kwargs),
+            closed=sensors.conditional.is_closed(
+                filters.range_end(request.query_params)
+            ),
+            variant=request.accepted_media_type,
+        )
+
+    def render_list(self, request, *args, **kwargs):
+        if getattr(request.accepted_renderer, "columnar", False):
+            return self.columnar_list(request)
+        if (
+            django.conf.settings.SENSORS_FAST_READING_LIST
+            and request.accepted_renderer.format in self.fast_list_formats
+            and self.format_kwarg is None
+        ):
+            return self.fast_list(request)
+        return super().list(request, *args, **kwargs)
+
+    def fast_list(self, request):
+        """
+        List readings from ``values_list`` rows, producing the same data as
+        the serializer without model or serializer instances per row.
+        """
+        rows = sensors.serializers.ReadingRows(request)
+        if django.conf.settings.SENSORS_COMPACT_READS:
+            page = self.compact_page(request, rows.columns)
+            return self.get_paginated_response(rows.to_representation(page))
+        queryset = self.filter_queryset(self.get_queryset())
+        # Cursor pagination reads its position from the rows, so keep the
+        # ordering columns in the query even if they aren't returned.
+        columns = rows.columns + [
+            name for name in ("id", "timestamp") if name not in rows.columns
+        ]
+        page = self.paginate_queryset(queryset.values_list(*columns, named=True))
+        if page is None:
+            return rest_framework.response.Response(
+                rows.to_representation(queryset.values_list(*rows.columns))
+            )
+        return self.get_paginated_response(rows.to_representation(page))
+
+    def columnar_list(self, request):
+        """
+        List readings as an Arrow table built straight from ``values_list``
+        rows, without model or serializer instances. Pagination links go in
+        a ``Link`` header.
+        """
+        schema = sensors.export.API_SCHEMA
+        include = {
+            name
+            for value in request.query_params.getlist("fields")
+            for name in value.split(",")
+        }
+        exclude = {
+            name
+            for value in request.query_params.getlist("fields!")
+            for name in value.split(",")
+        }
+        names = [
+            name
+            for name in schema.names
+            if (not include or name in include) and name not in exclude
+        ]
+        schema = pa.schema([schema.field(name) for name in names])
+
+        if django.conf.settings.SENSORS_COMPACT_READS:
+            rows = self.compact_page(request, names)
+        else:
+            # Cursor pagination reads its position from the rows, so keep the
+            # ordering columns in the query even if they aren't returned.
+            queryset = self.filter_queryset(self.get_queryset())
+            query_names = names + [
+                name for name in ("id", "timestamp") if name not in names
+            ]
+            page = self.paginate_queryset(
+                queryset.values_list(*query_names, named=True)
+            )
+            rows = [row[: len(names)] for row in page]
+        table = sensors.export.to_table(rows, schema=schema)
+        return rest_framework.response.Response(
+            table, headers=self.paginator.get_headers()
+        )
+
+    def compact_page(self, request, columns):
+        """
+        A page of the filtered readings from the compact layout (see
+        ``sensors.compact``), as rows of ``columns`` like ``values_list``
+        gives.
+        """
+        params = filters.Reading(request.query_params, queryset=self.get_queryset())
+        if not params.is_valid():
+            raise rest_framework.exceptions.ValidationError(params.errors)
+        queryset = sensors.compact.filtered(
+            request.user.id, params.form.cleaned_data
+        ).order_by("-id")
+        queryset = rest_framework.filters.OrderingFilter().filter_queryset(
+            request, queryset, self
+        )
+        page = self.paginate_queryset(
+            queryset.values_list(*sensors.compact.COLUMNS, named=True)
+        )
+        return sensors.compact.decode_rows(request.user.id, page, columns)
 
     def get_serializer(self, *args, **kwargs):
         if isinstance(kwargs.get("data"), list):
             kwargs["many"] = True
         return super().get_serializer(*args, **kwargs)
 
+    def create(self, request, *args, **kwargs):
+        if django.conf.settings.SENSORS_INGEST_BUFFER:
+            return self.enqueue(request.data)
+        return super().create(request, *args, **kwargs)
+
+    def enqueue(self, data):
+        """
+        Validate readings (one or a list) and hand them to the ingest buffer,
+        acknowledging with a 202 before they're written.
+        """
+        try:
+            rows = sensors.ingest.validate_readings(
+                data if isinstance(data, list) else [data]
+            )
+        except rest_framework.exceptions.ValidationError as e:
+            if not isinstance(data, list) and isinstance(e.detail, list):
+                raise rest_framework.exceptions.ValidationError(e.detail[0])
+            raise
+        ack = sensors.buffer.get_buffer().submit(self.request.user.id, rows)
+        logger.info("buffered ingest", count=ack["count"])
+        return rest_framework.response.Response(
+            ack, status=rest_framework.status.HTTP_202_ACCEPTED
+        )
+
     def perform_create(self, serializer):
-        serializer.save(owner=self.request.user)
+        with django.db.transaction.atomic():
+            saved = serializer.save(owner=self.request.user)
+            sensors.ingest.update_derived(
+                self.request.user.id, saved if isinstance(saved, list) else [saved]
+            )
+
+    def perform_update(self, serializer):
+        # Rollups can't subtract a reading, so rebuild the days it was and is
+        # in.
+        with django.db.transaction.atomic():
+            before = serializer.instance.timestamp
+            macs = {serializer.instance.mac}
+            reading = serializer.save()
+            sensors.rollups.rebuild_days(reading.owner_id, [before, reading.timestamp])
+            for mac in macs | {reading.mac}:
+                sensors.ingest.refresh_device_state(reading.owner_id, mac)
+            if django.conf.settings.SENSORS_COMPACT_READINGS:
+                sensors.compact.write(reading.owner_id, [reading], replace=True)
+            sensors.models.mark_readings_changed([reading.owner_id])
+
+    def perform_destroy(self, instance):
+        with django.db.transaction.atomic():
+            sensors.models.CompactReading.objects.filter(id=instance.id).delete()
+            instance.delete()
+            sensors.rollups.rebuild_days(instance.owner_id, [instance.timestamp])
+            sensors.ingest.refresh_device_state(instance.owner_id, instance.mac)
+            sensors.models.mark_readings_changed([instance.owner_id])
+
+    @rest_framework.decorators.action(detail=False, methods=["post"])
+    def bulk(self, request):
+        """
+        Fast path for gateways: validate and insert a JSON array of readings
+        in one transaction, and acknowledge with a count and the first and
+        last ids instead of echoing every row back.
+        """
+        if django.conf.settings.SENSORS_INGEST_BUFFER:
+            return self.enqueue(request.data)
+        ack = sensors.ingest.ingest_readings(request.user.id, request.data)
+        logger.info("bulk ingest", count=ack["count"])
+        return rest_framework.response.Response(
+            ack, status=rest_framework.status.HTTP_201_CREATED
+        )
+
+    @rest_framework.decorators.action(detail=False, methods=["get"])
+    def aggregate(self, request):
+        """
+        Per-device min/mean/max of each metric per time bucket, computed in
+        SQL (from the rollups where buckets line up with them), so the
+        payload depends on the number of buckets rather than the number of
+        readings. ``mode=minmax`` returns min/max-decimated raw
+        series instead, for line charts that need to show spikes.
+        """
+        query = sensors.serializers.AggregateQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+
+        def get_response():
+            return rest_framework.response.Response(
+                aggregate_data(request.user.id, query.validated_data)
+            )
+
+        if request.accepted_renderer.format == "api":
+            return get_response()
+        return sensors.conditional.respond(
+            request,
+            request.user.id,
+            get_response,
+            closed=sensors.conditional.is_closed(query.validated_data["end"]),
+            variant=request.accepted_media_type,
+        )
+
+
+def aggregate_data(owner_id, params):
+    """
+    The aggregate endpoint's response for validated
+    ``AggregateQuerySerializer`` data.
+    """
+    timestamp_field = rest_framework.fields.DateTimeField()
+    names = sensors.models.device_names.prefetch(owner_id)
+    response = {
+        "start": timestamp_field.to_representation(params["start"]),
+        "end": timestamp_field.to_representation(params["end"]),
+        "mode": params["mode"],
+        "metrics": params["metrics"],
+    }
+    if params["mode"] == "minmax":
+        series = sensors.caching.decimated_series(
+            owner_id,
+            params["start"],
+            params["end"],
+            params["metrics"],
+            params["points"],
+            macs=params.get("mac"),
+        )
+        response["points"] = params["points"]
+        response["devices"] = [
+            {
+                "mac": mac,
+                "device_name": names.get(mac),
+                "series": {
+                    metric: [
+                        [timestamp_field.to_representation(t), value]
+                        for t, value in points
+                    ]
+                    for metric, points in device_series.items()
+                },
+            }
+            for mac, device_series in series.items()
+        ]
+    else:
+        partials = sensors.caching.aggregate(
+            owner_id,
+            params["start"],
+            params["end"],
+            params["bucket"],
+            params["metrics"],
+            macs=params.get("mac"),
+        )
+        response["bucket"] = params["bucket"]
+        response["devices"] = sensors.timeseries.summarise(
+            partials,
+            params["metrics"],
+            names,
+            timestamp_field.to_representation,
+        )
+    return response
 
 
 class DeviceViewSet(rest_framework.viewsets.ModelViewSet):
@@ -78,6 +365,19 @@ class DeviceViewSet(rest_framework.viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
+    @rest_framework.decorators.action(detail=False, methods=["get"])
+    def latest(self, request):
+        """
+        The latest reading from each of the user's devices.
+        """
+        states = (
+            sensors.models.DeviceState.objects.filter(owner=request.user)
+            .with_device_name()
+            .order_by("mac")
+        )
+        serializer = sensors.serializers.DeviceStateSerializer(states, many=True)
+        return rest_framework.response.Response(serializer.data)
+
 
 class Chart(LoginRequiredMixin, django.views.generic.TemplateView):
     template_name = "chart.html"
@@ -95,30 +395,78 @@ class Test(django.views.generic.TemplateView):
 
 
 class DownloadParquet(LoginRequiredMixin, django.views.View):
+    """
+    Stream the user's readings as a Parquet file, optionally narrowed with
+    the same ``mac``, ``timestamp__gt`` and ``timestamp__lt`` filters as the
+    readings API.
+
+    Unfiltered downloads are served from the owner's snapshot files (see
+    ``export_snapshots``) when there is one, plus any newer readings.
+    """
+
     def get(self, request, *args, **kwargs):
         logger.info("DownloadParquet", args=args, kwargs=kwargs)
-        owner_id = request.user.id.hex
-
-        database_filename = django.conf.settings.DATABASES["default"]["NAME"]
-        uri = f"sqlite://{database_filename}"
-        query = f"SELECT * FROM sensors_reading WHERE owner_id = '{owner_id}'"
-        df = pl.read_database_uri(
-            query=query,
-            uri=uri,
-            schema_overrides={
-                "timestamp": pl.Datetime(time_zone="NZ"),
-            },
-        )
-
-        logger.info(
-            "dataframe created",
-            estimated_size_mb=str(df.estimated_size("mb")),
-            owner_id=owner_id,
-        )
-
-        parquet_file = io.BytesIO()
-        df.write_parquet(parquet_file)
-        parquet_file.seek(0)
-        return django.http.FileResponse(
-            parquet_file, as_attachment=True, filename="readings.parquet"
+        return sensors.conditional.respond(
+            request,
+            request.user.id,
+            lambda: self.download(request),
+            closed=sensors.conditional.is_closed(filters.range_end(request.GET)),
+        )
+
+    def download(self, request):
+        tables = None
+        if not request.GET:
+            tables = sensors.snapshots.snapshot_tables(request.user.id)
+        if tables is not None:
+            return self.parquet_response(sensors.export.stream_parquet(tables))
+
+        readings = filters.Reading(
+            request.GET,
+            queryset=sensors.models.Reading.objects.filter(owner=request.user),
+        )
+        if not readings.is_valid():
+            return django.http.JsonResponse(readings.errors, status=400)
+
+        if django.conf.settings.SENSORS_COMPACT_READS:
+            compact = sensors.compact.filtered(
+                request.user.id, readings.form.cleaned_data
+            )
+            return self.parquet_response(
+                sensors.export.stream_parquet(
+                    sensors.export.to_table(rows)
+                    for rows in sensors.compact.iter_chunks(request.user.id, compact)
+                )
+            )
+        return self.parquet_response(sensors.export.stream_readings(readings.qs))
+
+    def parquet_response(self, content):
+        response = django.http.StreamingHttpResponse(
+            self.counted(content), content_type="application/vnd.apache.parquet"
+        )
+        response["Content-Disposition"] = 'attachment; filename="readings.parquet"'
+        return response
+
+    def counted(self, content):
+        for chunk in content:
+            sensors.metrics.EXPORT_BYTES.inc(len(chunk), format="parquet")
+            yield chunk
+
+
+class Metrics(django.views.View):
+    """
+    Counters and histograms for Prometheus (see ``sensors.metrics``), for a
+    bearer ``SENSORS_METRICS_TOKEN`` or a staff user.
+    """
+
+    def get(self, request):
+        token = django.conf.settings.SENSORS_METRICS_TOKEN
+        authorization = request.headers.get("Authorization", "")
+        if not (
+            (token and hmac.compare_digest(authorization, f"Bearer {token}"))
+            or request.user.is_staff
+        ):
+            return django.http.HttpResponseForbidden()
+        return django.http.HttpResponse(
+            sensors.metrics.exposition(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
         )